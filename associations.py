@@ -0,0 +1,140 @@
+from typing import Dict, Iterable, List, Set
+
+from sqlalchemy import or_, and_, tuple_
+from sqlalchemy.orm import Session, lazyload, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from export import chunks
+from loading import location_option
+from models import DarwinSchedule, DarwinScheduleLocation, DarwinAssociation, DarwinScheduleFormation
+
+
+class AssociationGraph:
+    """Schedules reachable from a set of rids through associations, loaded in bulk, a query per level rather than
+    per association. Relationships of everything loaded are populated from the graph, so serialise() on the root
+    schedules and their calling points doesn't go back to the database"""
+    def __init__(self, session: Session, chunk_size: int=1000):
+        self.session = session
+        self.chunk_size = chunk_size
+        self.roots = []  # type: List[str]
+        self.schedules = {}  # type: Dict[str, DarwinSchedule]
+        self.associations = {}  # type: Dict[tuple, DarwinAssociation]
+        self.locations = {}  # type: Dict[str, Dict[int, DarwinScheduleLocation]]
+        self.levels = {}  # type: Dict[str, int]
+        # Schedules whose associations have been loaded, so whose association lists are complete
+        self._expanded = set()  # type: Set[str]
+
+    def resolve(self, rids: Iterable[str], depth: int=2, locations: bool=True, formation: bool=True) -> Dict[str, DarwinSchedule]:
+        """Load rids and everything within depth associations of them. depth=2 covers DarwinSchedule.serialise(True).
+        If locations, every calling point of the roots is loaded, otherwise only origins and destinations"""
+        self.roots = list(dict.fromkeys(rids))
+        frontier = [a for a in self.roots if a not in self.levels]
+        for rid in frontier:
+            self.levels[rid] = 0
+
+        for level in range(depth):
+            if not frontier:
+                break
+            found = self._load_associations(frontier)
+            # Cycle guard, a schedule is only ever visited at the first level it's reached
+            frontier = [a for a in found if a not in self.levels]
+            for rid in frontier:
+                self.levels[rid] = level + 1
+
+        self._load_schedules(list(self.levels))
+        self._load_locations([a for a in self.roots if a in self.schedules] if locations else [], [a for a in self.levels if a in self.schedules])
+        if formation:
+            self._load_formation([a for a in self.roots if a in self.schedules])
+        self._populate(full_locations=set(self.roots) if locations else set())
+        return {a: self.schedules[a] for a in self.roots if a in self.schedules}
+
+    def _load_associations(self, rids: List[str]) -> List[str]:
+        found = []
+        for chunk in chunks(rids, self.chunk_size):
+            query = self.session.query(DarwinAssociation).options(lazyload("*"))\
+                .filter(or_(DarwinAssociation.main_rid.in_(chunk), DarwinAssociation.assoc_rid.in_(chunk)))
+            for association in query:
+                key = (association.tiploc, association.main_rid, association.main_original_wt, association.assoc_rid, association.assoc_original_wt)
+                if key not in self.associations:
+                    self.associations[key] = association
+                    found.extend((association.main_rid, association.assoc_rid))
+        self._expanded.update(rids)
+        return list(dict.fromkeys(found))
+
+    def _load_schedules(self, rids: List[str]):
+        rids = [a for a in rids if a not in self.schedules]
+        for chunk in chunks(rids, self.chunk_size):
+            for schedule in self.session.query(DarwinSchedule).options(lazyload("*")).filter(DarwinSchedule.rid.in_(chunk)):
+                self.schedules[schedule.rid] = schedule
+
+    def _location_query(self, condition):
+        return self.session.query(DarwinScheduleLocation).options(
+            lazyload("*"),
+            joinedload(DarwinScheduleLocation.status, innerjoin=True),
+            location_option(),
+        ).filter(condition)
+
+    def _load_locations(self, full: List[str], endpoints: List[str]):
+        """Every calling point of full, origins and destinations of endpoints, and both ends of every association"""
+        full_set = set(full)
+        endpoints = [a for a in endpoints if a not in full_set]
+        pairs = list({a for association in self.associations.values() for a in (
+            (association.main_rid, association.main_original_wt), (association.assoc_rid, association.assoc_original_wt)) if a[0] not in full_set})
+
+        conditions = [DarwinScheduleLocation.rid.in_(a) for a in chunks(full, self.chunk_size)]
+        conditions += [and_(DarwinScheduleLocation.rid.in_(a), or_(DarwinScheduleLocation.loc_type.like("%OR"), DarwinScheduleLocation.loc_type.like("%DT")))
+            for a in chunks(endpoints, self.chunk_size)]
+        conditions += [tuple_(DarwinScheduleLocation.rid, DarwinScheduleLocation.original_wt).in_(a) for a in chunks(pairs, self.chunk_size)]
+
+        for condition in conditions:
+            for location in self._location_query(condition):
+                self.locations.setdefault(location.rid, {})[location.index] = location
+
+    def _load_formation(self, rids: List[str]):
+        formations = {a: [] for a in rids}
+        for chunk in chunks(rids, self.chunk_size):
+            for coach in self.session.query(DarwinScheduleFormation).filter(DarwinScheduleFormation.rid.in_(chunk)).order_by(DarwinScheduleFormation.seq):
+                formations[coach.rid].append(coach)
+        for rid, coaches in formations.items():
+            set_committed_value(self.schedules[rid], "formation", coaches)
+
+    def _populate(self, full_locations: Set[str]):
+        to = {}
+        from_ = {}
+        for association in self.associations.values():
+            to.setdefault(association.main_rid, []).append(association)
+            from_.setdefault(association.assoc_rid, []).append(association)
+
+        by_key = {(a.rid, a.original_wt, a.tiploc): a for locations in self.locations.values() for a in locations.values()}
+
+        for association in self.associations.values():
+            for attribute, value in (
+                    ("main_schedule", self.schedules.get(association.main_rid)),
+                    ("assoc_schedule", self.schedules.get(association.assoc_rid)),
+                    ("main_schedule_loc", by_key.get((association.main_rid, association.main_original_wt, association.tiploc))),
+                    ("assoc_schedule_loc", by_key.get((association.assoc_rid, association.assoc_original_wt, association.tiploc)))):
+                if value is not None:
+                    set_committed_value(association, attribute, value)
+
+        for rid, schedule in self.schedules.items():
+            locations = [v for k, v in sorted(self.locations.get(rid, {}).items())]
+            set_committed_value(schedule, "origins_rel", [a for a in locations if a.loc_type.endswith("OR")])
+            set_committed_value(schedule, "destinations_rel", [a for a in locations if a.loc_type.endswith("DT")])
+            if rid in full_locations:
+                set_committed_value(schedule, "locations", locations)
+
+            for location in locations:
+                set_committed_value(location, "schedule", schedule)
+
+            # Only complete if this schedule's associations were queried, otherwise left to lazy load
+            if rid in self._expanded:
+                set_committed_value(schedule, "associated_to", to.get(rid, []))
+                set_committed_value(schedule, "associated_from", from_.get(rid, []))
+                for location in locations:
+                    set_committed_value(location, "associated_to", [a for a in to.get(rid, []) if a.main_original_wt == location.original_wt])
+                    set_committed_value(location, "associated_from", [a for a in from_.get(rid, []) if a.assoc_original_wt == location.original_wt])
+
+
+def resolve(session: Session, rids: Iterable[str], depth: int=2, locations: bool=True, formation: bool=True) -> Dict[str, DarwinSchedule]:
+    """Schedules by rid, with their association closure resolved to depth, see AssociationGraph"""
+    return AssociationGraph(session).resolve(rids, depth, locations, formation)
@@ -0,0 +1,54 @@
+import datetime
+from typing import Iterable, List, Optional, Union
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from board import board_filters, board_options, board_time
+from loading import profile_options
+from messages import station_filters
+from models import DarwinSchedule, DarwinScheduleLocation, DarwinMessage
+
+# Async equivalents of the common read paths. Lazy loading can't happen under asyncio, so everything a result is
+# serialised with has to be loaded up front, by a loading profile or the board options, and anything else raises
+
+
+def async_session_factory(url: str, **engine_kwargs) -> sessionmaker:
+    """For example async_session_factory("postgresql+asyncpg://localhost/swallow"). Sessions don't expire on commit,
+    as expired attributes would need to lazy load"""
+    engine = create_async_engine(url, **engine_kwargs)
+    return sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def get_schedule(session: AsyncSession, rid: str, profile: str="full-service") -> Optional[DarwinSchedule]:
+    result = await session.execute(select(DarwinSchedule)
+        .where(DarwinSchedule.rid == rid)
+        .options(*profile_options(DarwinSchedule, profile)))
+    return result.scalars().first()
+
+
+async def get_schedule_by_uid(session: AsyncSession, uid: str, ssd: datetime.date, profile: str="full-service") -> Optional[DarwinSchedule]:
+    result = await session.execute(select(DarwinSchedule)
+        .where(DarwinSchedule.uid == uid, DarwinSchedule.ssd == ssd)
+        .options(*profile_options(DarwinSchedule, profile)))
+    return result.scalars().first()
+
+
+async def get_board(session: AsyncSession, code: str, start: datetime.datetime, end: datetime.datetime, passes: bool=False, partitioned: bool=False) -> List[DarwinScheduleLocation]:
+    """board.get_board"""
+    result = await session.execute(select(DarwinScheduleLocation)
+        .join(DarwinScheduleLocation.location)
+        .join(DarwinScheduleLocation.schedule)
+        .where(*board_filters(code, start, end, passes, partitioned))
+        .options(*board_options())
+        .order_by(board_time(), DarwinScheduleLocation.rid))
+    return result.scalars().all()
+
+
+async def get_station_messages(session: AsyncSession, crs: Union[str, Iterable[str]], min_severity: Optional[int]=None, max_severity: Optional[int]=None,
+        suppressed: bool=False) -> List[DarwinMessage]:
+    result = await session.execute(select(DarwinMessage)
+        .where(*station_filters(crs, min_severity, max_severity, suppressed))
+        .order_by(DarwinMessage.severity.desc(), DarwinMessage.message_id))
+    return result.scalars().all()
@@ -0,0 +1,181 @@
+"""Benchmarks of the hot paths against synthetic data (see synthetic.py), appended to a results file and compared with
+the previous run of the same dataset, so that regressions between versions show up.
+Usage: python bench.py postgresql://localhost/swallow_bench [results file] [days] [schedules per day] [seed]"""
+import datetime
+import json
+import statistics
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import sqlalchemy
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+import associations
+import export
+import loading
+import synthetic
+from board import get_board
+from instrumentation import Instrumentation
+from models import DarwinSchedule, DarwinScheduleLocation, DarwinAssociation, DarwinLocation
+
+START = datetime.date(2026, 1, 5)
+# A case is a regression if it's this much slower than last time, or issues more statements at all
+SLOWER = 0.2
+
+
+def version() -> str:
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Suite:
+    def __init__(self, engine, repeat: int=5, sample: int=20):
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine)
+        self.repeat = repeat
+        self.sample = sample
+        self.instrumentation = Instrumentation()
+        self.instrumentation.attach(engine)
+        self.results = OrderedDict()
+
+    def measure(self, name: str, body: Callable[[], int]):
+        """Median seconds of repeat runs of body, and statements and items (body's return value) per run"""
+        seconds = []
+        for _ in range(self.repeat):
+            with self.instrumentation.operation(name) as operation:
+                items = body()
+            seconds.append(operation.seconds)
+        self.results[name] = OrderedDict([("seconds", statistics.median(seconds)), ("statements", operation.statements), ("items", items)])
+
+    def ingest(self, generator: synthetic.Generator, days: int):
+        begin = time.perf_counter()
+        counts = synthetic.load(self.engine, generator, START, days)
+        seconds = time.perf_counter() - begin
+        self.results["ingest"] = OrderedDict([("seconds", seconds), ("statements", None), ("items", counts["schedule_rows"]),
+            ("rows_per_second", counts["schedule_rows"]/seconds)])
+
+    def busiest_stations(self) -> List[str]:
+        with self.engine.connect() as connection:
+            return [a for (a,) in connection.execute(select([DarwinLocation.crs_darwin])
+                .select_from(DarwinScheduleLocation.__table__.join(DarwinLocation.__table__))
+                .group_by(DarwinLocation.crs_darwin).order_by(func.count().desc()).limit(self.sample))]
+
+    def longest_services(self) -> List[str]:
+        with self.engine.connect() as connection:
+            return [a for (a,) in connection.execute(select([DarwinScheduleLocation.rid])
+                .group_by(DarwinScheduleLocation.rid).order_by(func.count().desc(), DarwinScheduleLocation.rid).limit(self.sample))]
+
+    def most_associated(self) -> List[str]:
+        with self.engine.connect() as connection:
+            return [a for (a,) in connection.execute(select([DarwinAssociation.main_rid])
+                .group_by(DarwinAssociation.main_rid).order_by(func.count().desc(), DarwinAssociation.main_rid).limit(self.sample))]
+
+    def boards(self):
+        stations = self.busiest_stations()
+        start = datetime.datetime.combine(START, datetime.time(7, 30))
+        end = start + datetime.timedelta(hours=2)
+
+        def body():
+            session = self.Session()
+            rows = 0
+            for crs in stations:
+                board = get_board(session, crs, start, end)
+                [a.serialise(True) for a in board]
+                rows += len(board)
+            session.close()
+            return rows
+        self.measure("boards", body)
+
+    def serialise_orm(self, name: str, rids: List[str]):
+        def body():
+            session = self.Session()
+            schedules = loading.with_profile(session.query(DarwinSchedule).filter(DarwinSchedule.rid.in_(rids)), "full-service").all()
+            [a.serialise(True) for a in schedules]
+            session.close()
+            return len(schedules)
+        self.measure(name, body)
+
+    def serialise_export(self, name: str, rids: List[str]):
+        def body():
+            with self.engine.connect() as connection:
+                return len(list(export.iter_schedules(connection, DarwinSchedule.__table__.c.rid.in_(rids), recurse=True)))
+        self.measure(name, body)
+
+    def serialise_resolved(self, name: str, rids: List[str]):
+        def body():
+            session = self.Session()
+            schedules = associations.resolve(session, rids)
+            [a.serialise(True) for a in schedules.values()]
+            session.close()
+            return len(schedules)
+        self.measure(name, body)
+
+    def run(self, generator: synthetic.Generator, days: int) -> OrderedDict:
+        self.ingest(generator, days)
+        self.boards()
+        long = self.longest_services()
+        self.serialise_orm("long_services_orm", long)
+        self.serialise_export("long_services_export", long)
+        associated = self.most_associated()
+        self.serialise_orm("associated_services_orm", associated)
+        self.serialise_resolved("associated_services_resolved", associated)
+        return self.results
+
+
+def compare(previous: Optional[dict], current: dict) -> List[str]:
+    """Regressions of current against previous, as readable lines"""
+    if previous is None:
+        return []
+    out = []
+    for name, result in current["results"].items():
+        before = previous["results"].get(name)
+        if before is None:
+            continue
+        if result["seconds"] > before["seconds"]*(1+SLOWER):
+            out.append("{}: {:.1f}ms, was {:.1f}ms at {}".format(name, result["seconds"]*1000, before["seconds"]*1000, previous["version"]))
+        if result["statements"] is not None and before["statements"] is not None and result["statements"] > before["statements"]:
+            out.append("{}: {} statements, was {} at {}".format(name, result["statements"], before["statements"], previous["version"]))
+    return out
+
+
+def previous_run(path: str, dataset: Dict) -> Optional[dict]:
+    """The last stored run of the same dataset"""
+    last = None
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    run = json.loads(line)
+                    if run["dataset"] == dataset:
+                        last = run
+    except FileNotFoundError:
+        pass
+    return last
+
+
+if __name__ == "__main__":
+    engine = sqlalchemy.create_engine(sys.argv[1])
+    path = sys.argv[2] if len(sys.argv) > 2 else "bench_results.jsonl"
+    days = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    per_day = int(sys.argv[4]) if len(sys.argv) > 4 else 5000
+    seed = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+    dataset = OrderedDict([("seed", seed), ("days", days), ("schedules_per_day", per_day)])
+
+    results = Suite(engine).run(synthetic.Generator(seed, schedules_per_day=per_day), days)
+    run = OrderedDict([("version", version()), ("time", datetime.datetime.utcnow().isoformat()), ("dataset", dataset), ("results", results)])
+    regressions = compare(previous_run(path, dataset), run)
+    with open(path, "a") as f:
+        f.write(json.dumps(run) + "\n")
+
+    print("{:<30} {:>10} {:>10} {:>8}".format("case", "ms", "statements", "items"))
+    for name, result in results.items():
+        print("{:<30} {:>10.1f} {:>10} {:>8}".format(name, result["seconds"]*1000, "-" if result["statements"] is None else result["statements"], result["items"]))
+    for line in regressions:
+        print("REGRESSION " + line)
+    sys.exit(1 if regressions else 0)
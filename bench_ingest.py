@@ -0,0 +1,62 @@
+"""Ingestion throughput of ingest.BulkWriter against a scratch database.
+Usage: python bench_ingest.py postgresql://localhost/swallow_bench [schedules] [batch size]"""
+import datetime
+import sys
+import time
+
+import sqlalchemy
+
+import models
+from ingest import BulkWriter, ScheduleBatch
+
+
+def synthetic_batches(schedules: int, batch_size: int, ssd: datetime.date, tiplocs=("PADTON", "RDNGSTN", "DIDCOTP", "SDON", "CHPNHAM", "BATHSPA", "BRSTLTM")):
+    batch = ScheduleBatch([], [], [], [], [])
+    start = datetime.datetime.combine(ssd, datetime.time(5))
+    for i in range(schedules):
+        rid = "{:%Y%m%d}{:07d}".format(ssd, i)
+        base = start + datetime.timedelta(minutes=i % 1080)
+        batch.schedules.append(dict(uid="Z{:05d}".format(i % 100000), rid=rid, ssd=ssd, signalling_id="1Z{:02d}".format(i % 100),
+            status="P", category="XX", operator_id="ZZ", is_active=True, is_passenger=True, origins=[], destinations=[]))
+        for index, tiploc in enumerate(tiplocs):
+            wt = base + datetime.timedelta(minutes=15*index)
+            original_wt = wt.strftime("%H:%M:%S")
+            first, last = index == 0, index == len(tiplocs)-1
+            batch.locations.append(dict(rid=rid, index=index, loc_type="OR" if first else "DT" if last else "IP", tiploc=tiploc, activity="T",
+                original_wt=original_wt, wta=None if first else wt, pta=None if first else wt, wtd=None if last else wt, ptd=None if last else wt))
+            batch.statuses.append(dict(rid=rid, tiploc=tiploc, original_wt=original_wt, ta_delayed=False, tp_delayed=False, td_delayed=False,
+                td=None if last else (wt + datetime.timedelta(minutes=1)).time(), td_type=None if last else "E", plat=str(index)))
+        batch.formations.extend(dict(rid=rid, fid=rid + "-01", seq=a, coach_number=str(a+1), coach_class="Standard", toilet_type="None") for a in range(4))
+
+        if len(batch.schedules) == batch_size:
+            yield batch
+            batch = ScheduleBatch([], [], [], [], [])
+    if batch.schedules:
+        yield batch
+
+
+def prepare(engine, tiplocs=("PADTON", "RDNGSTN", "DIDCOTP", "SDON", "CHPNHAM", "BATHSPA", "BRSTLTM")):
+    models.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("TRUNCATE darwin_formations, darwin_schedule_status, darwin_associations, darwin_schedule_locations, darwin_schedules CASCADE"))
+        connection.execute(sqlalchemy.text("INSERT INTO darwin_operators (operator, operator_name) VALUES ('ZZ', 'Benchmark') ON CONFLICT DO NOTHING"))
+        for tiploc in tiplocs:
+            connection.execute(sqlalchemy.text("INSERT INTO darwin_locations (tiploc) VALUES (:t) ON CONFLICT DO NOTHING"), t=tiploc)
+
+
+def run(engine, method: str, schedules: int, batch_size: int) -> float:
+    prepare(engine)
+    writer = BulkWriter(engine, method=method)
+    batches = list(synthetic_batches(schedules, batch_size, datetime.date(2026, 1, 1)))
+    begin = time.perf_counter()
+    rows = sum(writer.write(batch, sequence=i) for i, batch in enumerate(batches))
+    elapsed = time.perf_counter() - begin
+    return rows/elapsed
+
+
+if __name__ == "__main__":
+    engine = sqlalchemy.create_engine(sys.argv[1])
+    schedules = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    for method in ("copy", "upsert"):
+        print("{:<8} {:>10.0f} rows/s".format(method, run(engine, method, schedules, batch_size)))
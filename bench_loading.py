@@ -0,0 +1,57 @@
+"""Statements, rows transferred and wall time of each loading profile, against a populated database.
+Usage: python bench_loading.py postgresql://localhost/swallow [schedules]"""
+import sys
+import time
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+import loading
+from models import DarwinSchedule, DarwinScheduleLocation
+
+# Whether each profile's results are serialised, and how, so the comparison includes what it saves later on
+SERIALISE = {
+    "summary": None,
+    "board": lambda a: a.serialise(isinstance(a, DarwinScheduleLocation)),
+    "full-service": lambda a: a.serialise(True),
+    None: lambda a: a.serialise(True),
+}
+
+
+class Counter:
+    def __init__(self, engine):
+        self.statements = 0
+        self.rows = 0
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+        self.rows += max(cursor.rowcount, 0)
+
+
+def run(Session, counter: Counter, entity, profile, limit: int):
+    session = Session()
+    counter.statements = counter.rows = 0
+    begin = time.perf_counter()
+    query = session.query(entity).limit(limit)
+    if profile:
+        query = loading.with_profile(query, profile)
+    results = query.all()
+    if SERIALISE[profile]:
+        [SERIALISE[profile](a) for a in results]
+    elapsed = time.perf_counter() - begin
+    session.close()
+    return counter.statements, counter.rows, elapsed
+
+
+if __name__ == "__main__":
+    engine = sqlalchemy.create_engine(sys.argv[1])
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    Session = sessionmaker(bind=engine)
+    counter = Counter(engine)
+    print("{:<24} {:<14} {:>10} {:>10} {:>10}".format("entity", "profile", "statements", "rows", "ms"))
+    for entity in (DarwinSchedule, DarwinScheduleLocation):
+        for profile in [None] + loading.profile_names(entity):
+            statements, rows, elapsed = run(Session, counter, entity, profile, limit)
+            print("{:<24} {:<14} {:>10} {:>10} {:>10.1f}".format(entity.__name__, profile or "default", statements, rows, elapsed*1000))
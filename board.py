@@ -0,0 +1,54 @@
+import datetime
+from typing import List
+
+from sqlalchemy import or_, and_, func
+from sqlalchemy.orm import Session, contains_eager
+
+from loading import location_option, serialised_location_options
+from partitioning import ssd_window
+from models import DarwinLocation, DarwinSchedule, DarwinScheduleLocation
+
+
+def board_options() -> list:
+    """Loader options so that DarwinScheduleLocation.serialise(True) on board rows doesn't lazy load"""
+    return serialised_location_options(location_option(joined=True), contains_eager(DarwinScheduleLocation.schedule))
+
+
+def board_time():
+    """The time a calling point is sorted by on a board, departure first"""
+    return func.coalesce(DarwinScheduleLocation.wtd, DarwinScheduleLocation.wta, DarwinScheduleLocation.wtp)
+
+
+def board_filters(code: str, start: datetime.datetime, end: datetime.datetime, passes: bool=False, partitioned: bool=False) -> list:
+    """Criteria for a board query, which must join DarwinScheduleLocation.location and DarwinScheduleLocation.schedule"""
+    if len(code) == 3:
+        location_filter = DarwinLocation.crs_darwin == code
+    else:
+        location_filter = DarwinLocation.tiploc == code
+
+    # Each of these has its own index, so keep them separate rather than filtering on board_time()
+    time_filters = [
+        and_(DarwinScheduleLocation.wtd >= start, DarwinScheduleLocation.wtd < end),
+        and_(DarwinScheduleLocation.wta >= start, DarwinScheduleLocation.wta < end),
+    ]
+    if passes:
+        time_filters.append(and_(DarwinScheduleLocation.wtp >= start, DarwinScheduleLocation.wtp < end))
+
+    filters = [location_filter, or_(*time_filters)]
+    if partitioned:
+        first_ssd, last_ssd = ssd_window(start, end)
+        filters += [DarwinScheduleLocation.ssd.between(first_ssd, last_ssd), DarwinSchedule.ssd.between(first_ssd, last_ssd)]
+    return filters
+
+
+def get_board(session: Session, code: str, start: datetime.datetime, end: datetime.datetime, passes: bool=False, partitioned: bool=False) -> List[DarwinScheduleLocation]:
+    """Calling points at a CRS (three characters) or TIPLOC with a working time in [start, end), in board order.
+    The query count is fixed regardless of the number of rows, so serialise(True) may be called freely on the result.
+    If partitioned, calling points are also filtered on ssd so that only the relevant partitions are scanned"""
+    return session.query(DarwinScheduleLocation)\
+        .join(DarwinScheduleLocation.location)\
+        .join(DarwinScheduleLocation.schedule)\
+        .filter(*board_filters(code, start, end, passes, partitioned))\
+        .options(*board_options())\
+        .order_by(board_time(), DarwinScheduleLocation.rid)\
+        .all()
@@ -0,0 +1,261 @@
+from collections import OrderedDict
+import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import MetaData, Table, Column, Index, CHAR, VARCHAR, SMALLINT, DATE, BOOLEAN, TIMESTAMP, select, and_, or_, inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+import darwin_time
+import writes
+from export import LOCATION_COLUMNS, LOCATION_FROM, chunks
+from models import DarwinSchedule, DarwinScheduleLocation, DarwinAssociation
+
+# Optional read model for boards: one flat row per calling point, with times already resolved and the service's
+# origin and destination names copied in, so that a board is a range scan of one index. Rows are rebuilt per rid
+# whenever anything they're derived from is written, through BulkWriter or an ORM session, see BoardMaintainer
+
+metadata = MetaData()
+
+board_rows = Table("darwin_board_rows", metadata,
+    Column("rid", CHAR(15), primary_key=True),
+    Column("index", SMALLINT, primary_key=True),
+    Column("ssd", DATE, nullable=False),
+    Column("crs", VARCHAR(3)),
+    Column("tiploc", VARCHAR(7), nullable=False),
+    # coalesce(wtd, wta, wtp), as board.board_time()
+    Column("sort_time", TIMESTAMP, nullable=False),
+    Column("type", VARCHAR(4), nullable=False),
+    Column("activity", VARCHAR(12), nullable=False),
+    Column("uid", VARCHAR(7), nullable=False),
+    Column("rsid", CHAR(8)),
+    Column("signalling_id", CHAR(4), nullable=False),
+    Column("operator", CHAR(2), nullable=False),
+    Column("category", CHAR(2), nullable=False),
+    Column("is_passenger", BOOLEAN, nullable=False),
+    Column("cancelled", BOOLEAN, nullable=False),
+    Column("pta", TIMESTAMP),
+    Column("wta", TIMESTAMP),
+    Column("wtp", TIMESTAMP),
+    Column("ptd", TIMESTAMP),
+    Column("wtd", TIMESTAMP),
+    # Estimated or actual, resolved against the working time across midnight
+    Column("ta", TIMESTAMP),
+    Column("tp", TIMESTAMP),
+    Column("td", TIMESTAMP),
+    Column("ta_type", VARCHAR(1)),
+    Column("tp_type", VARCHAR(1)),
+    Column("td_type", VARCHAR(1)),
+    Column("plat", VARCHAR),
+    Column("plat_suppressed", BOOLEAN),
+    Column("plat_confirmed", BOOLEAN),
+    Column("length", SMALLINT),
+    Column("origins", postgresql.ARRAY(VARCHAR), nullable=False),
+    Column("destinations", postgresql.ARRAY(VARCHAR), nullable=False),
+    Index("ix_darwin_board_rows_crs_sort_time", "crs", "sort_time"),
+    Index("ix_darwin_board_rows_tiploc_sort_time", "tiploc", "sort_time"),
+)
+
+_schedules = DarwinSchedule.__table__
+_locations = DarwinScheduleLocation.__table__
+_associations = DarwinAssociation.__table__
+
+_SCHEDULE_COLUMNS = [_schedules.c[a] for a in ("rid", "ssd", "uid", "rsid", "signalling_id", "operator", "category", "is_passenger")]
+
+
+def create(engine):
+    metadata.create_all(engine)
+
+
+def _associated(connection: Connection, rids: List[str]) -> Set[str]:
+    """Schedules whose origins or destinations include some of rids' through an association"""
+    out = set()
+    for chunk in chunks(rids, 1000):
+        out.update(a for row in connection.execute(select([_associations.c.main_rid, _associations.c.assoc_rid])
+            .where(or_(_associations.c.main_rid.in_(chunk), _associations.c.assoc_rid.in_(chunk)))) for a in row)
+    return out
+
+
+def _endpoint_names(location_rows: List, suffix: str) -> List[str]:
+    return [a.name_short or a.tiploc for a in location_rows if a.type.endswith(suffix)]
+
+
+def build_rows(connection: Connection, rids: List[str]) -> List[dict]:
+    """darwin_board_rows rows for rids, from the schedule tables"""
+    schedules = {}
+    for chunk in chunks(rids, 1000):
+        schedules.update((a.rid, a) for a in connection.execute(select(_SCHEDULE_COLUMNS).where(_schedules.c.rid.in_(chunk))))
+    locations = {}
+    for chunk in chunks(list(schedules), 1000):
+        for row in connection.execute(select(LOCATION_COLUMNS).select_from(LOCATION_FROM).where(_locations.c.rid.in_(chunk)).order_by(_locations.c.rid, _locations.c.index)):
+            locations.setdefault(row.rid, []).append(row)
+
+    # As DarwinSchedule.get_origins() and get_destinations(), origins of services joining and destinations of dividing ones
+    origins = {a: _endpoint_names(b, "OR") for a, b in locations.items()}
+    destinations = {a: _endpoint_names(b, "DT") for a, b in locations.items()}
+    other = {}
+    for chunk in chunks(list(schedules), 1000):
+        for row in connection.execute(select([_associations]).where(_associations.c.category != "NP")
+                .where(or_(_associations.c.main_rid.in_(chunk), _associations.c.assoc_rid.in_(chunk)))):
+            other.setdefault(row.assoc_rid, ([], []))[0].append(row.main_rid)
+            other.setdefault(row.main_rid, ([], []))[1].append(row.assoc_rid)
+    missing = [a for pair in other.values() for b in pair for a in b if a not in locations]
+    for chunk in chunks(list(dict.fromkeys(missing)), 1000):
+        for row in connection.execute(select(LOCATION_COLUMNS).select_from(LOCATION_FROM).where(_locations.c.rid.in_(chunk))
+                .where(or_(_locations.c.type.like("%OR"), _locations.c.type.like("%DT"))).order_by(_locations.c.rid, _locations.c.index)):
+            locations.setdefault(row.rid, []).append(row)
+
+    out = []
+    for rid, schedule in schedules.items():
+        rows = locations.get(rid, [])
+        from_, to = other.get(rid, ((), ()))
+        schedule_origins = origins.get(rid, []) + [a for main in from_ for a in _endpoint_names(locations.get(main, []), "OR")]
+        schedule_destinations = destinations.get(rid, []) + [a for assoc in to for a in _endpoint_names(locations.get(assoc, []), "DT")]
+        resolved = [darwin_time.combine_many([getattr(a, working) for a in rows], [getattr(a, darwin) for a in rows])
+            for working, darwin in (("wta", "ta"), ("wtp", "tp"), ("wtd", "td"))]
+        for i, row in enumerate(rows):
+            sort_time = row.wtd or row.wta or row.wtp
+            if sort_time is None:
+                continue
+            out.append(dict(rid=rid, index=row.index, ssd=schedule.ssd, crs=row.crs_darwin, tiploc=row.tiploc, sort_time=sort_time,
+                type=row.type, activity=row.activity, uid=schedule.uid, rsid=schedule.rsid, signalling_id=schedule.signalling_id,
+                operator=schedule.operator, category=schedule.category, is_passenger=schedule.is_passenger, cancelled=row.cancelled,
+                pta=row.pta, wta=row.wta, wtp=row.wtp, ptd=row.ptd, wtd=row.wtd, ta=resolved[0][i], tp=resolved[1][i], td=resolved[2][i],
+                ta_type=row.ta_type, tp_type=row.tp_type, td_type=row.td_type, plat=row.plat, plat_suppressed=row.plat_suppressed,
+                plat_confirmed=row.plat_confirmed, length=row.length, origins=schedule_origins, destinations=schedule_destinations))
+    return out
+
+
+def refresh(connection: Connection, rids: Iterable[str], propagate: bool=True) -> int:
+    """Rebuild the rows of rids, and if propagate, of services associated with them, whose origins or destinations
+    may come from rids. Rows of rids no longer in the schedule tables are removed. Returns rows written"""
+    rids = list(dict.fromkeys(rids))
+    if propagate and rids:
+        rids = list(dict.fromkeys(rids + sorted(_associated(connection, rids))))
+    for chunk in chunks(rids, 1000):
+        connection.execute(board_rows.delete().where(board_rows.c.rid.in_(chunk)))
+    rows = build_rows(connection, rids)
+    if rows:
+        connection.execute(board_rows.insert(), rows)
+    return len(rows)
+
+
+def rebuild(connection: Connection, ssd: Optional[datetime.date]=None, chunk_size: int=1000) -> int:
+    """Rebuild every row, or those of one service date, such as after reference data changes the CRS of a tiploc"""
+    query = select([_schedules.c.rid])
+    if ssd is not None:
+        query = query.where(_schedules.c.ssd == ssd)
+    rids = [a for (a,) in connection.execute(query)]
+    connection.execute(board_rows.delete() if ssd is None else board_rows.delete().where(board_rows.c.ssd == ssd))
+    written = 0
+    for chunk in chunks(rids, chunk_size):
+        rows = build_rows(connection, chunk)
+        if rows:
+            connection.execute(board_rows.insert(), rows)
+        written += len(rows)
+    return written
+
+
+def _exists(connection: Connection) -> bool:
+    return inspect(connection).has_table(board_rows.name)
+
+
+def drop_day(connection: Connection, ssd: datetime.date) -> int:
+    """Delete the rows of a service date, if there's a darwin_board_rows table. Returns rows deleted"""
+    if not _exists(connection):
+        return 0
+    return connection.execute(board_rows.delete().where(board_rows.c.ssd == ssd)).rowcount
+
+
+def drop_before(connection: Connection, ssd: datetime.date) -> int:
+    """Retention: delete the rows of every service date before ssd, if there's a darwin_board_rows table"""
+    if not _exists(connection):
+        return 0
+    return connection.execute(board_rows.delete().where(board_rows.c.ssd < ssd)).rowcount
+
+
+def board_filters(code: str, start: datetime.datetime, end: datetime.datetime, passes: bool=False) -> list:
+    """As board.board_filters(), on darwin_board_rows"""
+    filters = [board_rows.c.crs == code if len(code) == 3 else board_rows.c.tiploc == code,
+        board_rows.c.sort_time >= start, board_rows.c.sort_time < end]
+    if not passes:
+        filters.append(or_(board_rows.c.wta != None, board_rows.c.wtd != None))
+    return filters
+
+
+def get_board(connection: Connection, code: str, start: datetime.datetime, end: datetime.datetime, passes: bool=False) -> List:
+    """Board rows at a CRS (three characters) or TIPLOC, in board order. One statement, on one index"""
+    return connection.execute(select([board_rows]).where(and_(*board_filters(code, start, end, passes)))
+        .order_by(board_rows.c.sort_time, board_rows.c.rid)).fetchall()
+
+
+def serialise_row(row) -> OrderedDict:
+    """A board row for presumed JSON, times grouped as in DarwinScheduleLocation.serialise()"""
+    return OrderedDict([
+        ("rid", row.rid),
+        ("uid", row.uid),
+        ("rsid", row.rsid),
+        ("ssd", row.ssd),
+        ("signalling_id", row.signalling_id),
+        ("operator", row.operator),
+        ("category", row.category),
+        ("is_passenger", row.is_passenger),
+        ("tiploc", row.tiploc),
+        ("crs_darwin", row.crs),
+        ("type", row.type),
+        ("activity", row.activity),
+        ("cancelled", row.cancelled),
+        ("length", row.length),
+        ("times", OrderedDict([
+            ("arrival", darwin_time.times_dict(row.wta, row.pta, row.ta, row.ta_type)),
+            ("pass", darwin_time.times_dict(row.wtp, None, row.tp, row.tp_type)),
+            ("departure", darwin_time.times_dict(row.wtd, row.ptd, row.td, row.td_type)),
+        ])),
+        ("platform", OrderedDict([
+            ("platform", row.plat),
+            ("suppressed", row.plat_suppressed),
+            ("confirmed", row.plat_confirmed),
+        ])),
+        ("origins", row.origins),
+        ("destinations", row.destinations),
+    ])
+
+
+def _written_rids(written: Dict[str, Set[str]]) -> Set[str]:
+    # Associations have both their schedules' origins and destinations, so rows of either side
+    return (written.get("schedules", set()) | written.get("locations", set()) | written.get("statuses", set())
+        | written.get("associations", set()))
+
+
+class BoardMaintainer:
+    """Keeps darwin_board_rows up to date with writes, in the same transaction as them"""
+    def __init__(self, propagate: bool=True):
+        self.propagate = propagate
+        self._writers = []
+        self._sessions = []
+
+    def _after_write(self, connection: Connection, written: Dict[str, Set[str]]):
+        rids = _written_rids(written)
+        if rids:
+            refresh(connection, sorted(rids), self.propagate)
+
+    def _after_flush(self, session: Session, written: Dict[str, Set[str]]):
+        self._after_write(session.connection(), written)
+
+    def attach(self, writer=None, sessions=None):
+        """Follow writes through writer, an ingest.BulkWriter, and/or sessions, a Session class, sessionmaker or session"""
+        if writer is not None:
+            writer.listeners.append(self._after_write)
+            self._writers.append(writer)
+        if sessions is not None:
+            writes.session_writes(sessions).subscribe(self._after_flush)
+            self._sessions.append(sessions)
+
+    def detach(self):
+        for writer in self._writers:
+            writer.listeners.remove(self._after_write)
+        for sessions in self._sessions:
+            writes.session_writes(sessions).unsubscribe(self._after_flush)
+        self._writers = []
+        self._sessions = []
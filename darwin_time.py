@@ -0,0 +1,107 @@
+from collections import OrderedDict
+import datetime
+from typing import Optional, Sequence, List, Iterable
+
+# Thresholds of _combine_darwin_time, in seconds rather than decimal hours
+MIDNIGHT_FORWARD = -6*3600
+MIDNIGHT_BACKWARD = 18*3600
+
+_DAY = datetime.timedelta(days=1)
+
+# Attribute names used by complete_times_dict, in output order
+TIME_KINDS = (
+    ("arrival", "wta", "pta", "ta", "ta_type"),
+    ("pass", "wtp", None, "tp", "tp_type"),
+    ("departure", "wtd", "ptd", "td", "td_type"),
+)
+
+
+def time_seconds(t) -> int:
+    """Seconds since midnight of a time or datetime, ignoring microseconds"""
+    return t.hour*3600 + t.minute*60 + t.second
+
+
+def ssd_offset(working_seconds: int, darwin_seconds: int) -> int:
+    """Day offset of a darwin time relative to the working time it's attached to"""
+    difference = darwin_seconds - working_seconds
+    # Crossed midnight, increment ssd offset
+    if difference < MIDNIGHT_FORWARD:
+        return +1
+    # Back in time, crossed midnight (in reverse), decrement ssd offset
+    elif difference > MIDNIGHT_BACKWARD:
+        return -1
+    return 0
+
+
+def combine(working_time: datetime.datetime, darwin_time: datetime.time) -> Optional[datetime.datetime]:
+    """Integer equivalent of models._combine_darwin_time"""
+    if not working_time or not darwin_time:
+        return None
+
+    out = datetime.datetime.combine(working_time.date(), darwin_time)
+    offset = ssd_offset(time_seconds(working_time), time_seconds(darwin_time))
+    if offset == 1:
+        out += _DAY
+    elif offset == -1:
+        out -= _DAY
+    return out
+
+
+def combine_many(working_times: Sequence[datetime.datetime], darwin_times: Sequence[datetime.time]) -> List[Optional[datetime.datetime]]:
+    """combine() over two equal length columns in one pass"""
+    if len(working_times) != len(darwin_times):
+        raise ValueError("Column lengths differ ({} working, {} darwin)".format(len(working_times), len(darwin_times)))
+
+    out = []
+    append = out.append
+    date_combine = datetime.datetime.combine
+    for wt, dt in zip(working_times, darwin_times):
+        if not wt or not dt:
+            append(None)
+            continue
+
+        difference = (dt.hour*3600 + dt.minute*60 + dt.second) - (wt.hour*3600 + wt.minute*60 + wt.second)
+        combined = date_combine(wt.date(), dt)
+        if difference < MIDNIGHT_FORWARD:
+            combined += _DAY
+        elif difference > MIDNIGHT_BACKWARD:
+            combined -= _DAY
+        append(combined)
+    return out
+
+
+def times_dict(wt, pt, combined, darwin_type) -> OrderedDict:
+    """One of the arrival, pass or departure dicts of complete_times_dict"""
+    out = OrderedDict()
+    if wt:
+        out["working"] = wt
+    if pt:
+        out["public"] = pt
+    if combined and darwin_type:
+        out["actual"*(darwin_type=="A") or "estimated"] = combined
+    return out
+
+
+def complete_times_dict(location) -> OrderedDict:
+    """DarwinScheduleLocation.complete_times_dict, for a location and its status"""
+    status = location.status
+    return OrderedDict([
+        ("arrival", times_dict(location.wta, location.pta, combine(location.wta, status.ta), status.ta_type)),
+        ("pass", times_dict(location.wtp, None, combine(location.wtp, status.tp), status.tp_type)),
+        ("departure", times_dict(location.wtd, location.ptd, combine(location.wtd, status.td), status.td_type)),
+    ])
+
+
+def complete_times_dicts(locations: Iterable) -> List[OrderedDict]:
+    """complete_times_dict for many locations, resolving each time column in a single pass"""
+    locations = list(locations)
+    statuses = [a.status for a in locations]
+    columns = []
+    for name, working, public, darwin, darwin_type in TIME_KINDS:
+        wts = [getattr(a, working) for a in locations]
+        pts = [getattr(a, public) for a in locations] if public else [None]*len(locations)
+        combined = combine_many(wts, [getattr(s, darwin) for s in statuses])
+        types = [getattr(s, darwin_type) for s in statuses]
+        columns.append((name, list(zip(wts, pts, combined, types))))
+
+    return [OrderedDict([(name, times_dict(*column[i])) for name, column in columns]) for i in range(len(locations))]
@@ -0,0 +1,184 @@
+import datetime
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Optional, Sequence
+
+import sqlalchemy
+from sqlalchemy import event, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from models import LastReceivedSequence
+
+log = logging.getLogger(__name__)
+
+
+def create_engine(url: str, pool_size: int=10, max_overflow: int=20, pool_timeout: float=30, pool_recycle: int=1800, pool_pre_ping: bool=True,
+        query_cache_size: int=1000, application_name: str="swallow", statement_timeout: Optional[int]=None, connect_timeout: Optional[int]=10, **kwargs) -> Engine:
+    """An engine with the pooling everything here expects. statement_timeout (milliseconds) is the default for its
+    connections, which sessions can override, and connect_timeout (seconds) how long to wait to connect, both PostgreSQL only.
+    query_cache_size is SQLAlchemy's compiled statement cache. Pool sizes only apply to a QueuePool, which SQLite
+    doesn't use by default, and are left out for any other pool"""
+    url = sqlalchemy.engine.make_url(url)
+    if url.get_backend_name() == "postgresql":
+        options = "-c application_name={}".format(application_name)
+        if statement_timeout is not None:
+            options += " -c statement_timeout={}".format(int(statement_timeout))
+        connect_args = kwargs.setdefault("connect_args", {})
+        connect_args.setdefault("options", options)
+        if connect_timeout is not None:
+            connect_args.setdefault("connect_timeout", int(connect_timeout))
+    if "pool" not in kwargs and issubclass(kwargs.get("poolclass") or url.get_dialect().get_pool_class(url), QueuePool):
+        kwargs.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout)
+    return sqlalchemy.create_engine(url, pool_recycle=pool_recycle, pool_pre_ping=pool_pre_ping, query_cache_size=query_cache_size, **kwargs)
+
+
+class ReplicaState(NamedTuple):
+    healthy: bool
+    sequence: Optional[int]
+    time_acquired: Optional[datetime.datetime]
+    checked_at: float
+
+
+def _last_received(connection, sequence_id: int):
+    table = LastReceivedSequence.__table__
+    return connection.execute(select([table.c.sequence, table.c.time_acquired]).where(table.c.id == sequence_id)).first()
+
+
+class Database:
+    """The primary and any replicas, and sessions routed between them. Writes, ingestion and LastReceivedSequence go to
+    the primary. Read-only sessions go round robin to replicas whose LastReceivedSequence is within max_lag of the
+    primary's, and at least min_sequence if one's asked for, falling back to the primary when none are.
+    Checking them is one query per engine, each limited to check_timeout milliseconds on PostgreSQL. Nothing is checked
+    on construction: the first caller to need the states runs the check inline, and any others meanwhile use the primary"""
+    def __init__(self, primary_url: str, replica_urls: Sequence[str]=(), max_lag: datetime.timedelta=datetime.timedelta(seconds=30),
+            check_interval: float=5.0, sequence_id: int=1, statement_timeout: Optional[int]=None, check_timeout: int=2000, **engine_kwargs):
+        self.primary = create_engine(primary_url, statement_timeout=statement_timeout, **engine_kwargs)
+        self.replicas = [create_engine(a, statement_timeout=statement_timeout, **engine_kwargs) for a in replica_urls]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.sequence_id = sequence_id
+        self.check_timeout = check_timeout
+        self._sessionmaker = sessionmaker()
+        self._states = {}  # Each replica's ReplicaState
+        self._primary_state = None  # type: Optional[ReplicaState]
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        event.listen(self._sessionmaker, "after_begin", self._after_begin)
+
+    def _after_begin(self, session: Session, transaction, connection):
+        # Transaction-scoped, so these go back to the connection's defaults on commit or rollback
+        if connection.dialect.name != "postgresql":
+            return
+        if session.info.get("readonly"):
+            connection.execute(text("SET TRANSACTION READ ONLY"))
+        if session.info.get("statement_timeout") is not None:
+            connection.execute(text("SET LOCAL statement_timeout = {}".format(int(session.info["statement_timeout"]))))
+
+    def _check(self, engine: Engine) -> ReplicaState:
+        try:
+            with engine.begin() as connection:
+                if connection.dialect.name == "postgresql":
+                    connection.execute(text("SET LOCAL statement_timeout = {}".format(int(self.check_timeout))))
+                row = _last_received(connection, self.sequence_id)
+        except DBAPIError:
+            log.warning("Replica check failed for %s", engine.url, exc_info=True)
+            return ReplicaState(False, None, None, time.monotonic())
+        return ReplicaState(True, row.sequence if row else None, row.time_acquired if row else None, time.monotonic())
+
+    def _checked(self) -> bool:
+        return self._primary_state is not None and time.monotonic() - self._primary_state.checked_at < self.check_interval
+
+    def _refresh(self, wait: bool=False):
+        """Recheck the primary and replicas if last checked over check_interval ago. One thread checks at a time, and
+        unless wait, any other goes on with the last states meanwhile, or if there are none yet, the primary"""
+        if self._checked():
+            return
+        if not self._refreshing.acquire(blocking=wait):
+            return
+        try:
+            if self._checked():
+                return
+            primary = self._check(self.primary)
+            states = {a: self._check(a) for a in self.replicas}
+            with self._lock:
+                self._primary_state = primary
+                self._states = states
+        finally:
+            self._refreshing.release()
+
+    def lag(self, replica: Engine) -> Optional[datetime.timedelta]:
+        """How far behind the primary a replica last was, by when each received its last message, None if unknown"""
+        self._refresh()
+        state, primary = self._states.get(replica), self._primary_state
+        if not (state and state.healthy and primary and primary.healthy):
+            return None
+        if primary.time_acquired is None:
+            return datetime.timedelta(0)
+        if state.time_acquired is None:
+            return None
+        return max(primary.time_acquired - state.time_acquired, datetime.timedelta(0))
+
+    def usable(self, replica: Engine, min_sequence: Optional[int]=None) -> bool:
+        lag = self.lag(replica)
+        if lag is None or lag > self.max_lag:
+            return False
+        state = self._states[replica]
+        return min_sequence is None or (state.sequence is not None and state.sequence >= min_sequence)
+
+    def read_engine(self, min_sequence: Optional[int]=None) -> Engine:
+        """A replica fit to read from, or the primary. min_sequence is for reading what was just written at that sequence"""
+        if self.replicas:
+            start = next(self._next)
+            for i in range(len(self.replicas)):
+                replica = self.replicas[(start + i) % len(self.replicas)]
+                if self.usable(replica, min_sequence):
+                    return replica
+        return self.primary
+
+    @contextmanager
+    def session(self, readonly: bool=False, statement_timeout: Optional[int]=None, min_sequence: Optional[int]=None) -> Iterator[Session]:
+        """A session on the primary, or if readonly on a replica, in read only transactions. Committed at the end
+        unless readonly, rolled back on an exception. statement_timeout is in milliseconds, for this session only"""
+        engine = self.read_engine(min_sequence) if readonly else self.primary
+        session = self._sessionmaker(bind=engine, info={"readonly": readonly, "statement_timeout": statement_timeout})
+        try:
+            yield session
+            if not readonly:
+                session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def read_session(self, statement_timeout: Optional[int]=None, min_sequence: Optional[int]=None):
+        """For boards, schedule lookups and message queries"""
+        return self.session(True, statement_timeout, min_sequence)
+
+    def write_session(self, statement_timeout: Optional[int]=None):
+        return self.session(False, statement_timeout)
+
+    def writer(self, **kwargs):
+        """An ingest.BulkWriter on the primary"""
+        from ingest import BulkWriter
+        return BulkWriter(self.primary, **kwargs)
+
+    def status(self) -> List[dict]:
+        """Health, sequence and lag of every engine, for monitoring, waiting for any check in progress"""
+        self._refresh(wait=True)
+        out = [dict(url=repr(self.primary.url), role="primary", healthy=self._primary_state.healthy, sequence=self._primary_state.sequence, lag=None)]
+        for replica in self.replicas:
+            state = self._states[replica]
+            out.append(dict(url=repr(replica.url), role="replica", healthy=state.healthy, sequence=state.sequence, lag=self.lag(replica)))
+        return out
+
+    def dispose(self):
+        for engine in [self.primary] + self.replicas:
+            engine.dispose()
@@ -0,0 +1,313 @@
+from collections import OrderedDict
+import datetime
+import json
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, and_, or_, tuple_
+from sqlalchemy.engine import Connection
+
+import darwin_time
+from models import DarwinSchedule, DarwinScheduleLocation, DarwinScheduleStatus, DarwinLocation, DarwinAssociation, DarwinScheduleFormation, DarwinMessage
+
+# Core equivalents of the serialise() methods, producing the same dicts from only the columns they use.
+# Nothing here builds ORM instances or touches a session, so memory use doesn't grow with the export
+
+_schedules = DarwinSchedule.__table__
+_locations = DarwinScheduleLocation.__table__
+_status = DarwinScheduleStatus.__table__
+_references = DarwinLocation.__table__
+_associations = DarwinAssociation.__table__
+_formations = DarwinScheduleFormation.__table__
+_messages = DarwinMessage.__table__
+
+SCHEDULE_COLUMNS = [_schedules.c[a] for a in (
+    "uid", "ssd", "rid", "rsid", "signalling_id", "category", "operator", "is_active", "is_charter", "is_passenger",
+    "delay_reason", "cancel_reason", "formation_summary")]
+
+LOCATION_COLUMNS = [
+    *[_locations.c[a] for a in ("rid", "index", "type", "tiploc", "activity", "original_wt", "pta", "wta", "wtp", "ptd", "wtd", "cancelled")],
+    *[_status.c[a] for a in ("length", "ta", "tp", "td", "ta_type", "tp_type", "td_type",
+        "plat", "plat_suppressed", "plat_cis_suppressed", "plat_confirmed", "plat_source")],
+    _references.c.category.label("location_category"), _references.c.crs_darwin, _references.c.name_short, _references.c.name_full,
+]
+
+# Calling points joined to their status and location, for LOCATION_COLUMNS
+LOCATION_FROM = _locations\
+    .join(_status, and_(_locations.c.rid == _status.c.rid, _locations.c.original_wt == _status.c.original_wt, _locations.c.tiploc == _status.c.tiploc))\
+    .join(_references, _locations.c.tiploc == _references.c.tiploc)
+
+
+def chunks(items: list, size: int) -> Iterator[list]:
+    """items in lists of at most size, such as to keep IN clauses to a reasonable length"""
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+
+class RowGraph:
+    """Schedules, calling points and associations as rows, loaded in bulk for a set of rids and what they refer to"""
+    def __init__(self, connection: Connection, chunk_size: int=1000):
+        self.connection = connection
+        self.chunk_size = chunk_size
+        self.schedules = {}
+        self.locations = {}
+        self.associated_to = {}
+        self.associated_from = {}
+        self._full_locations = set()
+        self._endpoint_locations = set()
+        self._association_rids = set()
+        self._association_keys = set()
+
+    def load_schedules(self, rids: Iterable[str]):
+        rids = [a for a in set(rids) if a not in self.schedules]
+        for chunk in chunks(rids, self.chunk_size):
+            for row in self.connection.execute(select(SCHEDULE_COLUMNS).where(_schedules.c.rid.in_(chunk))):
+                self.schedules[row.rid] = row
+
+    def add_schedules(self, rows: Iterable):
+        for row in rows:
+            self.schedules[row.rid] = row
+
+    def load_locations(self, rids: Iterable[str], endpoints_only: bool=False, pairs: Iterable[Tuple[str, str]]=()):
+        """Every calling point of rids, or only origins and destinations plus any (rid, original_wt) in pairs"""
+        loaded = self._full_locations if not endpoints_only else self._full_locations | self._endpoint_locations
+        rids = [a for a in set(rids) if a not in loaded]
+        pairs = [a for a in set(pairs) if a[0] not in self._full_locations]
+
+        for chunk in chunks(rids, self.chunk_size):
+            condition = _locations.c.rid.in_(chunk)
+            if endpoints_only:
+                condition = and_(condition, or_(_locations.c.type.like("%OR"), _locations.c.type.like("%DT")))
+            self._add_locations(condition)
+        for chunk in chunks(pairs, self.chunk_size):
+            self._add_locations(tuple_(_locations.c.rid, _locations.c.original_wt).in_(chunk))
+
+        (self._endpoint_locations if endpoints_only else self._full_locations).update(rids)
+
+    def _add_locations(self, condition):
+        for row in self.connection.execute(select(LOCATION_COLUMNS).select_from(LOCATION_FROM).where(condition)):
+            self.locations.setdefault(row.rid, {})[row.index] = row
+
+    def load_associations(self, rids: Iterable[str]):
+        rids = [a for a in set(rids) if a not in self._association_rids]
+        for chunk in chunks(rids, self.chunk_size):
+            for row in self.connection.execute(select([_associations]).where(or_(_associations.c.main_rid.in_(chunk), _associations.c.assoc_rid.in_(chunk)))):
+                key = tuple(row)
+                if key not in self._association_keys:
+                    self._association_keys.add(key)
+                    self.associated_to.setdefault(row.main_rid, []).append(row)
+                    self.associated_from.setdefault(row.assoc_rid, []).append(row)
+        self._association_rids.update(rids)
+
+    def load_for(self, rids: Iterable[str], recurse: bool):
+        """Everything needed to serialise rids, in a fixed number of rounds rather than per schedule"""
+        rids = set(rids)
+        self.load_schedules(rids)
+        self.load_locations(rids, endpoints_only=not recurse)
+        self.load_associations(rids)
+
+        # get_origins/get_destinations reach the other side's endpoints
+        others = {a.main_rid for r in rids for a in self.associated_from.get(r, ())} | {a.assoc_rid for r in rids for a in self.associated_to.get(r, ())}
+        if not recurse:
+            self.load_locations(others, endpoints_only=True)
+            return
+
+        # Calling point association dicts envelope the other location with its own schedule, origins and destinations
+        pairs = {(a.main_rid, a.main_original_wt) for r in rids for a in self.associated_from.get(r, ())} |\
+            {(a.assoc_rid, a.assoc_original_wt) for r in rids for a in self.associated_to.get(r, ())}
+        self.load_schedules(others)
+        self.load_associations(others)
+        self.load_locations(others, endpoints_only=True, pairs=pairs)
+        further = {a.main_rid for r in others for a in self.associated_from.get(r, ())} | {a.assoc_rid for r in others for a in self.associated_to.get(r, ())}
+        self.load_locations(further, endpoints_only=True)
+
+    def location_rows(self, rid: str) -> List:
+        return [v for k, v in sorted(self.locations.get(rid, {}).items())]
+
+    def location_at(self, rid: str, original_wt: str, tiploc: str):
+        for row in self.locations.get(rid, {}).values():
+            if row.original_wt == original_wt and row.tiploc == tiploc:
+                return row
+        return None
+
+    def origins(self, rid: str) -> List[Tuple[str, object]]:
+        """DarwinSchedule.get_origins"""
+        own = [("SC", a) for a in self.location_rows(rid) if a.type.endswith("OR")]
+        return own + [(a.category, b) for a in self.associated_from.get(rid, ()) for b in self.location_rows(a.main_rid) if b.type.endswith("OR") and a.category != "NP"]
+
+    def destinations(self, rid: str) -> List[Tuple[str, object]]:
+        """DarwinSchedule.get_destinations"""
+        own = [("SC", a) for a in self.location_rows(rid) if a.type.endswith("DT")]
+        return own + [(a.category, b) for a in self.associated_to.get(rid, ()) for b in self.location_rows(a.assoc_rid) if b.type.endswith("DT") and a.category != "NP"]
+
+
+def serialise_location_row(graph: RowGraph, row, recurse: bool, source: str="SC", limit_associations=False) -> OrderedDict:
+    """DarwinScheduleLocation.serialise"""
+    here = OrderedDict([
+        ("type", row.type),
+        ("source", source),
+        ("activity", row.activity),
+        ("cancelled", row.cancelled),
+        ("length", row.length),
+        ("times", OrderedDict([
+            ("arrival", darwin_time.times_dict(row.wta, row.pta, darwin_time.combine(row.wta, row.ta), row.ta_type)),
+            ("pass", darwin_time.times_dict(row.wtp, None, darwin_time.combine(row.wtp, row.tp), row.tp_type)),
+            ("departure", darwin_time.times_dict(row.wtd, row.ptd, darwin_time.combine(row.wtd, row.td), row.td_type)),
+        ])),
+        ("platform", OrderedDict([
+            ("platform", row.plat),
+            ("suppressed", row.plat_suppressed),
+            ("cis_suppressed", row.plat_cis_suppressed),
+            ("confirmed", row.plat_confirmed),
+            ("source", row.plat_source)
+            ])),
+        ("associations", serialise_associations(graph, row) if source == "SC" and not limit_associations else []),
+        ("tiploc", row.tiploc),
+        ("location_category", row.location_category),
+        ("crs_darwin", row.crs_darwin),
+        ("name_short", row.name_short),
+        ("name_full", row.name_full),
+        ])
+
+    if not recurse:
+        return here
+    else:
+        schedule = serialise_schedule_row(graph, graph.schedules[row.rid], not recurse)
+        schedule["here"] = here
+        return schedule
+
+
+def serialise_associations(graph: RowGraph, row) -> list:
+    """DarwinScheduleLocation.complete_associations_dict"""
+    complete = [(True, a) for a in graph.associated_from.get(row.rid, ()) if a.assoc_original_wt == row.original_wt] +\
+        [(False, a) for a in graph.associated_to.get(row.rid, ()) if a.main_original_wt == row.original_wt]
+    straightened = []
+    for k, v in complete:
+        out = OrderedDict()
+        out["from"] = k
+        out["category"] = v.category
+        if k:
+            out["assoc"] = serialise_location_row(graph, graph.location_at(v.main_rid, v.main_original_wt, v.tiploc), True, v.category)
+            out["there"] = out["assoc"]["origins"]
+        else:
+            out["assoc"] = serialise_location_row(graph, graph.location_at(v.assoc_rid, v.assoc_original_wt, v.tiploc), True, v.category)
+            out["there"] = out["assoc"]["destinations"]
+        straightened.append(out)
+    return straightened
+
+
+def serialise_schedule_row(graph: RowGraph, row, recurse: bool, formation: Optional[list]=None) -> OrderedDict:
+    """DarwinSchedule.serialise. formation is required if recurse is set"""
+    out = OrderedDict([
+        ("uid", row.uid),
+        ("ssd", row.ssd),
+        ("rid", row.rid),
+        ("rsid", row.rsid),
+        ("signalling_id", row.signalling_id),
+        ("category", row.category),
+        ("operator", row.operator),
+        ("is_active", row.is_active),
+        ("is_charter", row.is_charter),
+        ("is_passenger", row.is_passenger),
+        ("origins", [serialise_location_row(graph, a, False, c, limit_associations=True) for c, a in graph.origins(row.rid)]),
+        ("destinations", [serialise_location_row(graph, a, False, c, limit_associations=True) for c, a in graph.destinations(row.rid)]),
+        ("delay_reason", row.delay_reason),
+        ("cancel_reason", row.cancel_reason),
+        ("formation_summary", row.formation_summary)
+    ])
+
+    if recurse:
+        out["formation"] = [serialise_formation_row(a) for a in formation or ()]
+        out["locations"] = [serialise_location_row(graph, a, False) for a in graph.location_rows(row.rid)]
+    return out
+
+
+def serialise_formation_row(row) -> OrderedDict:
+    """DarwinScheduleFormation.serialise"""
+    return OrderedDict([
+        ("sequence", row.seq),
+        ("coach_number", row.coach_number),
+        ("coach_class", row.coach_class),
+        ("toilet_status", row.toilet_status),
+        ("toilet_type", row.toilet_type)
+    ])
+
+
+def serialise_message_row(row) -> OrderedDict:
+    """DarwinMessage.serialise"""
+    return OrderedDict([
+        ("id", row.message_id),
+        ("category", row.category),
+        ("severity", row.severity),
+        ("suppress", row.suppress),
+        ("stations", row.stations),
+        ("message", row.message)
+    ])
+
+
+def iter_schedules(connection: Connection, where=None, recurse: bool=False, chunk_size: int=500, order_by=None) -> Iterator[OrderedDict]:
+    """Serialised schedules matching where (a Core condition on darwin_schedules), chunk_size schedules at a time.
+    Schedule rows are streamed from a server side cursor, and each chunk's rows are dropped once serialised"""
+    query = select(SCHEDULE_COLUMNS).order_by(*(order_by if order_by is not None else [_schedules.c.ssd, _schedules.c.rid]))
+    if where is not None:
+        query = query.where(where)
+    result = connection.execution_options(stream_results=True).execute(query)
+
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+
+        graph = RowGraph(connection)
+        graph.add_schedules(rows)
+        graph.load_for([a.rid for a in rows], recurse)
+
+        formations = {}
+        if recurse:
+            for formation in connection.execute(select([_formations]).where(_formations.c.rid.in_([a.rid for a in rows])).order_by(_formations.c.seq)):
+                formations.setdefault(formation.rid, []).append(formation)
+
+        for row in rows:
+            yield serialise_schedule_row(graph, row, recurse, formations.get(row.rid))
+
+
+def iter_operator_schedules(connection: Connection, operator: str, ssd: datetime.date, recurse: bool=False, chunk_size: int=500) -> Iterator[OrderedDict]:
+    return iter_schedules(connection, and_(_schedules.c.operator == operator, _schedules.c.ssd == ssd), recurse, chunk_size)
+
+
+def iter_messages(connection: Connection, where=None, chunk_size: int=1000) -> Iterator[OrderedDict]:
+    query = select([_messages]).order_by(_messages.c.message_id)
+    if where is not None:
+        query = query.where(where)
+    result = connection.execution_options(stream_results=True).execute(query)
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            yield serialise_message_row(row)
+
+
+def _json_default(o):
+    if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+        return o.isoformat()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(o).__name__))
+
+
+def stream_json(items: Iterable, default=_json_default, chunk_bytes: int=65536) -> Iterator[bytes]:
+    """A JSON array of items, as byte chunks of roughly chunk_bytes"""
+    encoder = json.JSONEncoder(default=default)
+    buffer = ["["]
+    size = 1
+    first = True
+    for item in items:
+        encoded = encoder.encode(item)
+        if not first:
+            buffer.append(",")
+        buffer.append(encoded)
+        first = False
+        size += len(encoded) + 1
+        if size >= chunk_bytes:
+            yield "".join(buffer).encode()
+            buffer, size = [], 0
+    buffer.append("]")
+    yield "".join(buffer).encode()
@@ -0,0 +1,253 @@
+import datetime
+import io
+import json
+from typing import Dict, NamedTuple, Sequence, Any, List, Optional, Set
+
+import sqlalchemy
+from sqlalchemy import inspect, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine, Connection
+
+import partitioning
+import status_times
+import writes
+from models import DarwinSchedule, DarwinScheduleLocation, DarwinScheduleStatus, DarwinAssociation, DarwinScheduleFormation, LastReceivedSequence
+
+
+class ScheduleBatch(NamedTuple):
+    """Rows to write together. Each row is either a model instance or a dict keyed by attribute name"""
+    schedules: Sequence[Any] = ()
+    locations: Sequence[Any] = ()
+    statuses: Sequence[Any] = ()
+    associations: Sequence[Any] = ()
+    formations: Sequence[Any] = ()
+
+    def __len__(self):
+        return sum(len(a) for a in self)
+
+
+# Written in this order to satisfy foreign keys
+BATCH_MODELS = (
+    ("schedules", DarwinSchedule),
+    ("locations", DarwinScheduleLocation),
+    ("statuses", DarwinScheduleStatus),
+    ("associations", DarwinAssociation),
+    ("formations", DarwinScheduleFormation),
+)
+
+_MISSING = object()
+
+
+class _TableShape:
+    """Attribute to column mapping for one model, worked out once"""
+    def __init__(self, model):
+        self.model = model
+        self.table = model.__table__
+        self.keys = []
+        self.columns = []
+        for attr in inspect(model).column_attrs:
+            self.keys.append(attr.key)
+            self.columns.append(attr.columns[0])
+        self.names = [a.name for a in self.columns]
+        self.primary_key = [a.name for a in self.table.primary_key.columns]
+        self._pk_positions = [self.names.index(a) for a in self.primary_key]
+        # Child tables carry their (main) schedule's ssd for partitioning
+        self.ssd_position = self.names.index("ssd") if "ssd" in self.names and model is not DarwinSchedule else None
+        self.rid_position = self.names.index("main_rid" if "main_rid" in self.names else "rid")
+        self.defaults = [a.default.arg if a.default is not None and a.default.is_scalar else None for a in self.columns]
+        self.encoders = [_copy_encoder(a.type) for a in self.columns]
+
+    def row_tuple(self, row) -> tuple:
+        if isinstance(row, dict):
+            values = row
+        else:
+            values = vars(row)
+        out = []
+        for key, default in zip(self.keys, self.defaults):
+            value = values.get(key, _MISSING)
+            out.append(default if value is _MISSING else value)
+        return tuple(out)
+
+    def row_tuples(self, rows) -> List[tuple]:
+        """Deduplicated on primary key, last row wins, as ON CONFLICT can't update a row twice"""
+        out = {}
+        for row in rows:
+            row = self.row_tuple(row)
+            out[tuple(row[a] for a in self._pk_positions)] = row
+        return list(out.values())
+
+    def upsert(self, source=None, partitioned=False):
+        """INSERT ... ON CONFLICT DO UPDATE, either of bound values or SELECTed from source"""
+        statement = postgresql.insert(self.table)
+        if source is not None:
+            statement = statement.from_select(self.names, select([source.c[a] for a in self.names]))
+        conflict = self.primary_key + ["ssd"] if partitioned and "ssd" not in self.primary_key else self.primary_key
+        return statement.on_conflict_do_update(
+            index_elements=conflict,
+            set_={a: getattr(statement.excluded, a) for a in self.names if a not in conflict},
+        )
+
+
+_SHAPES = {}
+
+
+def _shape(model) -> _TableShape:
+    if model not in _SHAPES:
+        _SHAPES[model] = _TableShape(model)
+    return _SHAPES[model]
+
+
+def _copy_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _copy_scalar(type_):
+    if isinstance(type_, sqlalchemy.JSON):
+        return lambda v: json.dumps(v, default=str)
+    if isinstance(type_, sqlalchemy.BOOLEAN):
+        return lambda v: "t" if v else "f"
+    return str
+
+
+def _copy_encoder(type_):
+    """Value to COPY text format, before escaping"""
+    if isinstance(type_, sqlalchemy.ARRAY):
+        element = _copy_scalar(type_.item_type)
+        def array(values):
+            return "{" + ",".join("NULL" if a is None else '"' + element(a).replace("\\", "\\\\").replace('"', '\\"') + '"' for a in values) + "}"
+        return array
+    return _copy_scalar(type_)
+
+
+def _copy_buffer(shape: _TableShape, rows: List[tuple]) -> io.StringIO:
+    buffer = io.StringIO()
+    encoders = shape.encoders
+    for row in rows:
+        buffer.write("\t".join("\\N" if v is None else _copy_escape(e(v)) for e, v in zip(encoders, row)))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+class BulkWriter:
+    """Writes batches of schedules in one transaction each, advancing LastReceivedSequence with them.
+    method "copy" goes through COPY into temporary staging tables, "upsert" through executemany INSERT ... ON CONFLICT.
+    COPY is the faster of the two for anything much over a few hundred rows, and requires psycopg2.
+    partitioned should match how the schema was created, in which case missing ssds are filled in and partitions created"""
+    def __init__(self, engine: Engine, method: str="copy", sequence_id: int=1, partitioned: bool=False):
+        if method not in ("copy", "upsert"):
+            raise ValueError("Unknown write method {}".format(method))
+        self.engine = engine
+        self.method = method
+        self.sequence_id = sequence_id
+        self.partitioned = partitioned
+        # Called as listener(connection, written) after each batch is written, inside its transaction.
+        # written maps each ScheduleBatch field to the rids it wrote, both main and associated for associations
+        self.listeners = []
+        # Called as listener(written) once the transaction has committed, with everything it wrote
+        self.commit_listeners = []
+
+    def write(self, batch: ScheduleBatch, sequence: Optional[int]=None) -> int:
+        """Write a batch, and if given, the sequence number it was received up to. Returns rows written"""
+        written = {}
+        with self.engine.begin() as connection:
+            out = self.write_connection(connection, batch, sequence, written)
+        self.committed(written)
+        return out
+
+    def write_connection(self, connection: Connection, batch: ScheduleBatch, sequence: Optional[int]=None, written: Optional[Dict[str, Set[str]]]=None) -> int:
+        """As write(), within a transaction the caller has already begun on connection. If given, written is updated
+        with the rids written, to pass to committed() once the caller has committed"""
+        tables = []
+        fields = []
+        for field, model in BATCH_MODELS:
+            rows = getattr(batch, field)
+            if rows:
+                shape = _shape(model)
+                tables.append((shape, shape.row_tuples(rows)))
+                fields.append(field)
+
+        if self.partitioned:
+            tables = self._fill_ssd(connection, tables)
+
+        count = 0
+        for shape, tuples in tables:
+            if self.method == "copy":
+                self._write_copy(connection, shape, tuples)
+            else:
+                connection.execute(shape.upsert(partitioned=self.partitioned), [dict(zip(shape.names, a)) for a in tuples])
+            count += len(tuples)
+
+        rids = {field: {a[shape.rid_position] for a in tuples} for field, (shape, tuples) in zip(fields, tables)}
+        if "associations" in rids:
+            shape, tuples = tables[fields.index("associations")]
+            assoc_position = shape.names.index("assoc_rid")
+            rids["associations"] |= {a[assoc_position] for a in tuples}
+        # Either side of a status's resolved times may have changed
+        resolved = rids.get("locations", set()) | rids.get("statuses", set())
+        if resolved:
+            status_times.resolve(connection, sorted(resolved))
+        for listener in self.listeners:
+            listener(connection, rids)
+        if written is not None:
+            writes.merge(written, rids)
+
+        if sequence is not None:
+            advance_sequence(connection, sequence, self.sequence_id)
+        return count
+
+    def committed(self, written: Dict[str, Set[str]]):
+        """Tell commit_listeners that what was written, as write_connection() collects it, has been committed"""
+        if written:
+            for listener in self.commit_listeners:
+                listener(written)
+
+    def _fill_ssd(self, connection: Connection, tables: List[tuple]) -> List[tuple]:
+        """Sets ssd on child rows from their schedule, in the batch or otherwise in the database, and creates partitions"""
+        ssds = {}
+        schedule_shape = _shape(DarwinSchedule)
+        ssd_position = schedule_shape.names.index("ssd")
+        for shape, tuples in tables:
+            if shape is schedule_shape:
+                ssds.update((a[shape.rid_position], a[ssd_position]) for a in tuples)
+
+        missing = {a[shape.rid_position] for shape, tuples in tables if shape.ssd_position is not None for a in tuples
+            if a[shape.ssd_position] is None and a[shape.rid_position] not in ssds}
+        if missing:
+            schedules = DarwinSchedule.__table__
+            ssds.update(connection.execute(select([schedules.c.rid, schedules.c.ssd]).where(schedules.c.rid.in_(missing))).fetchall())
+
+        out = []
+        for shape, tuples in tables:
+            position = shape.ssd_position
+            if position is not None:
+                tuples = [a if a[position] is not None else a[:position] + (ssds.get(a[shape.rid_position]),) + a[position+1:] for a in tuples]
+            out.append((shape, tuples))
+
+        # Not remembered between batches, as a rollback or retention would undo them
+        partitioning.ensure_partitions(connection, [a for a in ssds.values() if a])
+        return out
+
+    def _write_copy(self, connection: Connection, shape: _TableShape, rows: List[tuple]):
+        staging = "staging_" + shape.table.name
+        # Rows are removed at the end of every transaction, so the table is only created once per connection
+        connection.execute(text('CREATE TEMPORARY TABLE IF NOT EXISTS "{}" (LIKE "{}" INCLUDING DEFAULTS) ON COMMIT DELETE ROWS'.format(staging, shape.table.name)))
+
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert('COPY "{}" ({}) FROM STDIN'.format(staging, ", ".join('"{}"'.format(a) for a in shape.names)), _copy_buffer(shape, rows))
+        finally:
+            cursor.close()
+
+        connection.execute(shape.upsert(sqlalchemy.table(staging, *[sqlalchemy.column(a) for a in shape.names]), self.partitioned))
+        # In case the same table is written again before commit
+        connection.execute(text('TRUNCATE "{}"'.format(staging)))
+
+
+def advance_sequence(connection: Connection, sequence: int, sequence_id: int=1, time_acquired: datetime.datetime=None):
+    table = LastReceivedSequence.__table__
+    statement = postgresql.insert(table).values(id=sequence_id, sequence=sequence, time_acquired=time_acquired or datetime.datetime.utcnow())
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=["id"],
+        set_={"sequence": statement.excluded.sequence, "time_acquired": statement.excluded.time_acquired},
+    ))
@@ -0,0 +1,251 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import models
+
+# Opt-in counting of statements, rows and time per logical operation (a serialise() call, a board request...),
+# with lazy loads flagged by where they came from. Nothing is hooked until Instrumentation.attach()
+
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+SERIALISED_MODELS = (models.DarwinSchedule, models.DarwinScheduleLocation, models.DarwinLocation, models.DarwinScheduleFormation, models.DarwinMessage)
+
+_current = contextvars.ContextVar("swallow_operation", default=None)
+
+
+class TooManyQueries(AssertionError):
+    def __init__(self, operation: "Operation", limit: int):
+        self.operation = operation
+        self.limit = limit
+        super().__init__("{} issued {} statements, more than {}: {}".format(
+            operation.name, operation.statements, limit, "; ".join(operation.statement_log[-5:])))
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple):
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets)+1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        out = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            out.append((str(bound), total))
+        return out
+
+
+class Operation:
+    def __init__(self, name: str, limit: Optional[int]=None, log_statements: bool=False, parent: Optional["Operation"]=None):
+        self.name = name
+        self.limit = limit
+        # The enclosing operation, which everything counted here is also counted towards
+        self.parent = parent
+        self.statements = 0
+        self.rows = 0
+        self.seconds = 0.0
+        # Of seconds, how much was spent executing statements
+        self.query_seconds = 0.0
+        self.lazy_loads = []  # type: List[str]
+        self.log_statements = log_statements
+        self.statement_log = []  # type: List[str]
+
+    def chain(self):
+        """This and every enclosing operation, innermost first"""
+        operation = self
+        while operation is not None:
+            yield operation
+            operation = operation.parent
+
+
+class Instrumentation:
+    """Statement, row and time counts per operation, as histograms keyed by operation name.
+    If strict, an operation with a limit raises TooManyQueries as soon as it exceeds it, which is meant for tests"""
+    def __init__(self, strict: bool=False, limits: Optional[Dict[str, int]]=None):
+        self.strict = strict
+        self.limits = dict(limits or {})
+        self.statements = {}  # type: Dict[str, Histogram]
+        self.seconds = {}  # type: Dict[str, Histogram]
+        self.rows = {}  # type: Dict[str, int]
+        self.query_seconds = {}  # type: Dict[str, float]
+        self.lazy_loads = {}  # type: Dict[Tuple[str, str], int]
+        self._lock = threading.Lock()
+        self._engines = []
+        self._session_hooked = False
+        self._wrapped = []
+
+    def attach(self, engine: Engine):
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+        self._engines.append(engine)
+        if not self._session_hooked:
+            event.listen(Session, "do_orm_execute", self._do_orm_execute)
+            self._session_hooked = True
+
+    def detach(self):
+        for engine in self._engines:
+            event.remove(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.remove(engine, "after_cursor_execute", self._after_cursor_execute)
+            event.remove(engine, "handle_error", self._handle_error)
+        self._engines = []
+        if self._session_hooked:
+            event.remove(Session, "do_orm_execute", self._do_orm_execute)
+            self._session_hooked = False
+        self.uninstrument_serialisers()
+
+    @contextmanager
+    def operation(self, name: str, limit: Optional[int]=None):
+        """Count everything executed inside as one operation. Nested operations count towards every enclosing one too"""
+        operation = Operation(name, limit if limit is not None else self.limits.get(name), log_statements=self.strict, parent=_current.get())
+        token = _current.set(operation)
+        begin = time.perf_counter()
+        try:
+            yield operation
+        finally:
+            operation.seconds = time.perf_counter() - begin
+            _current.reset(token)
+            self._record(operation)
+
+    @contextmanager
+    def max_queries(self, limit: int, name: str="max_queries"):
+        """For tests: raises TooManyQueries if the body issues more than limit statements"""
+        strict = self.strict
+        self.strict = True
+        try:
+            with self.operation(name, limit) as operation:
+                yield operation
+        finally:
+            self.strict = strict
+
+    def instrument_serialisers(self, classes=SERIALISED_MODELS):
+        """Make every outermost serialise() call on these models an operation named after it"""
+        for model in classes:
+            original = model.__dict__.get("serialise")
+            if original is None or getattr(original, "_swallow_instrumented", False):
+                continue
+            name = "{}.serialise".format(model.__name__)
+
+            def wrapper(*args, _original=original, _name=name, **kwargs):
+                current = _current.get()
+                if current is not None and current.name.endswith(".serialise"):
+                    return _original(*args, **kwargs)
+                with self.operation(_name):
+                    return _original(*args, **kwargs)
+
+            functools.update_wrapper(wrapper, original)
+            wrapper._swallow_instrumented = True
+            model.serialise = wrapper
+            self._wrapped.append((model, original))
+
+    def uninstrument_serialisers(self):
+        for model, original in self._wrapped:
+            model.serialise = original
+        self._wrapped = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("swallow_query_start", []).append((context, time.perf_counter()))
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        _, start = conn.info["swallow_query_start"].pop()
+        operation = _current.get()
+        if operation is None:
+            return
+        seconds = time.perf_counter() - start
+        for operation in operation.chain():
+            operation.query_seconds += seconds
+            operation.statements += 1
+            operation.rows += max(cursor.rowcount, 0)
+            if operation.log_statements:
+                operation.statement_log.append(" ".join(statement.split())[:200])
+            if self.strict and operation.limit is not None and operation.statements > operation.limit:
+                raise TooManyQueries(operation, operation.limit)
+
+    def _handle_error(self, exception_context):
+        """A failed statement has no after_cursor_execute, so its start is dropped here instead"""
+        connection = exception_context.connection
+        if connection is None:
+            return
+        starts = connection.info.get("swallow_query_start")
+        if starts and starts[-1][0] is exception_context.execution_context:
+            starts.pop()
+
+    def _do_orm_execute(self, orm_execute_state):
+        if not orm_execute_state.is_select:
+            return
+        parent = orm_execute_state.lazy_loaded_from
+        if parent is None:
+            return
+        operation = _current.get()
+        if operation is not None:
+            target = orm_execute_state.bind_mapper.class_.__name__ if orm_execute_state.bind_mapper else "?"
+            for operation in operation.chain():
+                operation.lazy_loads.append("{} -> {}".format(parent.class_.__name__, target))
+
+    def _record(self, operation: Operation):
+        with self._lock:
+            if operation.name not in self.statements:
+                self.statements[operation.name] = Histogram(STATEMENT_BUCKETS)
+                self.seconds[operation.name] = Histogram(SECONDS_BUCKETS)
+                self.rows[operation.name] = 0
+                self.query_seconds[operation.name] = 0.0
+            self.query_seconds[operation.name] += operation.query_seconds
+            self.statements[operation.name].observe(operation.statements)
+            self.seconds[operation.name].observe(operation.seconds)
+            self.rows[operation.name] += operation.rows
+            for lazy_load in operation.lazy_loads:
+                key = (operation.name, lazy_load)
+                self.lazy_loads[key] = self.lazy_loads.get(key, 0) + 1
+
+    def snapshot(self) -> OrderedDict:
+        with self._lock:
+            return OrderedDict((name, OrderedDict([
+                ("count", histogram.count),
+                ("statements", histogram.sum),
+                ("rows", self.rows[name]),
+                ("seconds", self.seconds[name].sum),
+                ("query_seconds", self.query_seconds[name]),
+                ("statement_buckets", histogram.cumulative()),
+                ("seconds_buckets", self.seconds[name].cumulative()),
+                ("lazy_loads", OrderedDict((k[1], v) for k, v in self.lazy_loads.items() if k[0] == name)),
+            ])) for name, histogram in self.statements.items())
+
+    def prometheus(self, prefix: str="swallow") -> str:
+        """Histograms in Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for metric, histograms in (("statements", self.statements), ("seconds", self.seconds)):
+                lines.append("# TYPE {}_operation_{} histogram".format(prefix, metric))
+                for name, histogram in histograms.items():
+                    for bound, count in histogram.cumulative():
+                        lines.append('{}_operation_{}_bucket{{operation="{}",le="{}"}} {}'.format(prefix, metric, name, bound, count))
+                    lines.append('{}_operation_{}_sum{{operation="{}"}} {}'.format(prefix, metric, name, histogram.sum))
+                    lines.append('{}_operation_{}_count{{operation="{}"}} {}'.format(prefix, metric, name, histogram.count))
+            lines.append("# TYPE {}_operation_rows counter".format(prefix))
+            for name, rows in self.rows.items():
+                lines.append('{}_operation_rows{{operation="{}"}} {}'.format(prefix, name, rows))
+            lines.append("# TYPE {}_operation_query_seconds counter".format(prefix))
+            for name, seconds in self.query_seconds.items():
+                lines.append('{}_operation_query_seconds{{operation="{}"}} {}'.format(prefix, name, seconds))
+            lines.append("# TYPE {}_lazy_loads counter".format(prefix))
+            for (name, lazy_load), count in self.lazy_loads.items():
+                lines.append('{}_lazy_loads{{operation="{}",relationship="{}"}} {}'.format(prefix, name, lazy_load, count))
+        return "\n".join(lines) + "\n"
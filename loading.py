@@ -0,0 +1,120 @@
+from typing import List
+
+from sqlalchemy.orm import Query, contains_eager, joinedload, lazyload, raiseload, selectinload
+
+from models import DarwinSchedule, DarwinScheduleLocation, DarwinAssociation, reference_cache_loaded
+
+# Loader options for what each serialise() touches, and named profiles made of them, so callers choose how much of the
+# graph a query brings back rather than lazy loading it relationship by relationship. Each function gives options
+# relative to its entity, nested under a relationship to it with .options(), so every path is given once
+
+
+def location_option(joined: bool=False):
+    """Eagerly loaded unless the reference cache can resolve it, in which case it's only loaded if the cache lacks the
+    tiploc. joined if the query already joins it, such as to filter on"""
+    if reference_cache_loaded():
+        return lazyload(DarwinScheduleLocation.location)
+    if joined:
+        return contains_eager(DarwinScheduleLocation.location)
+    return joinedload(DarwinScheduleLocation.location)
+
+
+def calling_point_options() -> list:
+    """Options for a calling point that is only serialised flat (origins, destinations)"""
+    return [
+        location_option(),
+        joinedload(DarwinScheduleLocation.status, innerjoin=True),
+        lazyload("*"),
+    ]
+
+
+def schedule_options() -> list:
+    """Options for everything DarwinSchedule.serialise(False) touches, in a fixed number of selects"""
+    return [
+        lazyload("*"),
+        selectinload(DarwinSchedule.associated_from).options(
+            lazyload("*"),
+            selectinload(DarwinAssociation.main_schedule).options(
+                lazyload("*"),
+                selectinload(DarwinSchedule.origins_rel).options(*calling_point_options()),
+            ),
+        ),
+        selectinload(DarwinSchedule.associated_to).options(
+            lazyload("*"),
+            selectinload(DarwinAssociation.assoc_schedule).options(
+                lazyload("*"),
+                selectinload(DarwinSchedule.destinations_rel).options(*calling_point_options()),
+            ),
+        ),
+        selectinload(DarwinSchedule.origins_rel).options(*calling_point_options()),
+        selectinload(DarwinSchedule.destinations_rel).options(*calling_point_options()),
+    ]
+
+
+def association_options(other_loc) -> list:
+    """Options for one side of DarwinScheduleLocation.complete_associations_dict()"""
+    return [
+        lazyload("*"),
+        selectinload(other_loc).options(
+            *calling_point_options(),
+            selectinload(DarwinScheduleLocation.schedule).options(*schedule_options()),
+        ),
+    ]
+
+
+def location_associations_options() -> list:
+    return [
+        selectinload(DarwinScheduleLocation.associated_from).options(*association_options(DarwinAssociation.main_schedule_loc)),
+        selectinload(DarwinScheduleLocation.associated_to).options(*association_options(DarwinAssociation.assoc_schedule_loc)),
+    ]
+
+
+def serialised_location_options(location=None, schedule=None, status=None) -> list:
+    """Options for DarwinScheduleLocation.serialise(True) on the queried calling points.
+    location, schedule and status can be given as contains_eager() where the query already joins them"""
+    return [
+        location if location is not None else location_option(),
+        status if status is not None else joinedload(DarwinScheduleLocation.status, innerjoin=True),
+        lazyload("*"),
+        (schedule if schedule is not None else joinedload(DarwinScheduleLocation.schedule, innerjoin=True)).options(*schedule_options()),
+        *location_associations_options(),
+    ]
+
+
+def serialised_schedule_options() -> list:
+    """Options for DarwinSchedule.serialise(True) on the queried schedules"""
+    return [
+        *schedule_options(),
+        selectinload(DarwinSchedule.formation),
+        selectinload(DarwinSchedule.locations).options(*calling_point_options(), *location_associations_options()),
+    ]
+
+
+# Profile name to options, for each entity. summary is columns only, and raises rather than lazy loading
+PROFILES = {
+    DarwinSchedule: {
+        "summary": lambda: [raiseload("*")],
+        "board": schedule_options,
+        "full-service": serialised_schedule_options,
+    },
+    DarwinScheduleLocation: {
+        "summary": lambda: [raiseload("*")],
+        "board": serialised_location_options,
+    },
+}
+
+
+def profile_options(entity, profile: str) -> list:
+    options = PROFILES.get(entity, {}).get(profile)
+    if options is None:
+        raise ValueError("No loading profile {} for {}".format(profile, getattr(entity, "__name__", entity)))
+    return options()
+
+
+def with_profile(query: Query, profile: str) -> Query:
+    """query, loading its first entity according to profile"""
+    return query.options(*profile_options(query.column_descriptions[0]["entity"], profile))
+
+
+def profile_names(entity) -> List[str]:
+    return list(PROFILES.get(entity, ()))
@@ -0,0 +1,123 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from sqlalchemy.orm import Session
+
+import writes
+from models import DarwinMessage
+
+
+def _codes(crs: Union[str, Iterable[str]]) -> List[str]:
+    return [crs] if isinstance(crs, str) else list(dict.fromkeys(crs))
+
+
+def station_filters(crs: Union[str, Iterable[str]], min_severity: Optional[int]=None, max_severity: Optional[int]=None, suppressed: bool=False) -> list:
+    """Criteria for messages affecting a CRS, or any of several. Both forms are served by the GIN index on stations"""
+    codes = _codes(crs)
+    filters = [DarwinMessage.stations.contains(codes) if len(codes) == 1 else DarwinMessage.stations.overlap(codes)]
+    if min_severity is not None:
+        filters.append(DarwinMessage.severity >= min_severity)
+    if max_severity is not None:
+        filters.append(DarwinMessage.severity <= max_severity)
+    if not suppressed:
+        filters.append(DarwinMessage.suppress == False)
+    return filters
+
+
+def get_station_messages(session: Session, crs: Union[str, Iterable[str]], min_severity: Optional[int]=None, max_severity: Optional[int]=None,
+        suppressed: bool=False, index: Optional["MessageIndex"]=None) -> List[DarwinMessage]:
+    """Messages affecting crs (one code or several), most severe first. Suppressed messages are left out unless suppressed.
+    Given a loaded index, matching ids come from it and only those rows are fetched, by primary key"""
+    query = session.query(DarwinMessage)
+    if index is not None and index.loaded:
+        ids = index.ids(crs, min_severity, max_severity, suppressed)
+        if not ids:
+            return []
+        query = query.filter(DarwinMessage.message_id.in_(ids))
+    else:
+        query = query.filter(*station_filters(crs, min_severity, max_severity, suppressed))
+    return query.order_by(DarwinMessage.severity.desc(), DarwinMessage.message_id).all()
+
+
+class MessageIndex:
+    """In-process inverted index of CRS to ids of current messages.
+    Once attached, it follows messages added, changed or deleted through ORM sessions, applied when they commit.
+    Writes that bypass the ORM (Core inserts, Query.delete()) need add() and remove() called for them"""
+    def __init__(self):
+        self._by_crs: Dict[str, Set[int]] = {}
+        # id to (stations, severity, suppress)
+        self._messages: Dict[int, Tuple[Tuple[str, ...], int, bool]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._attached = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self, session: Session):
+        rows = session.query(DarwinMessage.message_id, DarwinMessage.stations, DarwinMessage.severity, DarwinMessage.suppress).all()
+        with self._lock:
+            self._by_crs = {}
+            self._messages = {}
+            for row in rows:
+                self._add(*row)
+            self._loaded = True
+
+    def add(self, message_id: int, stations: Iterable[str], severity: int, suppress: bool):
+        """Index a message, replacing whatever was indexed under its id"""
+        with self._lock:
+            self._remove(message_id)
+            self._add(message_id, stations, severity, suppress)
+
+    def remove(self, message_id: int):
+        with self._lock:
+            self._remove(message_id)
+
+    def _add(self, message_id, stations, severity, suppress):
+        stations = tuple(stations or ())
+        self._messages[message_id] = (stations, severity, suppress)
+        for crs in stations:
+            self._by_crs.setdefault(crs, set()).add(message_id)
+
+    def _remove(self, message_id):
+        indexed = self._messages.pop(message_id, None)
+        if indexed is None:
+            return
+        for crs in indexed[0]:
+            ids = self._by_crs.get(crs)
+            if ids is not None:
+                ids.discard(message_id)
+                if not ids:
+                    del self._by_crs[crs]
+
+    def ids(self, crs: Union[str, Iterable[str]], min_severity: Optional[int]=None, max_severity: Optional[int]=None, suppressed: bool=False) -> List[int]:
+        """Ids of messages affecting crs (one code or several), filtered as station_filters() would"""
+        with self._lock:
+            found = set()
+            for code in _codes(crs):
+                found.update(self._by_crs.get(code, ()))
+            out = []
+            for message_id in found:
+                stations, severity, suppress = self._messages[message_id]
+                if (min_severity is None or severity >= min_severity) and (max_severity is None or severity <= max_severity) and (suppressed or not suppress):
+                    out.append(message_id)
+        return sorted(out)
+
+    def attach(self, target=Session):
+        """Follow ORM writes of target, a Session class, sessionmaker or session"""
+        writes.session_writes(target).subscribe(commit_listener=self._committed, instances=("messages",))
+        self._attached = target
+
+    def detach(self):
+        if self._attached is None:
+            return
+        writes.session_writes(self._attached).unsubscribe(commit_listener=self._committed)
+        self._attached = None
+
+    def _committed(self, written, instances):
+        for (message_id,), message in instances.get("messages", {}).items():
+            if message is None:
+                self.remove(message_id)
+            else:
+                self.add(message_id, message.stations, message.severity, message.suppress)
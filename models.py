@@ -1,41 +1,97 @@
 from collections import OrderedDict
 import datetime
-from decimal import Decimal
 from typing import Optional, Tuple, List
 
 import sqlalchemy
-from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy import Column, ForeignKey, ForeignKeyConstraint, UniqueConstraint, CHAR, VARCHAR, JSON, SMALLINT, INTEGER, DATE, BOOLEAN, TIMESTAMP, TIME, ARRAY
+from sqlalchemy.orm import Session, sessionmaker, relationship
+from sqlalchemy import event, select, Column, ForeignKey, ForeignKeyConstraint, UniqueConstraint, PrimaryKeyConstraint, Index, CHAR, VARCHAR, JSON, SMALLINT, INTEGER, DATE, BOOLEAN, TIMESTAMP, TIME, ARRAY
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
 
+import darwin_time as darwin_time_engine
 
-def _compare_time(t1, t2) -> int:
-    if not (t1 and t2):
-        return 0
-    t1,t2 = [a.hour*3600+a.minute*60+a.second for a in (t1,t2)]
-    return (Decimal(t1)-Decimal(t2))/3600
 
 def _combine_darwin_time(working_time, darwin_time) -> datetime.datetime:
-    if not working_time or not darwin_time:
-        return None
-
-    # Crossed midnight, increment ssd offset
-    if _compare_time(darwin_time, working_time) < -6:
-        ssd_offset = +1
-    # Normal increase or decrease, nothing we really need to do here
-    elif -6 <= _compare_time(darwin_time, working_time) <= +18:
-        ssd_offset = 0
-    # Back in time, crossed midnight (in reverse), decrement ssd offset
-    elif +18 < _compare_time(darwin_time, working_time):
-        ssd_offset = -1
-
-    return datetime.datetime.combine(working_time.date(), darwin_time) + datetime.timedelta(days=ssd_offset)
+    return darwin_time_engine.combine(working_time, darwin_time)
 
 
 Base = declarative_base()
 
-def create_all(engine):
-    Base.metadata.create_all(engine)
+# Set by reference.ReferenceCache.install(), used in place of lazy loading reference relationships
+reference_cache = None
+
+
+def reference_cache_loaded() -> bool:
+    """Whether reference data can come from the cache, which needn't be installed, loaded yet or fresh"""
+    return reference_cache is not None and not reference_cache.stale
+
+
+def _resolve_location(obj):
+    if reference_cache_loaded() and "location" not in obj.__dict__:
+        location = reference_cache.location(obj.tiploc)
+        if location:
+            return location
+    return obj.location
+
+# Range partitioned by ssd when created with partitioned=True. Every unique key of a partitioned table must include
+# the partition key, and foreign keys can't reference one by rid alone, so in that mode these gain ssd in their keys and
+# lose their foreign keys between each other
+PARTITIONED_TABLES = ("darwin_schedules", "darwin_schedule_locations", "darwin_schedule_status", "darwin_associations", "darwin_formations")
+
+
+def _partitioned_metadata() -> sqlalchemy.MetaData:
+    metadata = sqlalchemy.MetaData()
+    for table in Base.metadata.sorted_tables:
+        if table.name not in PARTITIONED_TABLES:
+            # So that remaining foreign keys resolve, these already exist by the time they'd be created
+            table.tometadata(metadata)
+            continue
+
+        columns = []
+        for column in table.columns:
+            foreign_keys = [ForeignKey(a.target_fullname) for a in column.foreign_keys if a.column.table.name not in PARTITIONED_TABLES]
+            columns.append(Column(column.name, column.type, *foreign_keys, nullable=column.nullable and column.name != "ssd", index=column.index))
+
+        constraints = [PrimaryKeyConstraint(*[a.name for a in table.primary_key.columns if a.name != "ssd"], "ssd")]
+        for constraint in table.constraints:
+            if isinstance(constraint, UniqueConstraint) and not isinstance(constraint, PrimaryKeyConstraint):
+                constraints.append(UniqueConstraint(*[a.name for a in constraint.columns if a.name != "ssd"], "ssd"))
+
+        sqlalchemy.Table(table.name, metadata, *columns, *constraints, postgresql_partition_by="RANGE (ssd)")
+    return metadata
+
+
+def _upgrade(engine):
+    """Columns and indexes added since tables were first created, which create_all() leaves alone on existing tables"""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as connection:
+        # Carried from the schedule to partition by, so filled in from it where just added
+        for table, rid in (("darwin_schedule_locations", "rid"), ("darwin_schedule_status", "rid"), ("darwin_associations", "main_rid"), ("darwin_formations", "rid")):
+            if "ssd" not in {a["name"] for a in sqlalchemy.inspect(connection).get_columns(table)}:
+                connection.execute(sqlalchemy.text("ALTER TABLE {} ADD COLUMN IF NOT EXISTS ssd DATE".format(table)))
+                connection.execute(sqlalchemy.text("UPDATE {0} SET ssd = darwin_schedules.ssd FROM darwin_schedules WHERE darwin_schedules.rid = {0}.{1}".format(table, rid)))
+        connection.execute(sqlalchemy.text("DROP INDEX IF EXISTS ix_darwin_messages_stations"))
+        connection.execute(sqlalchemy.text("CREATE INDEX IF NOT EXISTS ix_darwin_messages_stations_gin ON darwin_messages USING gin (stations)"))
+        for column, type_ in (("ta_resolved", "TIMESTAMP"), ("tp_resolved", "TIMESTAMP"), ("td_resolved", "TIMESTAMP"), ("delay_minutes", "SMALLINT")):
+            connection.execute(sqlalchemy.text("ALTER TABLE darwin_schedule_status ADD COLUMN IF NOT EXISTS {} {}".format(column, type_)))
+            connection.execute(sqlalchemy.text("CREATE INDEX IF NOT EXISTS ix_darwin_schedule_status_{0} ON darwin_schedule_status ({0})".format(column)))
+        for index in DarwinLocation.__table__.indexes:
+            if index.name.endswith("_trgm"):
+                index.create(connection, checkfirst=True)
+
+
+def create_all(engine, partitioned=False):
+    """If partitioned, darwin schedule tables are partitioned by ssd, and need partitions created (see partitioning.py)"""
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            connection.execute(sqlalchemy.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    if not partitioned:
+        Base.metadata.create_all(engine)
+    else:
+        Base.metadata.create_all(engine, tables=[a for a in Base.metadata.sorted_tables if a.name not in PARTITIONED_TABLES])
+        _partitioned_metadata().create_all(engine)
+    _upgrade(engine)
 
 
 class SwallowDebug(Base):
@@ -122,8 +178,29 @@ class DarwinReason(Base):
         return "<DarwinReason {}{} - {}>".format(self.id, self.type, self.message)
 
 
+def serialise_location(location, short=True) -> OrderedDict:
+    """Of a DarwinLocation or reference.CachedLocation"""
+    out = OrderedDict([
+        ("tiploc", location.tiploc),
+        ("location_category", location.category),
+        ("crs_darwin", location.crs_darwin),
+        ("name_short", location.name_short),
+        ("name_full", location.name_full),
+    ])
+    if not short:
+        out.update(OrderedDict([
+
+        ]))
+    return out
+
+
 class DarwinLocation(Base):
     __tablename__ = "darwin_locations"
+    # For station_search.search_sql(); these need the pg_trgm extension, which create_all() creates
+    __table_args__ = tuple(
+        Index("ix_darwin_locations_{}_trgm".format(a), a, postgresql_using="gin", postgresql_ops={a: "gin_trgm_ops"})
+        for a in ("name_short", "name_full", "name_darwin", "name_corpus", "name_bplan", "crs_darwin", "crs_corpus")
+    )
     tiploc = Column(VARCHAR(7), nullable=False, unique=True, primary_key=True, index=True)
     crs_darwin = Column(VARCHAR(3), index=True)
     crs_corpus = Column(VARCHAR(3))
@@ -148,18 +225,7 @@ class DarwinLocation(Base):
         return "<DarwinLocation {} - {}>".format(self.tiploc, self.name_short)
 
     def serialise(self, short=True):
-        out = OrderedDict([
-            ("tiploc", self.tiploc),
-            ("location_category", self.category),
-            ("crs_darwin", self.crs_darwin),
-            ("name_short", self.name_short),
-            ("name_full", self.name_full),
-        ])
-        if not short:
-            out.update(OrderedDict([
-
-            ]))
-        return out
+        return serialise_location(self, short)
 
 
 class DarwinSchedule(Base):
@@ -195,12 +261,12 @@ class DarwinSchedule(Base):
 
     locations = relationship("DarwinScheduleLocation", lazy="select", uselist=True, primaryjoin="foreign(DarwinSchedule.rid)==DarwinScheduleLocation.rid", order_by="DarwinScheduleLocation.index")
 
-    origins_rel = relationship("DarwinScheduleLocation", uselist=True, lazy="joined", primaryjoin="and_(foreign(DarwinSchedule.rid)==DarwinScheduleLocation.rid, DarwinScheduleLocation.loc_type.like('%OR'))")
-    destinations_rel = relationship("DarwinScheduleLocation", uselist=True, lazy="joined", primaryjoin="and_(foreign(DarwinSchedule.rid)==DarwinScheduleLocation.rid, DarwinScheduleLocation.loc_type.like('%DT'))")
+    origins_rel = relationship("DarwinScheduleLocation", uselist=True, lazy="select", primaryjoin="and_(foreign(DarwinSchedule.rid)==DarwinScheduleLocation.rid, DarwinScheduleLocation.loc_type.like('%OR'))")
+    destinations_rel = relationship("DarwinScheduleLocation", uselist=True, lazy="select", primaryjoin="and_(foreign(DarwinSchedule.rid)==DarwinScheduleLocation.rid, DarwinScheduleLocation.loc_type.like('%DT'))")
 
 
-    associated_to = relationship("DarwinAssociation", uselist=True, lazy="joined", primaryjoin="foreign(DarwinSchedule.rid)==DarwinAssociation.main_rid")
-    associated_from = relationship("DarwinAssociation", uselist=True, lazy="joined", primaryjoin="foreign(DarwinSchedule.rid)==DarwinAssociation.assoc_rid")
+    associated_to = relationship("DarwinAssociation", uselist=True, lazy="select", primaryjoin="foreign(DarwinSchedule.rid)==DarwinAssociation.main_rid")
+    associated_from = relationship("DarwinAssociation", uselist=True, lazy="select", primaryjoin="foreign(DarwinSchedule.rid)==DarwinAssociation.assoc_rid")
 
     formation = relationship("DarwinScheduleFormation", uselist=True, lazy="select", primaryjoin="foreign(DarwinSchedule.rid)==DarwinScheduleFormation.rid", order_by="DarwinScheduleFormation.seq")
 
@@ -252,12 +318,15 @@ class DarwinScheduleLocation(Base):
     rid = Column(CHAR(15), ForeignKey("darwin_schedules.rid"), nullable=False, primary_key=True)
     rid_constraint = ForeignKeyConstraint(("rid",), ("darwin_schedules.rid",), ondelete="CASCADE")
     schedule = relationship("DarwinSchedule", uselist=False, lazy="joined", innerjoin=True)
+    # The schedule's, carried here to partition by
+    ssd = Column(DATE, default=None)
 
     index = Column(SMALLINT, primary_key=True)
     loc_type = Column(VARCHAR(4), nullable=False, name="type")
 
     tiploc = Column(VARCHAR(7), ForeignKey("darwin_locations.tiploc"), nullable=False, index=True)
     location: DarwinLocation = relationship("DarwinLocation", uselist=False)
+    resolved_location = property(_resolve_location)
 
     activity = Column(VARCHAR(12), nullable=False)
     original_wt = Column(VARCHAR(18))
@@ -277,30 +346,11 @@ class DarwinScheduleLocation(Base):
         foreign(DarwinScheduleLocation.tiploc)==DarwinScheduleStatus.tiploc
         )""", innerjoin=True)
 
-    associated_to = relationship("DarwinAssociation", lazy="joined", uselist=True, primaryjoin="and_(foreign(DarwinScheduleLocation.rid)==DarwinAssociation.main_rid, foreign(DarwinScheduleLocation.original_wt)==DarwinAssociation.main_original_wt)")
-    associated_from = relationship("DarwinAssociation", lazy="joined", uselist=True, primaryjoin="and_(foreign(DarwinScheduleLocation.rid)==DarwinAssociation.assoc_rid, foreign(DarwinScheduleLocation.original_wt)==DarwinAssociation.assoc_original_wt)")
+    associated_to = relationship("DarwinAssociation", lazy="select", uselist=True, primaryjoin="and_(foreign(DarwinScheduleLocation.rid)==DarwinAssociation.main_rid, foreign(DarwinScheduleLocation.original_wt)==DarwinAssociation.main_original_wt)")
+    associated_from = relationship("DarwinAssociation", lazy="select", uselist=True, primaryjoin="and_(foreign(DarwinScheduleLocation.rid)==DarwinAssociation.assoc_rid, foreign(DarwinScheduleLocation.original_wt)==DarwinAssociation.assoc_original_wt)")
 
     def complete_times_dict(self) -> dict:
-        out = OrderedDict()
-        for letter, name in zip("apd", ["arrival", "pass", "departure"]):
-            this_times = OrderedDict()
-
-            wt = getattr(self, "wt%s" % letter)
-            if wt:
-                this_times["working"] = wt
-
-            pt = getattr(self, "pt%s" % letter, None)
-            if pt:
-                this_times["public"] = pt
-
-            st = _combine_darwin_time(wt, getattr(self.status, "t%s" % letter))
-            stt = getattr(self.status, "t%s_type" % letter)
-            if st and stt:
-                this_times["actual"*(stt=="A") or "estimated"] = st
-
-            out[name] = this_times
-
-        return out
+        return darwin_time_engine.complete_times_dict(self)
 
     def complete_associations(self) -> List[Tuple[bool, "DarwinAssociation"]]:
         return [(True, a) for a in self.associated_from] + [(False, a) for a in self.associated_to]
@@ -344,7 +394,7 @@ class DarwinScheduleLocation(Base):
                 ])),
             ("associations", self.complete_associations_dict() if source == "SC" and not limit_associations else [])
             ])
-        here.update(self.location.serialise(True))
+        here.update(self.resolved_location.serialise(True))
 
         if not recurse:
             return here
@@ -363,12 +413,15 @@ class DarwinAssociation(Base):
     category = Column(CHAR(2), nullable=False)
     tiploc = Column(VARCHAR(7), ForeignKey("darwin_locations.tiploc"), nullable=False, index=True, primary_key=True)
     location = relationship("DarwinLocation", uselist=False, lazy="select")
+    resolved_location = property(_resolve_location)
 
     # main
 
     main_rid = Column(CHAR(15), ForeignKey("darwin_schedules.rid"), nullable=False, index=True, primary_key=True)
     main_rid_constraint = ForeignKeyConstraint(("main_rid",), ("darwin_schedules.rid",), ondelete="CASCADE")
     main_original_wt = Column(VARCHAR(18), nullable=False, index=True, primary_key=True)
+    # The main schedule's, carried here to partition by
+    ssd = Column(DATE, default=None)
 
 
     main_schedule = relationship("DarwinSchedule", foreign_keys=(main_rid,), uselist=False)
@@ -407,7 +460,10 @@ class DarwinScheduleStatus(Base):
     rid = Column(CHAR(15), nullable=False, primary_key=True) # Technically a schedule ref but putting it as a foreign key screws everything up sorry
     tiploc = Column(VARCHAR(7), ForeignKey("darwin_locations.tiploc"), index=True, primary_key=True)
     location = relationship("DarwinLocation", uselist=False)
+    resolved_location = property(_resolve_location)
     original_wt = Column(VARCHAR(18), index=True, primary_key=True)
+    # The schedule's, carried here to partition by
+    ssd = Column(DATE, default=None)
 
     ta = Column(TIME, default=None, index=True)
     tp = Column(TIME, default=None, index=True)
@@ -425,6 +481,13 @@ class DarwinScheduleStatus(Base):
     tp_delayed = Column(BOOLEAN, nullable=False)
     td_delayed = Column(BOOLEAN, nullable=False)
 
+    # ta, tp and td combined with the location's working times across midnight, and the delay of the latest of them
+    # against public (or else working) time. Set on write by status_times.resolve(), not by the ORM
+    ta_resolved = Column(TIMESTAMP, default=None, index=True)
+    tp_resolved = Column(TIMESTAMP, default=None, index=True)
+    td_resolved = Column(TIMESTAMP, default=None, index=True)
+    delay_minutes = Column(SMALLINT, default=None, index=True)
+
     plat = Column(VARCHAR, default=None)
     plat_suppressed = Column(BOOLEAN)
     plat_cis_suppressed = Column(BOOLEAN)
@@ -445,6 +508,8 @@ class DarwinScheduleStatus(Base):
 class DarwinScheduleFormation(Base):
     __tablename__ = "darwin_formations"
     rid = Column(CHAR(15), nullable=False, primary_key=True, index=True)
+    # The schedule's, carried here to partition by
+    ssd = Column(DATE, default=None)
     fid = Column(CHAR(19), nullable=False, primary_key=True, index=True)
     seq = Column(SMALLINT, nullable=False, index=True)
     coach_number = Column(VARCHAR, nullable=False, primary_key=True)
@@ -464,11 +529,17 @@ class DarwinScheduleFormation(Base):
 
 class DarwinMessage(Base):
     __tablename__ = "darwin_messages"
+    __table_args__ = (
+        # For containment and overlap (@>, &&) on stations, which a btree can't serve
+        Index("ix_darwin_messages_stations_gin", "stations", postgresql_using="gin"),
+    )
+
     message_id = Column(INTEGER, nullable=False, primary_key=True, unique=True, index=True)
     category = Column(VARCHAR, nullable=False)
     severity = Column(SMALLINT, nullable=False)
     suppress = Column(BOOLEAN, nullable=False)
-    stations = Column(ARRAY(VARCHAR(3)), nullable=False, index=True)
+    # The PostgreSQL type, for its contains() and overlap() operators
+    stations = Column(postgresql.ARRAY(VARCHAR(3)), nullable=False)
     message = Column(VARCHAR, nullable=False)
 
     def serialise(self, recurse=False):
@@ -488,3 +559,39 @@ class LastReceivedSequence(Base):
     sequence = Column(INTEGER, nullable=False)
     time_acquired = Column(TIMESTAMP, nullable=False)
 
+
+
+# Child rows carry their (main) schedule's ssd to partition by. ingest.BulkWriter fills it in for itself, this for
+# whatever's written through the ORM: from a schedule in the same flush or session, otherwise from the database
+_SSD_MODELS = ((DarwinScheduleLocation, "rid"), (DarwinScheduleStatus, "rid"), (DarwinAssociation, "main_rid"), (DarwinScheduleFormation, "rid"))
+
+
+@event.listens_for(Session, "before_flush")
+def _fill_ssd(session, flush_context, instances):
+    missing = []
+    for obj in session.new:
+        for model, rid in _SSD_MODELS:
+            if isinstance(obj, model):
+                if obj.ssd is None:
+                    missing.append((obj, getattr(obj, rid)))
+                break
+    if not missing:
+        return
+
+    ssds = {}
+    for obj in session.new:
+        if isinstance(obj, DarwinSchedule):
+            ssds[obj.rid] = obj.ssd
+    unknown = set()
+    for _, rid in missing:
+        if rid not in ssds:
+            schedule = session.identity_map.get(session.identity_key(DarwinSchedule, rid))
+            if schedule is not None:
+                ssds[rid] = schedule.ssd
+            else:
+                unknown.add(rid)
+    if unknown:
+        table = DarwinSchedule.__table__
+        ssds.update(session.connection().execute(select([table.c.rid, table.c.ssd]).where(table.c.rid.in_(unknown))).fetchall())
+    for obj, rid in missing:
+        obj.ssd = ssds.get(rid)
@@ -0,0 +1,186 @@
+import datetime
+import heapq
+from array import array
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import select, or_
+
+from models import BPlanNetworkLink
+
+WEIGHTS = ("distance", "route_allowance")
+
+# Links in bplan_network_links that can be run in reverse as well, as DarwinLocation.lines has it
+REVERSIBLE = ("B", "R")
+
+
+class Route(NamedTuple):
+    cost: int
+    tiplocs: Tuple[str, ...]
+
+
+class Constraints(NamedTuple):
+    """What a link must allow to be used. power is the set of acceptable power codes, None for any"""
+    power: Optional[FrozenSet[str]] = None
+    doo_passenger: bool = False
+    doo_non_passenger: bool = False
+
+
+_DOO_PASSENGER = 1
+_DOO_NON_PASSENGER = 2
+
+
+class NetworkGraph:
+    """The BPlan network valid on one date, as a compressed adjacency list: the links out of node i are
+    targets[offsets[i]:offsets[i+1]], with their weights and flags in arrays alongside. Tiplocs are interned to node ids.
+    Parallel links (different running lines) are kept, so constraints can pick between them"""
+    def __init__(self, links: Iterable, date: Optional[datetime.date]=None):
+        self.date = date
+        self.tiplocs = []  # type: List[str]
+        self.ids = {}  # type: Dict[str, int]
+
+        edges = []
+        for link in links:
+            origin, destination = self._intern(link.origin), self._intern(link.destination)
+            flags = (_DOO_PASSENGER if link.doo_passenger else 0) | (_DOO_NON_PASSENGER if link.doo_non_passenger else 0)
+            # Unknown distances are -1, and those links aren't used when weighting by distance
+            edge = (link.distance if link.distance is not None else -1, link.route_allowance, ord(link.power or " "), flags)
+            edges.append((origin, destination) + edge)
+            if link.reversible in REVERSIBLE:
+                edges.append((destination, origin) + edge)
+        edges.sort()
+
+        self.offsets = array("l", [0])*(len(self.tiplocs)+1)
+        self.targets = array("l", [a[1] for a in edges])
+        self.weights = {
+            "distance": array("l", [a[2] for a in edges]),
+            "route_allowance": array("l", [a[3] for a in edges]),
+        }
+        self.power = array("B", [a[4] for a in edges])
+        self.flags = array("B", [a[5] for a in edges])
+        for origin, *_ in edges:
+            self.offsets[origin+1] += 1
+        for i in range(len(self.tiplocs)):
+            self.offsets[i+1] += self.offsets[i]
+
+        self._allowed = {}  # type: Dict[Tuple[str, Constraints], bytearray]
+        self._legs = {}  # type: Dict[tuple, Optional[Route]]
+
+    def _intern(self, tiploc: str) -> int:
+        id = self.ids.get(tiploc)
+        if id is None:
+            id = self.ids[tiploc] = len(self.tiplocs)
+            self.tiplocs.append(tiploc)
+        return id
+
+    def __len__(self):
+        return len(self.tiplocs)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.targets)
+
+    def neighbours(self, tiploc: str) -> List[str]:
+        id = self.ids.get(tiploc)
+        if id is None:
+            return []
+        return list(dict.fromkeys(self.tiplocs[a] for a in self.targets[self.offsets[id]:self.offsets[id+1]]))
+
+    def allowed(self, weight: str, constraints: Constraints) -> bytearray:
+        """Which edges are usable for weight under constraints, worked out once per combination"""
+        key = (weight, constraints)
+        mask = self._allowed.get(key)
+        if mask is not None:
+            return mask
+        if weight not in self.weights:
+            raise ValueError("Can't weight by {}, only {}".format(weight, ", ".join(WEIGHTS)))
+        power = None if constraints.power is None else {ord(a) for a in constraints.power}
+        required = (_DOO_PASSENGER if constraints.doo_passenger else 0) | (_DOO_NON_PASSENGER if constraints.doo_non_passenger else 0)
+        weights = self.weights[weight]
+        mask = bytearray(
+            weights[i] >= 0 and (power is None or self.power[i] in power) and self.flags[i] & required == required
+            for i in range(len(self.targets)))
+        self._allowed[key] = mask
+        return mask
+
+    def _search(self, source: int, target: Optional[int], weight: str, constraints: Constraints) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """Dijkstra from source, stopping early once target is settled. Returns costs and predecessors by node id"""
+        allowed = self.allowed(weight, constraints)
+        weights, targets, offsets = self.weights[weight], self.targets, self.offsets
+        costs = {source: 0}
+        previous = {}
+        settled = set()
+        heap = [(0, source)]
+        while heap:
+            cost, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            if node == target:
+                break
+            for edge in range(offsets[node], offsets[node+1]):
+                if not allowed[edge]:
+                    continue
+                next_node = targets[edge]
+                next_cost = cost + weights[edge]
+                if next_cost < costs.get(next_node, next_cost + 1):
+                    costs[next_node] = next_cost
+                    previous[next_node] = node
+                    heapq.heappush(heap, (next_cost, next_node))
+        return {a: costs[a] for a in settled}, previous
+
+    def route(self, origin: str, destination: str, weight: str="distance", constraints: Constraints=Constraints()) -> Optional[Route]:
+        """Cheapest route from origin to destination, or None if there isn't one"""
+        key = (origin, destination, weight, constraints)
+        if key in self._legs:
+            return self._legs[key]
+        source, target = self.ids.get(origin), self.ids.get(destination)
+        out = None
+        if source is not None and target is not None:
+            costs, previous = self._search(source, target, weight, constraints)
+            if target in costs:
+                path = [target]
+                while path[-1] != source:
+                    path.append(previous[path[-1]])
+                out = Route(costs[target], tuple(self.tiplocs[a] for a in reversed(path)))
+        self._legs[key] = out
+        return out
+
+    def distance(self, origin: str, destination: str, weight: str="distance", constraints: Constraints=Constraints()) -> Optional[int]:
+        route = self.route(origin, destination, weight, constraints)
+        return route.cost if route else None
+
+    def distances_from(self, origin: str, weight: str="distance", constraints: Constraints=Constraints()) -> Dict[str, int]:
+        """Cost to every reachable tiploc from origin"""
+        source = self.ids.get(origin)
+        if source is None:
+            return {}
+        costs, _ = self._search(source, None, weight, constraints)
+        return {self.tiplocs[a]: b for a, b in costs.items()}
+
+    def service_route(self, tiplocs: Sequence[str], weight: str="distance", constraints: Constraints=Constraints()) -> Optional[Route]:
+        """Route through each of tiplocs in turn, such as a service's calling points. Legs are cached, as services share them"""
+        total = 0
+        path = list(tiplocs[:1])
+        for origin, destination in zip(tiplocs, tiplocs[1:]):
+            if origin == destination:
+                continue
+            leg = self.route(origin, destination, weight, constraints)
+            if leg is None:
+                return None
+            total += leg.cost
+            path.extend(leg.tiplocs[1:])
+        return Route(total, tuple(path))
+
+
+def valid_links(date: Optional[datetime.date]=None):
+    """Query for the links valid on date, or every link if date is None"""
+    query = select([BPlanNetworkLink.__table__])
+    if date is not None:
+        query = query.where(or_(BPlanNetworkLink.start_date == None, BPlanNetworkLink.start_date <= date))\
+            .where(or_(BPlanNetworkLink.end_date == None, BPlanNetworkLink.end_date >= date))
+    return query
+
+
+def load(connection, date: Optional[datetime.date]=None) -> NetworkGraph:
+    """The network valid on date, from a Connection or Session"""
+    return NetworkGraph(connection.execute(valid_links(date)), date)
@@ -0,0 +1,66 @@
+import datetime
+from typing import List, Tuple, Iterable
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+import board_rows
+from models import PARTITIONED_TABLES
+
+
+def partition_name(table: str, day: datetime.date) -> str:
+    return "{}_{:%Y%m%d}".format(table, day)
+
+
+def ssd_window(start: datetime.datetime, end: datetime.datetime) -> Tuple[datetime.date, datetime.date]:
+    """Service dates that can have calling points between start and end. Services run past midnight, not past a day"""
+    return start.date() - datetime.timedelta(days=1), end.date()
+
+
+def create_partitions(connection: Connection, day: datetime.date):
+    """Partitions of every partitioned table for one service date, if they don't exist already"""
+    for table in PARTITIONED_TABLES:
+        connection.execute(text("CREATE TABLE IF NOT EXISTS \"{}\" PARTITION OF \"{}\" FOR VALUES FROM ('{:%Y-%m-%d}') TO ('{:%Y-%m-%d}')".format(
+            partition_name(table, day), table, day, day + datetime.timedelta(days=1))))
+
+
+def ensure_partitions(connection: Connection, days: Iterable[datetime.date]):
+    for day in sorted(set(days)):
+        create_partitions(connection, day)
+
+
+def ensure_partition_range(connection: Connection, start: datetime.date, end: datetime.date):
+    """Partitions for start to end inclusive, typically today to a few days ahead of the timetable"""
+    ensure_partitions(connection, [start + datetime.timedelta(days=a) for a in range((end - start).days + 1)])
+
+
+def partition_days(connection: Connection, table: str="darwin_schedules") -> List[datetime.date]:
+    """Service dates with a partition of table, by partition name"""
+    out = []
+    for (name,) in connection.execute(text("""SELECT child.relname FROM pg_inherits
+            INNER JOIN pg_class child ON child.oid=pg_inherits.inhrelid
+            INNER JOIN pg_class parent ON parent.oid=pg_inherits.inhparent
+            WHERE parent.relname=:table"""), table=table):
+        suffix = name[len(table)+1:]
+        if name.startswith(table + "_") and len(suffix) == 8 and suffix.isdigit():
+            out.append(datetime.datetime.strptime(suffix, "%Y%m%d").date())
+    return sorted(out)
+
+
+def drop_day(connection: Connection, day: datetime.date):
+    """Detach and drop a whole service date from every partitioned table, and delete its board rows"""
+    board_rows.drop_day(connection, day)
+    for table in reversed(PARTITIONED_TABLES):
+        name = partition_name(table, day)
+        connection.execute(text('ALTER TABLE "{}" DETACH PARTITION "{}"'.format(table, name)))
+        connection.execute(text('DROP TABLE "{}"'.format(name)))
+
+
+def drop_before(connection: Connection, day: datetime.date) -> List[datetime.date]:
+    """Retention: drop every service date before day, returning those dropped. Board rows before day are deleted
+    whether or not their partitions are still there"""
+    dropped = [a for a in partition_days(connection) if a < day]
+    for ssd in dropped:
+        drop_day(connection, ssd)
+    board_rows.drop_before(connection, day)
+    return dropped
@@ -0,0 +1,147 @@
+import threading
+from types import MappingProxyType
+from typing import NamedTuple, Optional, Tuple, Mapping, Any
+
+from sqlalchemy.orm import Session
+
+import models
+from models import DarwinLocation, DarwinOperator, DarwinReason, LocalisedReference
+
+
+class CachedLocation(NamedTuple):
+    tiploc: str
+    crs_darwin: Optional[str]
+    crs_corpus: Optional[str]
+    operator: Optional[str]
+    name_short: Optional[str]
+    name_full: Optional[str]
+    dict_values: Any
+    category: Optional[str]
+    name_darwin: Optional[str]
+    name_corpus: Optional[str]
+    name_bplan: Optional[str]
+
+    @classmethod
+    def from_row(cls, row: DarwinLocation) -> "CachedLocation":
+        return cls(*[getattr(row, a) for a in cls._fields])
+
+    def serialise(self, short=True):
+        return models.serialise_location(self, short)
+
+
+class CachedOperator(NamedTuple):
+    operator: str
+    operator_name: Optional[str]
+    url: Optional[str]
+    category: Optional[str]
+
+    @classmethod
+    def from_row(cls, row: DarwinOperator) -> "CachedOperator":
+        return cls(*[getattr(row, a) for a in cls._fields])
+
+
+class CachedReason(NamedTuple):
+    id: int
+    type: str
+    message: Optional[str]
+
+    @classmethod
+    def from_row(cls, row: DarwinReason) -> "CachedReason":
+        return cls(*[getattr(row, a) for a in cls._fields])
+
+
+class ReferenceSnapshot(NamedTuple):
+    version: Any
+    locations: Mapping[str, CachedLocation]
+    locations_by_crs: Mapping[str, Tuple[CachedLocation, ...]]
+    operators: Mapping[str, CachedOperator]
+    reasons: Mapping[Tuple[int, str], CachedReason]
+    localised: Mapping[Tuple[str, str, str, str], str]
+
+
+def load_snapshot(session: Session, version=None) -> ReferenceSnapshot:
+    """Reads every reference table, one select each"""
+    locations = {}
+    by_crs = {}
+    for row in session.query(DarwinLocation).order_by(DarwinLocation.tiploc):
+        location = CachedLocation.from_row(row)
+        locations[location.tiploc] = location
+        if location.crs_darwin:
+            by_crs.setdefault(location.crs_darwin, []).append(location)
+
+    operators = {a.operator: CachedOperator.from_row(a) for a in session.query(DarwinOperator)}
+    reasons = {(a.id, a.type): CachedReason.from_row(a) for a in session.query(DarwinReason)}
+    localised = {(a.source, a.locale, a.code_type, a.code): a.description for a in session.query(LocalisedReference)}
+
+    return ReferenceSnapshot(
+        version,
+        MappingProxyType(locations),
+        MappingProxyType({k: tuple(v) for k, v in by_crs.items()}),
+        MappingProxyType(operators),
+        MappingProxyType(reasons),
+        MappingProxyType(localised),
+    )
+
+
+class ReferenceCache:
+    """Process-wide copy of locations, operators, reasons and localised references. Locations have lookups of their own,
+    the rest are on snapshot. None of it touches a session; the snapshot is replaced as a whole on refresh, so readers
+    don't need to lock"""
+    def __init__(self):
+        self._snapshot = None  # type: Optional[ReferenceSnapshot]
+        self._stale = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._snapshot is not None
+
+    @property
+    def stale(self) -> bool:
+        return self._stale or self._snapshot is None
+
+    @property
+    def version(self):
+        return self._snapshot.version if self._snapshot else None
+
+    def refresh(self, session: Session, version=None):
+        """(Re)load everything from the database. version is opaque, typically the reference data file in use"""
+        snapshot = load_snapshot(session, version)
+        with self._lock:
+            self._snapshot = snapshot
+            self._stale = False
+
+    load = refresh
+
+    def invalidate(self, version=None):
+        """Mark the cache stale, or only if version is given and differs from the loaded one"""
+        if version is None or version != self.version:
+            self._stale = True
+
+    def ensure(self, session: Session, version=None):
+        """Reload if stale or loaded for a different version"""
+        if self.stale or (version is not None and version != self.version):
+            self.refresh(session, version if version is not None else self.version)
+
+    def install(self):
+        """Have the models resolve reference data from this cache instead of lazy loading it"""
+        models.reference_cache = self
+
+    def uninstall(self):
+        if models.reference_cache is self:
+            models.reference_cache = None
+
+    @property
+    def snapshot(self) -> ReferenceSnapshot:
+        if self._snapshot is None:
+            raise RuntimeError("Reference cache used before being loaded")
+        return self._snapshot
+
+    def location(self, tiploc: str) -> Optional[CachedLocation]:
+        return self.snapshot.locations.get(tiploc)
+
+    def locations_for_crs(self, crs: str) -> Tuple[CachedLocation, ...]:
+        return self.snapshot.locations_by_crs.get(crs, ())
+
+
+CACHE = ReferenceCache()
@@ -0,0 +1,284 @@
+import functools
+import logging
+import select
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+import writes
+from models import DarwinSchedule, DarwinScheduleLocation
+
+# Cache of serialise() output by rid, invalidated by writes to anything a rid's output is made from. Cached dicts are
+# shared between callers: each gets its own copy of the top level, which is as deep as serialise() itself modifies one
+
+log = logging.getLogger(__name__)
+
+# Postgres limits a notification payload to just under 8000 bytes
+NOTIFY_RIDS = 400
+
+
+def _embedded_rids(obj, depth: int=2) -> Set[str]:
+    """rids whose schedules obj's serialised output includes through associations, to depth associations away.
+    Only looks at what serialise() loaded, so never queries"""
+    out = set()
+    for collection, rid, others in (("associated_from", "main_rid", ("main_schedule", "main_schedule_loc")), ("associated_to", "assoc_rid", ("assoc_schedule", "assoc_schedule_loc"))):
+        for association in obj.__dict__.get(collection, ()):
+            out.add(getattr(association, rid))
+            if depth <= 1:
+                continue
+            for attribute in others:
+                other = association.__dict__.get(attribute)
+                if isinstance(other, DarwinScheduleLocation):
+                    out |= _embedded_rids(other, depth-1)
+                    other = other.__dict__.get("schedule")
+                if other is not None:
+                    out |= _embedded_rids(other, depth-1)
+    return out
+
+
+class ResponseCache:
+    """LRU of serialised schedules and calling points, at most max_entries of them.
+    Dropping a rid also drops every cached rid that embeds it, and so on, which can be more than is strictly necessary"""
+    def __init__(self, max_entries: int=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_rid = {}  # type: Dict[str, Set[tuple]]
+        # rid to rids whose cached output embeds it, and the reverse, to prune those edges once a rid isn't cached
+        self._dependents = {}  # type: Dict[str, Set[str]]
+        self._embeds = {}  # type: Dict[str, Set[str]]
+        self._lock = threading.RLock()
+        self._wrapped = []
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        # Bumped by every invalidation, so that output serialised from data invalidated meanwhile isn't stored
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: tuple):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return OrderedDict(value)
+
+    def put(self, key: tuple, value, embeds: Iterable[str]=(), generation: Optional[int]=None):
+        """key[1] is the rid the value belongs to, and embeds those it includes parts of.
+        If generation is given and there have been invalidations since, value is dropped as possibly stale"""
+        rid = key[1]
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._by_rid.setdefault(rid, set()).add(key)
+            for other in embeds:
+                if other != rid:
+                    self._dependents.setdefault(other, set()).add(rid)
+                    self._embeds.setdefault(rid, set()).add(other)
+            while len(self._entries) > self.max_entries:
+                old, _ = self._entries.popitem(last=False)
+                self._discard_key(old)
+                self.evictions += 1
+
+    def _discard_key(self, key: tuple):
+        keys = self._by_rid.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_rid[key[1]]
+                self._discard_embeds(key[1])
+
+    def _discard_embeds(self, rid: str):
+        """Drop the edges from what rid embeds to it, once nothing of rid's is cached"""
+        for other in self._embeds.pop(rid, ()):
+            dependents = self._dependents.get(other)
+            if dependents is not None:
+                dependents.discard(rid)
+                if not dependents:
+                    del self._dependents[other]
+
+    def invalidate(self, rids: Iterable[str]):
+        with self._lock:
+            pending = list(rids)
+            seen = set()
+            self.generation += 1
+            while pending:
+                rid = pending.pop()
+                if rid in seen:
+                    continue
+                seen.add(rid)
+                for key in self._by_rid.pop(rid, ()):
+                    self._entries.pop(key, None)
+                    self.invalidations += 1
+                self._discard_embeds(rid)
+                pending.extend(self._dependents.pop(rid, ()))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_rid.clear()
+            self._dependents.clear()
+            self._embeds.clear()
+
+    def stats(self) -> OrderedDict:
+        return OrderedDict([("entries", len(self._entries)), ("hits", self.hits), ("misses", self.misses),
+            ("evictions", self.evictions), ("invalidations", self.invalidations)])
+
+    def schedule(self, schedule: DarwinSchedule, recurse: bool, _serialise=None) -> OrderedDict:
+        """schedule.serialise(recurse), cached"""
+        key = ("schedule", schedule.rid, recurse)
+        generation = self.generation
+        out = self.get(key)
+        if out is None:
+            out = (_serialise or DarwinSchedule.serialise)(schedule, recurse)
+            embeds = _embedded_rids(schedule)
+            if recurse:
+                for location in schedule.__dict__.get("locations", ()):
+                    embeds |= _embedded_rids(location)
+            self.put(key, out, embeds, generation)
+            out = OrderedDict(out)
+        return out
+
+    def location(self, location: DarwinScheduleLocation, recurse: bool, source: str="SC", limit_associations=False, _serialise=None) -> OrderedDict:
+        """location.serialise(recurse, source, limit_associations), cached"""
+        key = ("location", location.rid, location.index, recurse, source, limit_associations)
+        generation = self.generation
+        out = self.get(key)
+        if out is None:
+            out = (_serialise or DarwinScheduleLocation.serialise)(location, recurse, source, limit_associations)
+            embeds = _embedded_rids(location) if source == "SC" and not limit_associations else set()
+            if recurse and location.__dict__.get("schedule") is not None:
+                embeds |= _embedded_rids(location.schedule)
+            self.put(key, out, embeds, generation)
+            out = OrderedDict(out)
+        return out
+
+    def install(self):
+        """Have DarwinSchedule.serialise() and DarwinScheduleLocation.serialise() go through this cache"""
+        for model, method in ((DarwinSchedule, self.schedule), (DarwinScheduleLocation, self.location)):
+            original = model.__dict__["serialise"]
+
+            def wrapper(obj, *args, _original=original, _method=method, **kwargs):
+                return _method(obj, *args, _serialise=_original, **kwargs)
+
+            functools.update_wrapper(wrapper, original)
+            model.serialise = wrapper
+            self._wrapped.append((model, original))
+
+    def uninstall(self):
+        for model, original in self._wrapped:
+            model.serialise = original
+        self._wrapped = []
+
+
+class PostgresChannel:
+    """Invalidation through LISTEN/NOTIFY, so every worker's cache drops a rid written by any of them.
+    Notifications are sent inside the writing transaction, so they're delivered on commit and not at all on rollback"""
+    def __init__(self, engine: Engine, channel: str="swallow_response_cache"):
+        self.engine = engine
+        self.channel = channel
+        self._thread = None
+        self._stop = threading.Event()
+
+    def notify(self, connection: Connection, rids: Iterable[str]):
+        rids = sorted(set(rids))
+        for i in range(0, len(rids), NOTIFY_RIDS):
+            connection.execute(text("SELECT pg_notify(:channel, :payload)"), channel=self.channel, payload=",".join(rids[i:i+NOTIFY_RIDS]))
+
+    def start(self, cache: ResponseCache, timeout: float=5.0, reconnect_delay: float=5.0):
+        """Listen on a connection of its own, in a background thread, invalidating cache on every notification.
+        If the connection fails, it reconnects after reconnect_delay seconds, clearing cache as notifications may have been missed"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, args=(cache, timeout, reconnect_delay), name="response-cache-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _listen(self, cache: ResponseCache, timeout: float, reconnect_delay: float):
+        while not self._stop.is_set():
+            try:
+                self._listen_connection(cache, timeout)
+            except Exception:
+                log.warning("Response cache listener on %s failed, reconnecting in %ss", self.channel, reconnect_delay, exc_info=True)
+                self._stop.wait(reconnect_delay)
+
+    def _listen_connection(self, cache: ResponseCache, timeout: float):
+        # Detached from the pool, so it's closed at the end rather than going back to it in autocommit
+        connection = self.engine.raw_connection()
+        connection.detach()
+        dbapi_connection = connection.connection
+        isolation_level = dbapi_connection.isolation_level
+        try:
+            dbapi_connection.set_isolation_level(0)
+            cursor = dbapi_connection.cursor()
+            cursor.execute('LISTEN "{}"'.format(self.channel))
+            # Anything written while not listening may have been missed
+            cache.clear()
+            log.info("Response cache listening on %s", self.channel)
+            while not self._stop.is_set():
+                if select.select([dbapi_connection], [], [], timeout) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notification = dbapi_connection.notifies.pop(0)
+                    cache.invalidate(notification.payload.split(","))
+        finally:
+            try:
+                if not dbapi_connection.closed:
+                    dbapi_connection.set_isolation_level(isolation_level)
+            finally:
+                connection.close()
+
+
+class Invalidator:
+    """Follows writes through BulkWriters and ORM sessions, and invalidates the rids they touch once committed,
+    in this process directly and in others through channel if given"""
+    def __init__(self, cache: ResponseCache, channel: Optional[PostgresChannel]=None):
+        self.cache = cache
+        self.channel = channel
+        self._writers = []
+        self._sessions = []
+
+    def _after_write(self, connection: Connection, written: Dict[str, Set[str]]):
+        rids = writes.schedule_rids(written)
+        if rids and self.channel is not None:
+            self.channel.notify(connection, rids)
+
+    def _after_flush(self, session: Session, written: Dict[str, Set[str]]):
+        self._after_write(session.connection(), written)
+
+    def _committed(self, written: Dict[str, Set[str]], instances=None):
+        rids = writes.schedule_rids(written)
+        if rids:
+            self.cache.invalidate(rids)
+
+    def attach(self, writer=None, sessions=None):
+        """Follow writes through writer, an ingest.BulkWriter, and/or sessions, a Session class, sessionmaker or session"""
+        if writer is not None:
+            writer.listeners.append(self._after_write)
+            writer.commit_listeners.append(self._committed)
+            self._writers.append(writer)
+        if sessions is not None:
+            writes.session_writes(sessions).subscribe(self._after_flush, self._committed)
+            self._sessions.append(sessions)
+
+    def detach(self):
+        for writer in self._writers:
+            writer.listeners.remove(self._after_write)
+            writer.commit_listeners.remove(self._committed)
+        for sessions in self._sessions:
+            writes.session_writes(sessions).unsubscribe(self._after_flush, self._committed)
+        self._writers = []
+        self._sessions = []
@@ -0,0 +1,369 @@
+"""Columnar snapshot of one service day's schedules, calling points and statuses, for workers to memory map.
+Usage: python snapshot.py postgresql://localhost/swallow 2026-01-05 /var/lib/swallow/20260105.snap"""
+import datetime
+import json
+import mmap
+import os
+import sys
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import sqlalchemy
+from sqlalchemy import select
+from sqlalchemy.engine import Connection
+
+import darwin_time
+from export import LOCATION_COLUMNS, LOCATION_FROM
+from models import DarwinSchedule, DarwinScheduleLocation
+
+_schedules = DarwinSchedule.__table__
+_locations = DarwinScheduleLocation.__table__
+
+MAGIC = b"SWSNAP02"
+# Times are seconds from midnight at the start of the ssd, this one meaning none
+NONE = -2**31
+
+_FLAGS = ("is_active", "is_charter", "is_deleted", "is_passenger")
+_LOCATION_FLAGS = ("cancelled", "plat_suppressed", "plat_cis_suppressed", "plat_confirmed")
+_TIMES = ("pta", "wta", "wtp", "ptd", "wtd", "ta", "tp", "td")
+
+# Fixed width text columns of schedules, padded with spaces
+_FIXED = (("rid", 15), ("uid", 7), ("rsid", 8), ("signalling_id", 4), ("category", 2))
+_LOCATION_COLUMNS = (("schedule", "I"), ("position", "H"), ("tiploc", "I"), ("type", "H"), ("activity", "H"), ("plat", "H"), ("flags", "B"),
+    ("ta_type", "B"), ("tp_type", "B"), ("td_type", "B"), ("sort", "i")) + tuple((a, "i") for a in _TIMES)
+
+
+class SnapshotSchedule(NamedTuple):
+    index: int
+    rid: str
+    uid: str
+    rsid: Optional[str]
+    signalling_id: str
+    category: str
+    operator: str
+    is_active: bool
+    is_charter: bool
+    is_deleted: bool
+    is_passenger: bool
+
+
+class SnapshotLocation(NamedTuple):
+    """Times are seconds from the snapshot's ssd, see Snapshot.time_at(). ta, tp and td are resolved across midnight"""
+    index: int
+    schedule: int
+    position: int
+    tiploc: str
+    type: str
+    activity: str
+    pta: Optional[int]
+    wta: Optional[int]
+    wtp: Optional[int]
+    ptd: Optional[int]
+    wtd: Optional[int]
+    ta: Optional[int]
+    tp: Optional[int]
+    td: Optional[int]
+    ta_type: Optional[str]
+    tp_type: Optional[str]
+    td_type: Optional[str]
+    plat: Optional[str]
+    cancelled: bool
+    plat_suppressed: bool
+    plat_cis_suppressed: bool
+    plat_confirmed: bool
+
+
+class _Interner:
+    """String to id, id 0 being None"""
+    def __init__(self):
+        self.ids = {None: 0}
+        self.values = [None]
+
+    def __call__(self, value: Optional[str]) -> int:
+        id = self.ids.get(value)
+        if id is None:
+            id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return id
+
+    def pack(self) -> Tuple[array, bytes]:
+        return _pack_strings(self.values)
+
+
+def _pack_strings(values: List[Optional[str]]) -> Tuple[array, bytes]:
+    """A string table: string i is data[offsets[i]:offsets[i+1]]"""
+    offsets = array("I", [0])
+    data = bytearray()
+    for value in values:
+        data += (value or "").encode()
+        offsets.append(len(data))
+    return offsets, bytes(data)
+
+
+def _seconds(value, midnight: datetime.datetime) -> int:
+    if value is None:
+        return NONE
+    return int((value - midnight).total_seconds())
+
+
+def _fixed(values: List[Optional[str]], width: int) -> bytes:
+    return b"".join((a or "").encode().ljust(width)[:width] for a in values)
+
+
+def build(connection: Connection, ssd: datetime.date) -> Dict[str, Tuple[str, object]]:
+    """Columns of the snapshot of ssd, by name, as (typecode, array or bytes)"""
+    midnight = datetime.datetime.combine(ssd, datetime.time())
+    schedules = connection.execute(select([_schedules]).where(_schedules.c.ssd == ssd).order_by(_schedules.c.rid)).fetchall()
+    positions = {a.rid: i for i, a in enumerate(schedules)}
+
+    tiplocs, operators, types, activities, platforms, darwin_types = (_Interner() for _ in range(6))
+    columns = {}
+    for name, width in _FIXED:
+        columns["schedule_" + name] = ("B", _fixed([getattr(a, name) for a in schedules], width))
+    columns["schedule_operator"] = ("H", array("H", [operators(a.operator) for a in schedules]))
+    columns["schedule_flags"] = ("B", array("B", [sum(bool(getattr(a, b)) << i for i, b in enumerate(_FLAGS)) for a in schedules]))
+
+    location_offsets = array("I", [0])*(len(schedules)+1)
+    location_columns = {a: array(typecode) for a, typecode in _LOCATION_COLUMNS}
+    crs = {}
+    names = {}
+    result = connection.execution_options(stream_results=True).execute(select(LOCATION_COLUMNS).select_from(LOCATION_FROM.join(_schedules, _schedules.c.rid == _locations.c.rid))
+        .where(_schedules.c.ssd == ssd).order_by(_locations.c.rid, _locations.c.index))
+    for row in result:
+        schedule = positions[row.rid]
+        location_offsets[schedule+1] += 1
+        tiploc = tiplocs(row.tiploc)
+        crs[tiploc] = row.crs_darwin
+        names[tiploc] = row.name_short
+        resolved = {"ta": darwin_time.combine(row.wta, row.ta), "tp": darwin_time.combine(row.wtp, row.tp), "td": darwin_time.combine(row.wtd, row.td)}
+        values = dict(schedule=schedule, position=row.index, tiploc=tiploc, type=types(row.type), activity=activities(row.activity), plat=platforms(row.plat),
+            flags=sum(bool(getattr(row, b)) << i for i, b in enumerate(_LOCATION_FLAGS)),
+            ta_type=darwin_types(row.ta_type), tp_type=darwin_types(row.tp_type), td_type=darwin_types(row.td_type),
+            sort=_seconds(row.wtd or row.wta or row.wtp, midnight))
+        for name in _TIMES:
+            values[name] = _seconds(resolved[name] if name in resolved else getattr(row, name), midnight)
+        for name, column in location_columns.items():
+            column.append(values[name])
+    for i in range(len(schedules)):
+        location_offsets[i+1] += location_offsets[i]
+
+    columns["location_offsets"] = ("I", location_offsets)
+    for name, column in location_columns.items():
+        columns["location_" + name] = (column.typecode, column)
+
+    # Calling points by tiploc, then by sort time, for boards
+    sort = location_columns["sort"]
+    order = sorted(range(len(sort)), key=lambda a: (location_columns["tiploc"][a], sort[a]))
+    station_offsets = array("I", [0])*(len(tiplocs.values)+1)
+    for a in order:
+        station_offsets[location_columns["tiploc"][a]+1] += 1
+    for i in range(len(tiplocs.values)):
+        station_offsets[i+1] += station_offsets[i]
+    columns["station_order"] = ("I", array("I", order))
+    columns["station_offsets"] = ("I", station_offsets)
+    # How far a calling point's other working times reach either side of its sort time, at most, by station. Boards
+    # match on any of them, so look this far beyond their window
+    before, after = array("i", [0])*len(tiplocs.values), array("i", [0])*len(tiplocs.values)
+    for a in range(len(sort)):
+        tiploc = location_columns["tiploc"][a]
+        for name in ("wta", "wtp", "wtd"):
+            value = location_columns[name][a]
+            if value != NONE:
+                before[tiploc] = max(before[tiploc], sort[a] - value)
+                after[tiploc] = max(after[tiploc], value - sort[a])
+    columns["station_before"] = ("i", before)
+    columns["station_after"] = ("i", after)
+
+    columns["tiploc_crs"] = ("B", _fixed([crs.get(a) for a in range(len(tiplocs.values))], 3))
+    for name, (offsets, data) in (("tiplocs", tiplocs.pack()), ("operators", operators.pack()), ("types", types.pack()), ("activities", activities.pack()),
+            ("platforms", platforms.pack()), ("darwin_types", darwin_types.pack()), ("tiploc_names", _pack_strings([names.get(a) for a in range(len(tiplocs.values))]))):
+        columns[name + "_offsets"] = ("I", offsets)
+        columns[name + "_data"] = ("B", data)
+    return columns
+
+
+def write(connection: Connection, ssd: datetime.date, path: str) -> int:
+    """Write the snapshot of ssd to path, atomically replacing any previous one. Returns its size"""
+    columns = build(connection, ssd)
+    directory = {"ssd": ssd.isoformat(), "byteorder": sys.byteorder, "columns": {}}
+    position = 0
+    for name, (typecode, values) in columns.items():
+        size = len(values)*(array(typecode).itemsize if isinstance(values, array) else 1)
+        directory["columns"][name] = [typecode, position, size]
+        # Each column aligned to 8 bytes, so that casts of it are aligned
+        position += (size + 7) // 8 * 8
+    header = json.dumps(directory).encode()
+    start = (len(MAGIC) + 4 + len(header) + 7) // 8 * 8
+
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(MAGIC + len(header).to_bytes(4, "little") + header)
+        for name, (typecode, values) in columns.items():
+            _, offset, size = directory["columns"][name]
+            f.seek(start + offset)
+            f.write(values.tobytes() if isinstance(values, array) else values)
+        f.truncate(start + position)
+    os.replace(temporary, path)
+    return start + position
+
+
+class _Strings:
+    def __init__(self, offsets: memoryview, data: memoryview):
+        self.offsets = offsets
+        self.data = data
+        self._ids = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, id: int) -> Optional[str]:
+        if id == 0:
+            return None
+        return bytes(self.data[self.offsets[id]:self.offsets[id+1]]).decode()
+
+    def id(self, value: str) -> Optional[int]:
+        if self._ids is None:
+            self._ids = {self[a]: a for a in range(1, len(self))}
+        return self._ids.get(value)
+
+
+class Snapshot:
+    """A snapshot file, memory mapped read-only. Columns are memoryviews straight onto the mapping, so processes
+    mapping the same file share its pages and nothing is copied until a row is asked for"""
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError("{} is not a snapshot".format(path))
+        length = int.from_bytes(self._mmap[len(MAGIC):len(MAGIC)+4], "little")
+        directory = json.loads(self._mmap[len(MAGIC)+4:len(MAGIC)+4+length].decode())
+        if directory["byteorder"] != sys.byteorder:
+            self._mmap.close()
+            raise ValueError("{} was written with {} endian byte order".format(path, directory["byteorder"]))
+        self.ssd = datetime.date.fromisoformat(directory["ssd"])
+        self._midnight = datetime.datetime.combine(self.ssd, datetime.time())
+        start = (len(MAGIC) + 4 + length + 7) // 8 * 8
+        self._view = memoryview(self._mmap)
+        self._columns = {}
+        for name, (typecode, offset, size) in directory["columns"].items():
+            self._columns[name] = self._view[start+offset:start+offset+size].cast(typecode)
+
+        c = self._columns
+        self.tiplocs, self.operators, self._types, self._activities, self._platforms, self._darwin_types, self._names = (
+            _Strings(c[a + "_offsets"], c[a + "_data"]) for a in ("tiplocs", "operators", "types", "activities", "platforms", "darwin_types", "tiploc_names"))
+        self._crs_ids = None
+
+    def close(self):
+        for column in self._columns.values():
+            column.release()
+        for strings in (self.tiplocs, self.operators, self._types, self._activities, self._platforms, self._darwin_types, self._names):
+            strings.offsets = strings.data = None
+        self._columns = {}
+        self._view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._columns["location_offsets"]) - 1
+
+    @property
+    def location_count(self) -> int:
+        return self._columns["location_offsets"][-1]
+
+    def time_at(self, seconds: Optional[int]) -> Optional[datetime.datetime]:
+        return None if seconds is None else self._midnight + datetime.timedelta(seconds=seconds)
+
+    def _fixed(self, name: str, width: int, index: int) -> Optional[str]:
+        return bytes(self._columns["schedule_" + name][index*width:(index+1)*width]).decode().rstrip() or None
+
+    def find(self, rid: str) -> Optional[int]:
+        """Index of a schedule by rid, by binary search of the sorted rid column"""
+        column = self._columns["schedule_rid"]
+        key = rid.encode()
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(column[middle*15:middle*15+15]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and bytes(column[low*15:low*15+15]) == key:
+            return low
+        return None
+
+    def schedule(self, index: int) -> SnapshotSchedule:
+        flags = self._columns["schedule_flags"][index]
+        return SnapshotSchedule(index, *(self._fixed(name, width, index) for name, width in _FIXED),
+            self.operators[self._columns["schedule_operator"][index]], *(bool(flags >> i & 1) for i in range(len(_FLAGS))))
+
+    def location(self, index: int) -> SnapshotLocation:
+        c = self._columns
+        flags = c["location_flags"][index]
+        times = [c["location_" + a][index] for a in _TIMES]
+        return SnapshotLocation(index, c["location_schedule"][index], c["location_position"][index], self.tiplocs[c["location_tiploc"][index]],
+            self._types[c["location_type"][index]], self._activities[c["location_activity"][index]], *(None if a == NONE else a for a in times),
+            *(self._darwin_types[c["location_" + a][index]] for a in ("ta_type", "tp_type", "td_type")), self._platforms[c["location_plat"][index]],
+            *(bool(flags >> i & 1) for i in range(len(_LOCATION_FLAGS))))
+
+    def locations(self, schedule: int) -> List[SnapshotLocation]:
+        offsets = self._columns["location_offsets"]
+        return [self.location(a) for a in range(offsets[schedule], offsets[schedule+1])]
+
+    def crs(self, tiploc: str) -> Optional[str]:
+        id = self.tiplocs.id(tiploc)
+        return None if id is None else bytes(self._columns["tiploc_crs"][id*3:id*3+3]).decode().rstrip() or None
+
+    def name(self, tiploc: str) -> Optional[str]:
+        id = self.tiplocs.id(tiploc)
+        return None if id is None else self._names[id]
+
+    def _tiploc_ids(self, code: str) -> List[int]:
+        if len(code) != 3:
+            id = self.tiplocs.id(code)
+            return [] if id is None else [id]
+        if self._crs_ids is None:
+            column = self._columns["tiploc_crs"]
+            self._crs_ids = {}
+            for id in range(1, len(self.tiplocs)):
+                self._crs_ids.setdefault(bytes(column[id*3:id*3+3]).decode().rstrip(), []).append(id)
+        return self._crs_ids.get(code, [])
+
+    def board(self, code: str, start: datetime.datetime, end: datetime.datetime, passes: bool=False) -> List[int]:
+        """Indexes of calling points at a CRS (three characters) or TIPLOC with a working time in [start, end), in board
+        order (by wtd, wta then wtp), as board.get_board()"""
+        start, end = _seconds(start, self._midnight), _seconds(end, self._midnight)
+        c = self._columns
+        order, offsets, sort = c["station_order"], c["station_offsets"], c["location_sort"]
+        times = [c["location_wtd"], c["location_wta"]] + ([c["location_wtp"]] if passes else [])
+        found = []
+        for id in self._tiploc_ids(code):
+            low, high = offsets[id], offsets[id+1]
+            first, last = start - c["station_after"][id], end + c["station_before"][id]
+            # First calling point that could be in the window, by binary search over sort times
+            while low < high:
+                middle = (low + high) // 2
+                if sort[order[middle]] < first:
+                    low = middle + 1
+                else:
+                    high = middle
+            for position in range(low, offsets[id+1]):
+                index = order[position]
+                if sort[index] >= last:
+                    break
+                if any(start <= a[index] < end for a in times):
+                    found.append(index)
+        if len(found) > 1:
+            found.sort(key=lambda a: (sort[a], bytes(c["schedule_rid"][c["location_schedule"][a]*15:c["location_schedule"][a]*15+15])))
+        return found
+
+
+if __name__ == "__main__":
+    engine = sqlalchemy.create_engine(sys.argv[1])
+    with engine.connect() as connection:
+        print(write(connection, datetime.date.fromisoformat(sys.argv[2]), sys.argv[3]), "bytes")
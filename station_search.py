@@ -0,0 +1,228 @@
+import math
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import case, or_
+from sqlalchemy.orm import Session
+
+import reference
+from models import DarwinLocation
+from reference import CachedLocation, ReferenceCache
+
+# Station search for typeahead, over every name variant and CRS code of DarwinLocation, in memory.
+# Locations are numbered in order of category (A first, none last) then name, so ranking within a tier of match
+# is just ordering by number. Tiers are: exact CRS, a name starting with the query, a later word of a name (or a CRS)
+# starting with it, and then only if none of those matched, names similar by trigrams as pg_trgm would have it
+
+NAME_FIELDS = ("name_short", "name_full", "name_darwin", "name_corpus", "name_bplan")
+CRS_FIELDS = ("crs_darwin", "crs_corpus")
+
+# Prefixes of more keys than this have their matches precomputed, being too many to gather on every keystroke
+LARGE_PREFIX = 32
+
+SIMILARITY_THRESHOLD = 0.3
+
+_NOT_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalise(text: str) -> str:
+    return _NOT_WORD.sub(" ", text.lower()).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    """Of normalised text, padded per word as pg_trgm does"""
+    out = set()
+    for word in text.split():
+        padded = "  " + word + " "
+        out.update(padded[i:i+3] for i in range(len(padded)-2))
+    return out
+
+
+def _rank(location: CachedLocation):
+    return location.category is None, location.category or "", location.name_short or "", location.tiploc
+
+
+class _PrefixTable:
+    def __init__(self, keys: Dict[str, Set[int]]):
+        self._keys = sorted(keys)
+        self._ids = [tuple(sorted(keys[a])) for a in self._keys]
+        self._large = {}  # type: Dict[str, Tuple[int, ...]]
+        self._precompute(0, len(self._keys), 0)
+
+    def _union(self, start: int, end: int) -> Tuple[int, ...]:
+        if end - start == 1:
+            return self._ids[start]
+        out = set()
+        for ids in self._ids[start:end]:
+            out.update(ids)
+        return tuple(sorted(out))
+
+    def _precompute(self, start: int, end: int, depth: int):
+        """Of keys[start:end], which share their first depth characters"""
+        i = start
+        while i < end:
+            if len(self._keys[i]) <= depth:
+                i += 1
+                continue
+            prefix = self._keys[i][:depth+1]
+            j = bisect_left(self._keys, prefix + "\x7f", i, end)
+            if j - i > LARGE_PREFIX:
+                self._large[prefix] = self._union(i, j)
+                self._precompute(i, j, depth+1)
+            i = j
+
+    def lookup(self, prefix: str) -> Tuple[int, ...]:
+        """Ids of keys starting with prefix, in order"""
+        out = self._large.get(prefix)
+        if out is not None:
+            return out
+        # Normalised keys are only ever [a-z0-9 ], all before \x7f
+        return self._union(bisect_left(self._keys, prefix), bisect_left(self._keys, prefix + "\x7f"))
+
+
+class StationIndex:
+    """Immutable index over locations, built once and searched from any thread"""
+    def __init__(self, locations: Iterable[CachedLocation]):
+        self.locations = sorted(locations, key=_rank)
+        crs = {}
+        names = {}
+        words = {}
+        names_by_text = {}
+        for i, location in enumerate(self.locations):
+            for field in CRS_FIELDS:
+                code = getattr(location, field)
+                if code:
+                    crs.setdefault(code.lower(), set()).add(i)
+                    words.setdefault(code.lower(), set()).add(i)
+            for field in NAME_FIELDS:
+                name = normalise(getattr(location, field) or "")
+                if not name:
+                    continue
+                names.setdefault(name, set()).add(i)
+                split = name.split(" ")
+                for n in range(1, len(split)):
+                    words.setdefault(" ".join(split[n:]), set()).add(i)
+                names_by_text.setdefault(name, set()).add(i)
+
+        self._crs = {k: tuple(sorted(v)) for k, v in crs.items()}
+        self._names = _PrefixTable(names)
+        self._words = _PrefixTable(words)
+
+        # Trigram postings are by distinct name, as similarity is per name
+        self._trigram_entries = []  # type: List[Tuple[int, ...]]
+        self._trigram_sets = []  # type: List[frozenset]
+        postings = {}
+        for n, (name, ids) in enumerate(names_by_text.items()):
+            grams = frozenset(trigrams(name))
+            self._trigram_entries.append(tuple(sorted(ids)))
+            self._trigram_sets.append(grams)
+            for gram in grams:
+                postings.setdefault(gram, array("l")).append(n)
+        self._postings = postings
+
+    def __len__(self):
+        return len(self.locations)
+
+    def similar(self, query: str, threshold: float=SIMILARITY_THRESHOLD) -> List[int]:
+        """Ids of locations with a name of trigram similarity at least threshold to normalised query, most similar first"""
+        grams = trigrams(query)
+        if not grams:
+            return []
+        # A name this similar shares at least needed trigrams with the query, so at least one of its rarest
+        # len(grams) - needed + 1, and only names with those need comparing
+        needed = max(1, math.ceil(threshold*len(grams)))
+        rarest = sorted(grams, key=lambda a: len(self._postings.get(a, ())))[:len(grams)-needed+1]
+        candidates = set()
+        for gram in rarest:
+            candidates.update(self._postings.get(gram, ()))
+        best = {}
+        for n in candidates:
+            name_grams = self._trigram_sets[n]
+            count = len(grams & name_grams)
+            similarity = count / (len(grams) + len(name_grams) - count)
+            if similarity >= threshold:
+                for i in self._trigram_entries[n]:
+                    if similarity > best.get(i, 0):
+                        best[i] = similarity
+        return sorted(best, key=lambda a: (-best[a], a))
+
+    def search(self, query: str, limit: int=10, fuzzy: bool=True) -> List[CachedLocation]:
+        query = normalise(query)
+        if not query:
+            return []
+        out = []
+        seen = set()
+
+        def take(ids) -> bool:
+            for i in ids:
+                if i not in seen:
+                    seen.add(i)
+                    out.append(self.locations[i])
+                    if len(out) >= limit:
+                        return True
+            return False
+
+        if take(self._crs.get(query, ())) or take(self._names.lookup(query)) or take(self._words.lookup(query)):
+            return out
+        if fuzzy and not out and len(query) >= 3:
+            take(self.similar(query))
+        return out
+
+
+def load_index(session: Session) -> StationIndex:
+    return StationIndex(CachedLocation.from_row(a) for a in session.query(DarwinLocation))
+
+
+class StationSearch:
+    """A StationIndex over a ReferenceCache's locations, rebuilt whenever the cache is refreshed.
+    Until the cache is loaded, searches go to search_sql() if given a session, and otherwise find nothing"""
+    def __init__(self, cache: Optional[ReferenceCache]=None):
+        self.cache = cache if cache is not None else reference.CACHE
+        self._index = None  # type: Optional[StationIndex]
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    @property
+    def index(self) -> Optional[StationIndex]:
+        """None while the cache isn't loaded"""
+        if not self.cache.loaded:
+            return None
+        snapshot = self.cache.snapshot
+        if snapshot is not self._snapshot:
+            with self._lock:
+                if snapshot is not self._snapshot:
+                    self._index = StationIndex(snapshot.locations.values())
+                    self._snapshot = snapshot
+        return self._index
+
+    def search(self, query: str, limit: int=10, fuzzy: bool=True, session: Optional[Session]=None) -> List[CachedLocation]:
+        index = self.index
+        if index is not None:
+            return index.search(query, limit, fuzzy)
+        if session is not None:
+            return [CachedLocation.from_row(a) for a in search_sql(session, query, limit)]
+        return []
+
+
+def _like_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_sql(session: Session, query: str, limit: int=10) -> List[DarwinLocation]:
+    """Much the same in SQL, through the trigram indexes on darwin_locations, without the similarity tier"""
+    query = query.strip()
+    if not query:
+        return []
+    columns = [getattr(DarwinLocation, a) for a in NAME_FIELDS + CRS_FIELDS]
+    prefix, anywhere = _like_escape(query) + "%", "%" + _like_escape(query) + "%"
+    tier = case([
+        (or_(*[getattr(DarwinLocation, a).ilike(_like_escape(query), escape="\\") for a in CRS_FIELDS]), 0),
+        (or_(*[a.ilike(prefix, escape="\\") for a in columns]), 1),
+    ], else_=2)
+    return session.query(DarwinLocation)\
+        .filter(or_(*[a.ilike(anywhere, escape="\\") for a in columns]))\
+        .order_by(tier, DarwinLocation.category.is_(None), DarwinLocation.category, DarwinLocation.name_short, DarwinLocation.tiploc)\
+        .limit(limit).all()
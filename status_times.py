@@ -0,0 +1,116 @@
+import datetime
+from typing import Iterable, List, Optional
+
+from sqlalchemy import and_, case, cast, extract, func, literal, select, DATE, TIME, SMALLINT, Interval
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session, contains_eager
+
+import writes
+from darwin_time import MIDNIGHT_FORWARD, MIDNIGHT_BACKWARD
+from loading import location_option, serialised_location_options
+from models import DarwinLocation, DarwinSchedule, DarwinScheduleLocation, DarwinScheduleStatus
+
+# Maintains DarwinScheduleStatus.ta_resolved, tp_resolved, td_resolved and delay_minutes, and queries on them.
+# The midnight rules are those of darwin_time.combine(), in SQL, so resolution happens in the database as part of the write
+
+_status = DarwinScheduleStatus.__table__
+_locations = DarwinScheduleLocation.__table__
+
+_DAY = literal(datetime.timedelta(days=1), Interval)
+_NO_DAYS = literal(datetime.timedelta(0), Interval)
+
+RESOLVED_ATTRIBUTES = ("ta_resolved", "tp_resolved", "td_resolved", "delay_minutes")
+
+
+def resolved_time(working, darwin):
+    """SQL equivalent of darwin_time.combine(working, darwin)"""
+    difference = extract("epoch", darwin) - extract("epoch", cast(working, TIME))
+    return cast(working, DATE) + darwin + case([(difference < MIDNIGHT_FORWARD, _DAY), (difference > MIDNIGHT_BACKWARD, -_DAY)], else_=_NO_DAYS)
+
+
+def _minutes(later, earlier):
+    return cast(func.floor(extract("epoch", later - earlier)/60), SMALLINT)
+
+
+def _update(condition):
+    ta = resolved_time(_locations.c.wta, _status.c.ta)
+    tp = resolved_time(_locations.c.wtp, _status.c.tp)
+    td = resolved_time(_locations.c.wtd, _status.c.td)
+    # Of the latest time known, against what passengers were told, or for passes the working time
+    delay = case([
+        (_status.c.td != None, _minutes(td, func.coalesce(_locations.c.ptd, _locations.c.wtd))),
+        (_status.c.tp != None, _minutes(tp, _locations.c.wtp)),
+        (_status.c.ta != None, _minutes(ta, func.coalesce(_locations.c.pta, _locations.c.wta))),
+    ], else_=None)
+    return _status.update()\
+        .where(and_(_locations.c.rid == _status.c.rid, _locations.c.original_wt == _status.c.original_wt, _locations.c.tiploc == _status.c.tiploc))\
+        .where(condition)\
+        .values(ta_resolved=ta, tp_resolved=tp, td_resolved=td, delay_minutes=delay)
+
+
+def resolve(connection: Connection, rids: Iterable[str], chunk_size: int=1000):
+    """Set the resolved times of every status of rids, from their locations' working times. Call after writing either"""
+    rids = list(dict.fromkeys(rids))
+    for i in range(0, len(rids), chunk_size):
+        connection.execute(_update(_status.c.rid.in_(rids[i:i+chunk_size])))
+
+
+def resolve_day(connection: Connection, ssd: datetime.date):
+    """Resolve a whole service date, such as to backfill after upgrading"""
+    schedules = DarwinSchedule.__table__
+    connection.execute(_update(_status.c.rid.in_(select([schedules.c.rid]).where(schedules.c.ssd == ssd))))
+
+
+def _after_flush(session: Session, written):
+    rids = written.get("locations", set()) | written.get("statuses", set())
+    if not rids:
+        return
+    resolve(session.connection(), sorted(rids))
+    # So that they're read back rather than left as they were before the update
+    for obj in session.identity_map.values():
+        if isinstance(obj, DarwinScheduleStatus) and obj.rid in rids:
+            session.expire(obj, RESOLVED_ATTRIBUTES)
+
+
+def attach(sessions=Session):
+    """Resolve times on every flush of sessions, a Session class, sessionmaker or session. BulkWriter always does"""
+    writes.session_writes(sessions).subscribe(_after_flush)
+
+
+def detach(sessions=Session):
+    writes.session_writes(sessions).unsubscribe(_after_flush)
+
+
+def _query(session: Session, code: Optional[str]):
+    query = session.query(DarwinScheduleLocation)\
+        .join(DarwinScheduleLocation.location)\
+        .join(DarwinScheduleLocation.schedule)\
+        .join(DarwinScheduleLocation.status)\
+        .options(*serialised_location_options(location_option(joined=True), contains_eager(DarwinScheduleLocation.schedule),
+            contains_eager(DarwinScheduleLocation.status)))
+    if code is not None:
+        query = query.filter(DarwinLocation.crs_darwin == code if len(code) == 3 else DarwinLocation.tiploc == code)
+    return query
+
+
+def departures_between(session: Session, code: str, start: datetime.datetime, end: datetime.datetime) -> List[DarwinScheduleLocation]:
+    """Calling points at a CRS or TIPLOC estimated (or having actually departed) in [start, end), by that time"""
+    return _query(session, code)\
+        .filter(DarwinScheduleStatus.td_resolved >= start, DarwinScheduleStatus.td_resolved < end)\
+        .order_by(DarwinScheduleStatus.td_resolved, DarwinScheduleLocation.rid).all()
+
+
+def arrivals_between(session: Session, code: str, start: datetime.datetime, end: datetime.datetime) -> List[DarwinScheduleLocation]:
+    return _query(session, code)\
+        .filter(DarwinScheduleStatus.ta_resolved >= start, DarwinScheduleStatus.ta_resolved < end)\
+        .order_by(DarwinScheduleStatus.ta_resolved, DarwinScheduleLocation.rid).all()
+
+
+def late(session: Session, minutes: int, start: datetime.datetime, end: datetime.datetime, code: Optional[str]=None) -> List[DarwinScheduleLocation]:
+    """Calling points at least minutes late, with a departure (or else arrival) resolved to [start, end), most late first.
+    For "late right now", start and end around now"""
+    return _query(session, code)\
+        .filter(DarwinScheduleStatus.delay_minutes >= minutes)\
+        .filter(func.coalesce(DarwinScheduleStatus.td_resolved, DarwinScheduleStatus.ta_resolved) >= start)\
+        .filter(func.coalesce(DarwinScheduleStatus.td_resolved, DarwinScheduleStatus.ta_resolved) < end)\
+        .order_by(DarwinScheduleStatus.delay_minutes.desc(), DarwinScheduleLocation.rid).all()
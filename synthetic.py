@@ -0,0 +1,247 @@
+"""Seeded synthetic Darwin data, for benchmarks and for trying things out without production data.
+Usage: python synthetic.py postgresql://localhost/swallow_bench [days] [schedules per day] [seed]"""
+import datetime
+import random
+import string
+import sys
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+import sqlalchemy
+
+import models
+from ingest import BulkWriter, ScheduleBatch
+
+OPERATORS = [("GW", "Great Western Railway"), ("SW", "South Western Railway"), ("XC", "CrossCountry"), ("VT", "Avanti West Coast"),
+    ("NT", "Northern"), ("SE", "Southeastern"), ("SN", "Southern"), ("TP", "TransPennine Express"), ("LM", "West Midlands Trains"), ("AW", "Transport for Wales")]
+COACH_CLASSES = ("Standard", "Standard", "Standard", "First", "Mixed")
+TOILET_TYPES = ("None", "Standard", "Accessible")
+MESSAGE_CATEGORIES = ("Train", "Station", "Connections", "System", "Misc", "PriorTrains", "PriorOther")
+
+
+class Reference(NamedTuple):
+    locations: List[dict]
+    operators: List[dict]
+    reasons: List[dict]
+    localised: List[dict]
+    links: List[dict]
+    platforms: List[dict]
+
+
+class SyntheticDay(NamedTuple):
+    ssd: datetime.date
+    batch: ScheduleBatch
+    messages: List[dict]
+
+
+def _original_wt(wta, wtp, wtd) -> str:
+    return "|".join("" if a is None else a.strftime("%H:%M") for a in (wta, wtp, wtd))
+
+
+class Generator:
+    """Builds a network of lines through shared hubs, then per service day: schedules along those lines, calling points,
+    statuses, splits, joins and next workings, formations and station messages. The same seed gives the same data"""
+    def __init__(self, seed: int=0, stations: int=400, lines: int=40, schedules_per_day: int=5000, association_rate: float=0.08, messages_per_day: int=60):
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.station_count = stations
+        self.line_count = lines
+        self.schedules_per_day = schedules_per_day
+        self.association_rate = association_rate
+        self.messages_per_day = messages_per_day
+        self.reference = self._reference()
+        self.lines = self._lines()
+        self._message_id = 0
+
+    def _reference(self) -> Reference:
+        r = self.random
+        codes = r.sample([x+y+z for x in string.ascii_uppercase for y in string.ascii_uppercase for z in string.ascii_uppercase], self.station_count)
+        locations = []
+        for i, crs in enumerate(codes):
+            name = "{} {}".format(r.choice(("North", "South", "East", "West", "Upper", "Lower", "Great", "Little", "")), r.choice(("Ashby", "Barford", "Carlton", "Dunham", "Elston", "Felling", "Garston", "Hatton", "Ilford", "Kenton", "Langley", "Marston", "Norton", "Oakley", "Preston", "Ripley", "Sutton", "Thorpe", "Upton", "Weston"))).strip()
+            name = "{} {}".format(name, i)
+            locations.append(dict(tiploc="T{:05d}".format(i), crs_darwin=crs, crs_corpus=crs, operator=r.choice(OPERATORS)[0],
+                name_short=name[:16], name_full=name, name_darwin=name, name_corpus=name.upper(), name_bplan=name.upper()[:26],
+                category=r.choice("ABCDE"), dict_values=None))
+        operators = [dict(operator=a, operator_name=b, url="https://example.invalid/{}".format(a.lower()), category="T") for a, b in OPERATORS]
+        reasons = [dict(id=i, type=t, message="{} reason {}".format("Delay" if t == "D" else "Cancellation", i)) for i in range(100, 1000, 7) for t in "DC"]
+        localised = [dict(source="darwin", locale=l, code_type="reason", code="{}{}".format(a["id"], a["type"]), description=a["message"]) for a in reasons for l in ("en_gb", "cy_gb")]
+        platforms = [dict(tiploc=a["tiploc"], platform=str(p), start_date=None, end_date=None, length=r.randrange(80, 300), power=r.choice("DEO"),
+            doo_passenger=r.random() < .5, doo_non_passenger=False) for a in locations for p in range(1, r.randrange(2, 9))]
+        return Reference(locations, operators, reasons, localised, [], platforms)
+
+    def _lines(self) -> List[List[dict]]:
+        """Lines are runs of stations, the first few stations being hubs shared between lines"""
+        r = self.random
+        hubs = self.reference.locations[:max(1, self.line_count // 4)]
+        rest = self.reference.locations[len(hubs):]
+        lines = []
+        for i in range(self.line_count):
+            stations = [r.choice(hubs)] + r.sample(rest, min(len(rest), r.randrange(8, 40)))
+            if r.random() < .5:
+                stations.append(r.choice(hubs))
+            stations = list({a["tiploc"]: a for a in stations}.values())
+            lines.append(stations)
+            for a, b in zip(stations, stations[1:]):
+                link = dict(origin=a["tiploc"], destination=b["tiploc"], running_line_code=r.choice(("ML", "FL", "SL", "")), running_line_desc=None,
+                    start_date=None, end_date=None, initial_direction="D", final_direction="D", distance=r.randrange(1500, 15000),
+                    doo_passenger=r.random() < .3, doo_non_passenger=r.random() < .3, retb=False, zone="1", reversible=r.choice("BN"),
+                    power=r.choice("DEO"), route_allowance=r.randrange(0, 4))
+                self.reference.links.append(link)
+        return lines
+
+    def _rid(self, ssd: datetime.date, n: int) -> str:
+        return "{:%Y%m%d}{:07d}".format(ssd, n)
+
+    def _schedule(self, batch: ScheduleBatch, ssd: datetime.date, n: int, stations: List[dict], start: datetime.datetime, now: datetime.datetime) -> Tuple[str, List[dict]]:
+        r = self.random
+        rid = self._rid(ssd, n)
+        operator = r.choice(OPERATORS)[0]
+        batch.schedules.append(dict(uid="{}{:05d}".format(r.choice(string.ascii_uppercase), n % 100000), rid=rid, rsid="{}{:06d}".format(operator, n % 1000000),
+            ssd=ssd, signalling_id="{}{}{:02d}".format(r.choice("12359"), r.choice(string.ascii_uppercase), n % 100), status="P", category="OO",
+            operator_id=operator, is_active=True, is_charter=False, is_deleted=False, is_passenger=True, origins=[], destinations=[],
+            delay_reason=None, cancel_reason=None, formation_summary=None, best_toilet_type=None))
+
+        delay = max(0, int(r.gauss(2, 6))) if r.random() < .4 else 0
+        wt = start
+        locations = []
+        for index, station in enumerate(stations):
+            first, last = index == 0, index == len(stations) - 1
+            passing = not (first or last) and r.random() < .15
+            wta = None if first or passing else wt
+            wtp = wt if passing else None
+            wtd = None if last or passing else wt + datetime.timedelta(seconds=30*r.randrange(1, 5))
+            location = dict(rid=rid, ssd=ssd, index=index, loc_type="OR" if first else "DT" if last else "PP" if passing else "IP", tiploc=station["tiploc"],
+                activity="TB" if first else "TF" if last else "" if passing else "T", original_wt=_original_wt(wta, wtp, wtd),
+                wta=wta, wtp=wtp, wtd=wtd, pta=None if passing else wta and wta.replace(second=0), ptd=None if passing else wtd and wtd.replace(second=0),
+                cancelled=False, rdelay=0)
+            batch.locations.append(location)
+            locations.append(location)
+
+            status = dict(rid=rid, ssd=ssd, tiploc=station["tiploc"], original_wt=location["original_wt"], ta_delayed=False, tp_delayed=False, td_delayed=False,
+                plat=None if passing else str(r.randrange(1, 6)), plat_suppressed=False, plat_cis_suppressed=False, plat_confirmed=r.random() < .5, plat_source="P",
+                length=None)
+            for letter, working in zip("apd", (wta, wtp, wtd)):
+                status.update({"t" + letter: None, "t{}_type".format(letter): None, "t{}_source".format(letter): None})
+                if working is None:
+                    continue
+                status["t" + letter] = (working + datetime.timedelta(minutes=delay)).time()
+                status["t{}_type".format(letter)] = "A" if working < now else "E"
+                status["t{}_source".format(letter)] = "TD" if working < now else "Darwin"
+            batch.statuses.append(status)
+
+            delay = max(0, delay + int(r.gauss(0, 1.5)))
+            wt = (wtd or wtp or wt) + datetime.timedelta(minutes=r.randrange(2, 12))
+
+        coaches = r.choice((2, 3, 4, 5, 8, 10, 12))
+        fid = "{}-{:03d}".format(rid, 1)
+        batch.formations.extend(dict(rid=rid, ssd=ssd, fid=fid, seq=a, coach_number=chr(65+a), coach_class=r.choice(COACH_CLASSES),
+            toilet_status="InService", toilet_type=r.choice(TOILET_TYPES)) for a in range(coaches))
+        return rid, locations
+
+    def day(self, ssd: datetime.date, now: datetime.datetime=None) -> SyntheticDay:
+        """One service day. now decides which times are actual rather than estimated, by default midday"""
+        r = self.random
+        now = now or datetime.datetime.combine(ssd, datetime.time(12))
+        batch = ScheduleBatch([], [], [], [], [])
+        n = 0
+        while n < self.schedules_per_day:
+            line = r.choice(self.lines)
+            if r.random() < .5:
+                line = line[::-1]
+            first = r.randrange(0, max(1, len(line) - 2))
+            stations = line[first:r.randrange(first + 2, len(line) + 1)]
+            start = datetime.datetime.combine(ssd, datetime.time(5)) + datetime.timedelta(minutes=r.randrange(0, 19*60))
+            main_rid, main_locations = self._schedule(batch, ssd, n, stations, start, now)
+            n += 1
+
+            if r.random() >= self.association_rate or len(main_locations) < 3:
+                continue
+            category = r.choice(("VV", "JJ", "NP"))
+            other = r.choice(self.lines)
+            if category == "NP":
+                at = main_locations[-1]
+                other_stations = [next(a for a in self.reference.locations if a["tiploc"] == at["tiploc"])] + [a for a in other[:r.randrange(2, 10)] if a["tiploc"] != at["tiploc"]]
+                other_start = at["wta"] + datetime.timedelta(minutes=r.randrange(10, 60))
+                assoc_rid, assoc_locations = self._schedule(batch, ssd, n, other_stations, other_start, now)
+                assoc_at = assoc_locations[0]
+            else:
+                at = r.choice([a for a in main_locations[1:-1] if a["wta"]] or main_locations[1:-1])
+                station = next(a for a in self.reference.locations if a["tiploc"] == at["tiploc"])
+                branch = [a for a in other[:r.randrange(2, 10)] if a["tiploc"] != at["tiploc"]]
+                at_time = at["wta"] or at["wtp"]
+                if category == "VV":
+                    # Divides, the associated portion starting here
+                    assoc_rid, assoc_locations = self._schedule(batch, ssd, n, [station] + branch, at_time + datetime.timedelta(minutes=3), now)
+                    assoc_at = assoc_locations[0]
+                else:
+                    # Joins, the associated portion finishing here
+                    assoc_rid, assoc_locations = self._schedule(batch, ssd, n, branch[::-1] + [station], at_time - datetime.timedelta(minutes=10*len(branch)+5), now)
+                    assoc_at = assoc_locations[-1]
+            n += 1
+            batch.associations.append(dict(category=category, tiploc=at["tiploc"], main_rid=main_rid, main_original_wt=at["original_wt"],
+                ssd=ssd, assoc_rid=assoc_rid, assoc_original_wt=assoc_at["original_wt"]))
+
+        self._fill_endpoints(batch)
+        return SyntheticDay(ssd, batch, self._messages())
+
+    def _fill_endpoints(self, batch: ScheduleBatch):
+        """origins/destinations columns, as darwin_schedules stores them"""
+        names = {a["tiploc"]: a for a in self.reference.locations}
+        by_rid = {}
+        for location in batch.locations:
+            by_rid.setdefault(location["rid"], []).append(location)
+        for schedule in batch.schedules:
+            locations = by_rid[schedule["rid"]]
+            schedule["origins"] = [{"tiploc": locations[0]["tiploc"], "name": names[locations[0]["tiploc"]]["name_short"]}]
+            schedule["destinations"] = [{"tiploc": locations[-1]["tiploc"], "name": names[locations[-1]["tiploc"]]["name_short"]}]
+
+    def _messages(self) -> List[dict]:
+        r = self.random
+        out = []
+        for _ in range(self.messages_per_day):
+            self._message_id += 1
+            stations = [a["crs_darwin"] for a in r.sample(self.reference.locations, r.randrange(1, 6))]
+            out.append(dict(message_id=self._message_id, category=r.choice(MESSAGE_CATEGORIES), severity=r.randrange(0, 4), suppress=r.random() < .05,
+                stations=stations, message="Disruption between {} and {}".format(stations[0], stations[-1])))
+        return out
+
+    def days(self, start: datetime.date, count: int) -> Iterator[SyntheticDay]:
+        for i in range(count):
+            yield self.day(start + datetime.timedelta(days=i))
+
+
+def load_reference(connection, reference: Reference):
+    for model, rows in ((models.DarwinLocation, reference.locations), (models.DarwinOperator, reference.operators), (models.DarwinReason, reference.reasons),
+            (models.LocalisedReference, reference.localised), (models.BPlanNetworkLink, reference.links), (models.BPlanPlatform, reference.platforms)):
+        table = model.__table__
+        keys = {a.key: a.columns[0].name for a in sqlalchemy.inspect(model).column_attrs}
+        # Generated links can repeat a pair of stations on the same running line
+        unique = {tuple(row.get(a) for a in (b.key for b in sqlalchemy.inspect(model).primary_key)): row for row in rows}
+        if unique:
+            connection.execute(table.insert(), [{keys[k]: v for k, v in row.items()} for row in unique.values()])
+
+
+def load(engine, generator: Generator, start: datetime.date, days: int, partitioned: bool=False, wipe: bool=True) -> Dict[str, int]:
+    """Create the schema and load reference data and days of schedules and messages. Returns row counts"""
+    models.create_all(engine, partitioned=partitioned)
+    counts = {"schedule_rows": 0, "messages": 0}
+    with engine.begin() as connection:
+        if wipe:
+            connection.execute(sqlalchemy.text("TRUNCATE " + ", ".join(reversed([a.name for a in models.Base.metadata.sorted_tables])) + " CASCADE"))
+        load_reference(connection, generator.reference)
+
+    writer = BulkWriter(engine, partitioned=partitioned)
+    for sequence, day in enumerate(generator.days(start, days)):
+        counts["schedule_rows"] += writer.write(day.batch, sequence=sequence)
+        with engine.begin() as connection:
+            connection.execute(models.DarwinMessage.__table__.insert(), day.messages)
+        counts["messages"] += len(day.messages)
+    return counts
+
+
+if __name__ == "__main__":
+    engine = sqlalchemy.create_engine(sys.argv[1])
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    per_day = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    print(load(engine, Generator(seed, schedules_per_day=per_day), datetime.date.today(), days))
@@ -0,0 +1,168 @@
+from contextlib import contextmanager
+import datetime
+import os
+import sys
+
+import pytest
+import sqlalchemy
+from sqlalchemy import event, JSON
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import board_rows  # noqa: E402
+import models  # noqa: E402
+from ingest import BATCH_MODELS, ScheduleBatch  # noqa: E402
+
+SSD = datetime.date(2026, 10, 16)
+STATIONS = [("PADTON", "PAD", "London Paddington"), ("RDNGSTN", "RDG", "Reading"), ("SDON", "SWI", "Swindon"), ("BRSTLTM", "BRI", "Bristol Temple Meads"), ("DIDCOTP", "DID", "Didcot Parkway")]
+CALLING_POINTS = [("PADTON", "OR", 0), ("RDNGSTN", "IP", 25), ("SDON", "IP", 55), ("BRSTLTM", "DT", 100)]
+
+# SQLite has no arrays, so these tests store them as JSON
+_ARRAY_TYPES = {a: a.type for metadata in (models.Base.metadata, board_rows.metadata) for table in metadata.tables.values() for a in table.columns
+    if isinstance(a.type, sqlalchemy.ARRAY)}
+for _column in _ARRAY_TYPES:
+    _column.type = JSON()
+
+
+@contextmanager
+def postgresql_types():
+    """The models' own array types, for building statements to compile for PostgreSQL"""
+    for column, type_ in _ARRAY_TYPES.items():
+        column.type = type_
+    try:
+        yield
+    finally:
+        for column in _ARRAY_TYPES:
+            column.type = JSON()
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.statements = []
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __len__(self):
+        return len(self.statements)
+
+    def reset(self):
+        self.statements = []
+
+
+def pytest_configure(config):
+    # The models' overlapping relationships warn on every mapper configuration
+    config.addinivalue_line("filterwarnings", "ignore::sqlalchemy.exc.SAWarning")
+
+
+@pytest.fixture(scope="session")
+def _engine():
+    # Shared so that its compiled statement cache is, as the serialising options take seconds to compile
+    engine = sqlalchemy.create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def engine(_engine):
+    models.Base.metadata.create_all(_engine)
+    yield _engine
+    models.Base.metadata.drop_all(_engine)
+
+
+@pytest.fixture(scope="session")
+def _pg_engine():
+    # What needs PostgreSQL (COPY, array operators, partitions, resolving times in SQL) runs against the database at
+    # SWALLOW_TEST_DATABASE, which needs pg_trgm available, and whose public schema is dropped and recreated by every test using it
+    url = os.environ.get("SWALLOW_TEST_DATABASE")
+    if not url:
+        pytest.skip("SWALLOW_TEST_DATABASE isn't set to a PostgreSQL database")
+    engine = sqlalchemy.create_engine(url)
+    yield engine
+    engine.dispose()
+
+
+def _pg_schema(engine, partitioned: bool):
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("DROP SCHEMA public CASCADE"))
+        connection.execute(sqlalchemy.text("CREATE SCHEMA public"))
+    models.create_all(engine, partitioned)
+
+
+@pytest.fixture
+def pg_engine(_pg_engine):
+    with postgresql_types():
+        _pg_schema(_pg_engine, False)
+        yield _pg_engine
+
+
+@pytest.fixture
+def pg_partitioned_engine(_pg_engine):
+    with postgresql_types():
+        _pg_schema(_pg_engine, True)
+        yield _pg_engine
+
+
+@pytest.fixture
+def Session(engine):
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def counter(engine):
+    return StatementCounter(engine)
+
+
+def add_reference_data(session):
+    session.add(models.DarwinOperator(operator="GW", operator_name="Great Western Railway"))
+    for tiploc, crs, name in STATIONS:
+        session.add(models.DarwinLocation(tiploc=tiploc, crs_darwin=crs, name_short=name, name_full=name, category="A"))
+    session.flush()
+
+
+def schedule_batch(schedules=20, ssd=SSD) -> ScheduleBatch:
+    """schedules from Paddington to Bristol ten minutes apart, each odd one associated with the one before at Reading,
+    as rows keyed by attribute"""
+    batch = ScheduleBatch([], [], [], [], [])
+    for i in range(schedules):
+        rid = "2026101600{:05d}".format(i)
+        base = datetime.datetime.combine(ssd, datetime.time(8)) + datetime.timedelta(minutes=10*i)
+        batch.schedules.append(dict(uid="C{:05d}".format(i), rid=rid, ssd=ssd, signalling_id="1A{:02d}".format(i % 100), status="P",
+            category="XX", operator_id="GW", origins=[], destinations=[], is_active=True, is_passenger=True))
+        for index, (tiploc, type_, minutes) in enumerate(CALLING_POINTS):
+            wt = base + datetime.timedelta(minutes=minutes)
+            original_wt = wt.strftime("%H:%M")
+            batch.locations.append(dict(rid=rid, ssd=ssd, index=index, loc_type=type_, tiploc=tiploc, activity="T", original_wt=original_wt,
+                wta=wt if type_ != "OR" else None, wtd=wt if type_ != "DT" else None, pta=wt if type_ != "OR" else None, ptd=wt if type_ != "DT" else None))
+            batch.statuses.append(dict(rid=rid, ssd=ssd, tiploc=tiploc, original_wt=original_wt,
+                ta=(wt + datetime.timedelta(minutes=2)).time() if type_ != "OR" else None, ta_type="E",
+                td=(wt + datetime.timedelta(minutes=3)).time() if type_ != "DT" else None, td_type="A",
+                ta_delayed=False, tp_delayed=False, td_delayed=False, plat="1", plat_suppressed=False, plat_confirmed=True))
+    reading = {a["rid"]: a["original_wt"] for a in batch.locations if a["tiploc"] == "RDNGSTN"}
+    for i in range(1, schedules, 2):
+        main, assoc = "2026101600{:05d}".format(i-1), "2026101600{:05d}".format(i)
+        batch.associations.append(dict(category="VV", tiploc="RDNGSTN", ssd=ssd, main_rid=main, main_original_wt=reading[main],
+            assoc_rid=assoc, assoc_original_wt=reading[assoc]))
+    return batch
+
+
+def populate(session, schedules=20, ssd=SSD):
+    """Reference data and schedule_batch(), through the ORM"""
+    add_reference_data(session)
+    batch = schedule_batch(schedules, ssd)
+    for field, model in BATCH_MODELS:
+        for row in getattr(batch, field):
+            session.add(model(**row))
+        session.flush()
+    session.commit()
+
+
+@pytest.fixture
+def populated(Session):
+    session = Session()
+    populate(session)
+    session.close()
+    return Session
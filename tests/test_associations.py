@@ -0,0 +1,54 @@
+import associations
+import models
+from conftest import SSD, schedule_batch
+
+
+def _chain(session, schedules=20):
+    # On top of populate()'s pairs, each pair joins the next, so associations run three deep from the first
+    reading = {a["rid"]: a["original_wt"] for a in schedule_batch(schedules).locations if a["tiploc"] == "RDNGSTN"}
+    for i in range(1, schedules - 1, 2):
+        main, assoc = "2026101600{:05d}".format(i), "2026101600{:05d}".format(i+1)
+        session.add(models.DarwinAssociation(category="NP", tiploc="RDNGSTN", ssd=SSD, main_rid=main, main_original_wt=reading[main],
+            assoc_rid=assoc, assoc_original_wt=reading[assoc]))
+    session.commit()
+
+
+def _rids(count):
+    return ["2026101600{:05d}".format(a) for a in range(0, 20, 20 // count)]
+
+
+def test_resolve_matches_serialise(populated, counter):
+    session = populated()
+    _chain(session)
+    session.close()
+
+    counts = []
+    for count in (2, 10):
+        rids = _rids(count)
+        session = populated()
+        expected = [session.get(models.DarwinSchedule, a).serialise(True) for a in rids]
+        session.close()
+
+        session = populated()
+        counter.reset()
+        schedules = associations.resolve(session, rids)
+        assert list(schedules) == rids
+        resolved = len(counter)
+        assert [schedules[a].serialise(True) for a in rids] == expected
+        # Nothing is lazy loaded, and the queries don't depend on how many schedules are resolved
+        assert len(counter) == resolved
+        counts.append(resolved)
+        session.close()
+    assert counts[0] == counts[1] > 0
+
+
+def test_resolve_depth(populated):
+    session = populated()
+    _chain(session)
+    graph = associations.AssociationGraph(session)
+    graph.resolve(["202610160000000"], depth=1, locations=False, formation=False)
+    assert graph.levels == {"202610160000000": 0, "202610160000001": 1}
+    graph = associations.AssociationGraph(session)
+    graph.resolve(["202610160000000"], depth=3)
+    assert graph.levels == {"202610160000000": 0, "202610160000001": 1, "202610160000002": 2, "202610160000003": 3}
+    session.close()
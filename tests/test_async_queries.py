@@ -0,0 +1,87 @@
+import asyncio
+import datetime
+
+import pytest
+import sqlalchemy
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+
+import async_queries
+import board
+import models
+from models import DarwinSchedule
+
+from conftest import SSD, populate, postgresql_types
+
+START = datetime.datetime.combine(SSD, datetime.time(8))
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A file, so that the sync engine populating it and the async one reading it share it"""
+    # Only a driver for these tests, not of the application, which runs on asyncpg
+    pytest.importorskip("aiosqlite")
+    path = tmp_path / "swallow.db"
+    engine = sqlalchemy.create_engine("sqlite:///{}".format(path))
+    models.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    populate(session)
+    session.close()
+    yield engine, "sqlite+aiosqlite:///{}".format(path)
+    engine.dispose()
+
+
+def _run(url, query):
+    async def run():
+        Session = async_queries.async_session_factory(url)
+        async with Session() as session:
+            result = await query(session)
+            # Serialising mustn't lazy load, which would raise under asyncio
+            return result, [a.serialise(True) for a in result] if isinstance(result, list) else result.serialise(True)
+    return asyncio.run(run())
+
+
+def test_board_matches_sync(database):
+    engine, url = database
+    _, out = _run(url, lambda session: async_queries.get_board(session, "RDG", START, START + datetime.timedelta(hours=2)))
+    session = sessionmaker(bind=engine)()
+    expected = [a.serialise(True) for a in board.get_board(session, "RDG", START, START + datetime.timedelta(hours=2))]
+    session.close()
+    assert out == expected and out
+
+
+def test_schedule_matches_sync(database):
+    engine, url = database
+    session = sessionmaker(bind=engine)()
+    schedule = session.query(DarwinSchedule).order_by(DarwinSchedule.rid).first()
+    expected = schedule.serialise(True)
+    _, out = _run(url, lambda s: async_queries.get_schedule(s, schedule.rid))
+    assert out == expected
+    _, out = _run(url, lambda s: async_queries.get_schedule_by_uid(s, schedule.uid, SSD))
+    assert out == expected
+    session.close()
+
+
+class _Capture:
+    """Stands in for an AsyncSession, keeping the statement instead of executing it"""
+    statement = None
+
+    async def execute(self, statement):
+        self.statement = statement
+        return self
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return []
+
+
+@pytest.mark.parametrize("crs,operator", [("RDG", "@>"), (["RDG", "PAD"], "&&")])
+def test_station_messages_compile_for_postgresql(crs, operator):
+    session = _Capture()
+    with postgresql_types():
+        asyncio.run(async_queries.get_station_messages(session, crs, min_severity=1))
+        sql = str(session.statement.compile(dialect=postgresql.dialect()))
+    assert "darwin_messages.stations {}".format(operator) in sql
+    assert "darwin_messages.severity >=" in sql
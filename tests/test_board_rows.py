@@ -0,0 +1,96 @@
+from collections import OrderedDict
+import datetime
+
+import board
+import board_rows
+import ingest
+import models
+from board_rows import BoardMaintainer
+from conftest import SSD, populate, schedule_batch
+
+
+def test_retention_deletes_board_rows(Session, engine):
+    # partitioning.drop_before() needs PostgreSQL, so only what it calls here
+    board_rows.create(engine)
+    try:
+        session = Session()
+        populate(session, schedules=4)
+        later = SSD + datetime.timedelta(days=1)
+        with engine.begin() as connection:
+            board_rows.rebuild(connection)
+            connection.execute(board_rows.board_rows.update().where(board_rows.board_rows.c.rid.like("%1")).values(ssd=later))
+            assert board_rows.drop_before(connection, later) == 3*4
+            assert {a.ssd for a in connection.execute(board_rows.board_rows.select())} == {later}
+            assert board_rows.drop_day(connection, later) == 4
+        session.close()
+    finally:
+        board_rows.metadata.drop_all(engine)
+
+
+def test_retention_without_board_rows(engine):
+    with engine.begin() as connection:
+        assert board_rows.drop_before(connection, SSD) == 0
+
+
+def _expected(location) -> OrderedDict:
+    """What serialise_row() should give for an ORM board row, from its own serialise()"""
+    out = location.serialise(True)
+    here = out["here"]
+    platform = here["platform"]
+    return OrderedDict([*[(a, out[a]) for a in ("rid", "uid", "rsid", "ssd", "signalling_id", "operator", "category", "is_passenger")],
+        *[(a, here[a]) for a in ("tiploc", "crs_darwin", "type", "activity", "cancelled", "length", "times")],
+        ("platform", OrderedDict((a, platform[a]) for a in ("platform", "suppressed", "confirmed"))),
+        ("origins", [a["name_short"] for a in out["origins"]]),
+        ("destinations", [a["name_short"] for a in out["destinations"]])])
+
+
+def test_rows_match_orm_serialise(populated, engine):
+    board_rows.create(engine)
+    try:
+        session = populated()
+        with engine.begin() as connection:
+            board_rows.rebuild(connection)
+        start, end = datetime.datetime.combine(SSD, datetime.time(0)), datetime.datetime.combine(SSD, datetime.time(23, 59))
+        for code in ("PAD", "RDG", "BRSTLTM", "DID"):
+            expected = [_expected(a) for a in board.get_board(session, code, start, end)]
+            with engine.connect() as connection:
+                assert [board_rows.serialise_row(a) for a in board_rows.get_board(connection, code, start, end)] == expected
+            assert expected or code == "DID"
+        session.close()
+    finally:
+        board_rows.metadata.drop_all(engine)
+
+
+def _compare(session, engine, code="PAD"):
+    start, end = datetime.datetime.combine(SSD, datetime.time(0)), datetime.datetime.combine(SSD, datetime.time(23, 59))
+    expected = [_expected(a) for a in board.get_board(session, code, start, end)]
+    with engine.connect() as connection:
+        assert [board_rows.serialise_row(a) for a in board_rows.get_board(connection, code, start, end)] == expected
+    return expected
+
+
+def test_association_writes_refresh_rows(Session, engine):
+    board_rows.create(engine)
+    maintainer = BoardMaintainer()
+    writer = ingest.BulkWriter(engine, method="upsert")
+    maintainer.attach(writer=writer, sessions=Session)
+    try:
+        session = Session()
+        populate(session, schedules=6)
+        batch = schedule_batch(schedules=6)
+        reading = {a["rid"]: a["original_wt"] for a in batch.locations if a["tiploc"] == "RDNGSTN"}
+
+        # Through the ORM and through the writer, each writing nothing but the association
+        session.add(models.DarwinAssociation(category="VV", tiploc="RDNGSTN", ssd=SSD, main_rid="202610160000002",
+            main_original_wt=reading["202610160000002"], assoc_rid="202610160000001", assoc_original_wt=reading["202610160000001"]))
+        session.commit()
+        writer.write(ingest.ScheduleBatch(associations=[dict(category="VV", tiploc="RDNGSTN", ssd=SSD, main_rid="202610160000004",
+            main_original_wt=reading["202610160000004"], assoc_rid="202610160000003", assoc_original_wt=reading["202610160000003"])]))
+        session.expire_all()
+
+        expected = _compare(session, engine)
+        assert [len(a["destinations"]) for a in expected] == [2, 1, 3, 1, 3, 1]
+        session.close()
+    finally:
+        maintainer.detach()
+        board_rows.metadata.drop_all(engine)
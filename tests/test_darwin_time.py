@@ -0,0 +1,96 @@
+import datetime
+import random
+from collections import OrderedDict
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+import darwin_time
+
+
+def _decimal_combine(working_time, darwin_time_):
+    """models._combine_darwin_time as it was before darwin_time, on Decimal hours"""
+    if not working_time or not darwin_time_:
+        return None
+    t1, t2 = [a.hour*3600+a.minute*60+a.second for a in (darwin_time_, working_time)]
+    difference = (Decimal(t1)-Decimal(t2))/3600
+    if difference < -6:
+        ssd_offset = +1
+    elif -6 <= difference <= +18:
+        ssd_offset = 0
+    else:
+        ssd_offset = -1
+    return datetime.datetime.combine(working_time.date(), darwin_time_) + datetime.timedelta(days=ssd_offset)
+
+
+def _decimal_times_dict(location):
+    out = OrderedDict()
+    for letter, name in zip("apd", ["arrival", "pass", "departure"]):
+        this_times = OrderedDict()
+        wt = getattr(location, "wt%s" % letter)
+        if wt:
+            this_times["working"] = wt
+        pt = getattr(location, "pt%s" % letter, None)
+        if pt:
+            this_times["public"] = pt
+        st = _decimal_combine(wt, getattr(location.status, "t%s" % letter))
+        stt = getattr(location.status, "t%s_type" % letter)
+        if st and stt:
+            this_times["actual"*(stt=="A") or "estimated"] = st
+        out[name] = this_times
+    return out
+
+
+def _random_time(r):
+    return datetime.time(r.randrange(24), r.randrange(60), r.choice((0, 0, 30, r.randrange(60))))
+
+
+def _random_working(r):
+    return datetime.datetime.combine(datetime.date(2026, 10, 16), _random_time(r))
+
+
+# Either side of the -6 and +18 hour thresholds, in seconds since midnight
+EDGES = [(w, w + offset) for w in (0, 6*3600, 12*3600, 18*3600, 23*3600+59*60) for offset in (-6*3600-1, -6*3600, -6*3600+1, 18*3600-1, 18*3600, 18*3600+1)
+    if 0 <= w + offset < 86400]
+
+
+@pytest.mark.parametrize("working,darwin", EDGES)
+def test_threshold_edges(working, darwin):
+    wt = datetime.datetime(2026, 10, 16) + datetime.timedelta(seconds=working)
+    dt = (datetime.datetime.min + datetime.timedelta(seconds=darwin)).time()
+    assert darwin_time.combine(wt, dt) == _decimal_combine(wt, dt)
+
+
+def test_combine_matches_decimal():
+    r = random.Random(0)
+    for _ in range(20000):
+        wt, dt = _random_working(r), _random_time(r)
+        assert darwin_time.combine(wt, dt) == _decimal_combine(wt, dt)
+
+
+def test_combine_missing():
+    assert darwin_time.combine(None, datetime.time(1)) is None
+    assert darwin_time.combine(datetime.datetime(2026, 10, 16), None) is None
+
+
+def test_combine_many_matches_combine():
+    r = random.Random(1)
+    wts = [_random_working(r) if r.random() < .9 else None for _ in range(5000)]
+    dts = [_random_time(r) if r.random() < .9 else None for _ in range(5000)]
+    assert darwin_time.combine_many(wts, dts) == [_decimal_combine(a, b) for a, b in zip(wts, dts)]
+    with pytest.raises(ValueError):
+        darwin_time.combine_many(wts, dts[1:])
+
+
+def test_complete_times_dicts_match_decimal():
+    r = random.Random(2)
+    locations = []
+    for _ in range(2000):
+        maybe = lambda f: f() if r.random() < .7 else None
+        status = SimpleNamespace(**{k: maybe(lambda: _random_time(r)) for k in ("ta", "tp", "td")},
+            **{k: r.choice(("A", "E", None)) for k in ("ta_type", "tp_type", "td_type")})
+        locations.append(SimpleNamespace(status=status, **{k: maybe(lambda: _random_working(r)) for k in ("wta", "wtp", "wtd", "pta", "ptd")}))
+    expected = [_decimal_times_dict(a) for a in locations]
+    assert [darwin_time.complete_times_dict(a) for a in locations] == expected
+    assert darwin_time.complete_times_dicts(locations) == expected
@@ -0,0 +1,83 @@
+import datetime
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool, QueuePool, SingletonThreadPool, StaticPool
+
+import models
+from database import Database, create_engine
+
+
+@pytest.mark.parametrize("url, kwargs, pool", [
+    ("sqlite://", {}, SingletonThreadPool),
+    ("sqlite:///{tmp}/a.db", {}, NullPool),
+    ("sqlite:///{tmp}/a.db", {"poolclass": QueuePool}, QueuePool),
+    ("sqlite://", {"poolclass": StaticPool}, StaticPool),
+])
+def test_create_engine_pools(tmp_path, url, kwargs, pool):
+    engine = create_engine(url.format(tmp=tmp_path), pool_size=3, **kwargs)
+    assert isinstance(engine.pool, pool)
+    if pool is QueuePool:
+        assert engine.pool.size() == 3
+    with engine.connect() as connection:
+        connection.exec_driver_sql("SELECT 1")
+    engine.dispose()
+
+
+class _Connecting(Exception):
+    pass
+
+
+def test_create_engine_postgresql_options():
+    engine = create_engine("postgresql://localhost/swallow", statement_timeout=500, connect_timeout=3)
+    assert isinstance(engine.pool, QueuePool) and engine.pool.size() == 10
+    connected = {}
+
+    @event.listens_for(engine, "do_connect")
+    def do_connect(dialect, connection_record, cargs, cparams):
+        connected.update(cparams)
+        raise _Connecting()
+
+    with pytest.raises(_Connecting):
+        engine.connect()
+    assert connected["connect_timeout"] == 3
+    assert connected["options"] == "-c application_name=swallow -c statement_timeout=500"
+    engine.dispose()
+
+
+def _database(tmp_path, replica_sequence, **kwargs) -> Database:
+    database = Database("sqlite:///{}/primary.db".format(tmp_path), ["sqlite:///{}/replica.db".format(tmp_path)], **kwargs)
+    now = datetime.datetime(2026, 10, 16, 12)
+    # The replica a second behind if in step, otherwise a minute
+    replica_acquired = now - datetime.timedelta(seconds=1 if replica_sequence == 10 else 60)
+    for engine, sequence, acquired in ((database.primary, 10, now), (database.replicas[0], replica_sequence, replica_acquired)):
+        models.LastReceivedSequence.__table__.create(engine)
+        with engine.begin() as connection:
+            connection.execute(models.LastReceivedSequence.__table__.insert(), dict(id=1, sequence=sequence, time_acquired=acquired))
+    return database
+
+
+def test_reads_go_to_replicas_in_step(tmp_path):
+    database = _database(tmp_path, 10)
+    replica = database.replicas[0]
+    assert database.read_engine() is replica
+    assert database.read_engine(min_sequence=11) is database.primary
+    assert [a["healthy"] for a in database.status()] == [True, True]
+    database.dispose()
+
+    (tmp_path / "lagging").mkdir()
+    database = _database(tmp_path / "lagging", 5)
+    assert database.read_engine() is database.primary
+    database.dispose()
+
+
+def test_refresh_doesnt_wait_for_another(tmp_path):
+    database = _database(tmp_path, 10)
+    # As if another thread were checking, for the first time
+    database._refreshing.acquire()
+    try:
+        assert database.read_engine() is database.primary
+    finally:
+        database._refreshing.release()
+    assert database.read_engine() is database.replicas[0]
+    database.dispose()
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+import export
+from models import DarwinMessage, DarwinSchedule, DarwinScheduleFormation
+
+from conftest import SSD
+
+
+@pytest.fixture
+def data(populated):
+    session = populated()
+    rid = session.query(DarwinSchedule.rid).order_by(DarwinSchedule.rid).first()[0]
+    for seq, coach in enumerate("ABCD"):
+        session.add(DarwinScheduleFormation(rid=rid, ssd=SSD, fid=rid + "0001", seq=seq, coach_number=coach, coach_class="Standard",
+            toilet_status="InService", toilet_type="Standard"))
+    session.add(DarwinMessage(message_id=1, category="Train", severity=1, suppress=False, stations=["RDG", "PAD"], message="<p>Delays</p>"))
+    session.add(DarwinMessage(message_id=2, category="Station", severity=0, suppress=True, stations=["BRI"], message="Lift out of order"))
+    session.commit()
+    session.close()
+    return populated
+
+
+@pytest.mark.parametrize("recurse", [False, True])
+def test_schedules_match_orm(data, engine, recurse):
+    session = data()
+    expected = [a.serialise(recurse) for a in session.query(DarwinSchedule).order_by(DarwinSchedule.ssd, DarwinSchedule.rid)]
+    session.close()
+    with engine.connect() as connection:
+        # Small chunks, so associated schedules are loaded from other chunks too
+        out = list(export.iter_schedules(connection, recurse=recurse, chunk_size=3))
+    assert out == expected
+    assert any(len(a["origins"]) > 1 for a in out)
+
+
+def test_messages_match_orm(data, engine):
+    session = data()
+    expected = [a.serialise() for a in session.query(DarwinMessage).order_by(DarwinMessage.message_id)]
+    session.close()
+    with engine.connect() as connection:
+        assert list(export.iter_messages(connection)) == expected
+
+
+def test_stream_json(data, engine):
+    with engine.connect() as connection:
+        items = list(export.iter_schedules(connection, recurse=True))
+        streamed = b"".join(export.stream_json(export.iter_schedules(connection, recurse=True), chunk_bytes=512))
+    assert json.loads(streamed) == json.loads(json.dumps(items, default=export._json_default))
@@ -0,0 +1,145 @@
+import datetime
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+import ingest
+import models
+import partitioning
+from conftest import SSD, add_reference_data, schedule_batch
+
+_STRANGE = {"tiploc": "PADTON", "note": 'a "quoted"\ttab, a \\ backslash,\na newline and {braces}'}
+
+
+def _reference(engine):
+    session = sessionmaker(bind=engine)()
+    add_reference_data(session)
+    session.commit()
+    session.close()
+
+
+def _rows(connection, model) -> dict:
+    table = model.__table__
+    return {tuple(row[a.name] for a in table.primary_key.columns): row for row in connection.execute(table.select())}
+
+
+def _batch(schedules=4):
+    batch = schedule_batch(schedules)
+    batch.schedules[0].update(origins=[_STRANGE, None], delay_reason={"reason": 101, "near": "R\\DG"})
+    return batch
+
+
+def test_unknown_method(engine):
+    with pytest.raises(ValueError):
+        ingest.BulkWriter(engine, method="merge")
+
+
+@pytest.mark.parametrize("method", ["copy", "upsert"])
+def test_write_and_rewrite(pg_engine, method):
+    _reference(pg_engine)
+    writer = ingest.BulkWriter(pg_engine, method=method)
+    batch = _batch()
+    assert writer.write(batch) == len(batch)
+
+    # Rewrites update in place, and a row repeated in a batch is written as its last
+    batch.schedules[1]["signalling_id"] = "2B00"
+    batch.statuses.append(dict(batch.statuses[0], plat="2\\A", plat_confirmed=False))
+    assert writer.write(batch) == len(batch) - 1
+
+    with pg_engine.connect() as connection:
+        schedules = _rows(connection, models.DarwinSchedule)
+        assert len(schedules) == 4
+        assert schedules[("202610160000000",)].origins == [_STRANGE, None]
+        assert schedules[("202610160000000",)].delay_reason == {"reason": 101, "near": "R\\DG"}
+        assert schedules[("202610160000001",)].signalling_id == "2B00"
+        assert schedules[("202610160000002",)].is_charter is False
+
+        statuses = _rows(connection, models.DarwinScheduleStatus)
+        assert len(statuses) == len(batch.statuses) - 1
+        first = batch.statuses[0]
+        status = statuses[(first["rid"], first["tiploc"], first["original_wt"])]
+        assert (status.plat, status.plat_confirmed) == ("2\\A", False)
+        # Resolved in the same transaction
+        assert all(a.td_resolved is not None or a.tiploc == "BRSTLTM" for a in statuses.values())
+
+        assert len(_rows(connection, models.DarwinScheduleLocation)) == len(batch.locations)
+        assert len(_rows(connection, models.DarwinAssociation)) == len(batch.associations)
+
+
+def test_copy_matches_upsert(pg_engine):
+    _reference(pg_engine)
+    out = {}
+    for method in ("upsert", "copy"):
+        ingest.BulkWriter(pg_engine, method=method).write(_batch())
+        with pg_engine.begin() as connection:
+            out[method] = {model: _rows(connection, model) for _, model in ingest.BATCH_MODELS}
+            for table in reversed(models.Base.metadata.sorted_tables):
+                if table.name in models.PARTITIONED_TABLES:
+                    connection.execute(table.delete())
+    assert out["copy"] == out["upsert"]
+
+
+def test_model_instances(pg_engine):
+    _reference(pg_engine)
+    batch = _batch(2)
+    writer = ingest.BulkWriter(pg_engine)
+    writer.write(ingest.ScheduleBatch(schedules=[models.DarwinSchedule(**a) for a in batch.schedules]))
+    with pg_engine.connect() as connection:
+        assert {a.rid: a.origins for a in connection.execute(models.DarwinSchedule.__table__.select())} == {a["rid"]: a["origins"] for a in batch.schedules}
+
+
+def _sequence(connection):
+    return connection.execute(select([models.LastReceivedSequence.__table__.c.sequence])).scalar()
+
+
+def test_sequence(pg_engine):
+    _reference(pg_engine)
+    writer = ingest.BulkWriter(pg_engine, method="upsert")
+    batch = _batch(2)
+    writer.write(ingest.ScheduleBatch(schedules=batch.schedules), sequence=5)
+    with pg_engine.connect() as connection:
+        assert _sequence(connection) == 5
+
+    with pg_engine.connect() as connection:
+        transaction = connection.begin()
+        writer.write_connection(connection, ingest.ScheduleBatch(schedules=batch.schedules), sequence=6)
+        assert _sequence(connection) == 6
+        transaction.rollback()
+        assert _sequence(connection) == 5
+
+    writer.write(ingest.ScheduleBatch(), sequence=7)
+    with pg_engine.begin() as connection:
+        assert _sequence(connection) == 7
+        when = datetime.datetime(2026, 10, 16, 12)
+        ingest.advance_sequence(connection, 9, time_acquired=when)
+        ingest.advance_sequence(connection, 1, sequence_id=2, time_acquired=when)
+        rows = connection.execute(models.LastReceivedSequence.__table__.select()).fetchall()
+        assert {(a.id, a.sequence, a.time_acquired) for a in rows} == {(1, 9, when), (2, 1, when)}
+
+
+@pytest.mark.parametrize("method", ["copy", "upsert"])
+def test_partitioned_fills_ssd(pg_partitioned_engine, method):
+    engine = pg_partitioned_engine
+    _reference(engine)
+    writer = ingest.BulkWriter(engine, method=method, partitioned=True)
+    batch = _batch(4)
+    for field in ("locations", "statuses", "associations"):
+        for row in getattr(batch, field):
+            row["ssd"] = None
+    later = SSD + datetime.timedelta(days=1)
+    batch.schedules[3]["ssd"] = later
+
+    # The schedules of child rows in the batch, then those already written
+    writer.write(ingest.ScheduleBatch(schedules=batch.schedules, locations=batch.locations))
+    writer.write(ingest.ScheduleBatch(statuses=batch.statuses, associations=batch.associations))
+    # Rewritten, still in the same partition
+    writer.write(ingest.ScheduleBatch(statuses=batch.statuses[:1]))
+
+    with engine.connect() as connection:
+        assert partitioning.partition_days(connection) == [SSD, later]
+        for _, model in ingest.BATCH_MODELS[1:4]:
+            rows = _rows(connection, model)
+            rid = "main_rid" if model is models.DarwinAssociation else "rid"
+            assert rows and {(getattr(a, rid), a.ssd) for a in rows.values()} <= {(a["rid"], a["ssd"]) for a in batch.schedules}
+        assert len(_rows(connection, models.DarwinScheduleStatus)) == len(batch.statuses)
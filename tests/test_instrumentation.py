@@ -0,0 +1,121 @@
+import datetime
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from board import get_board
+from instrumentation import Instrumentation, TooManyQueries
+from loading import with_profile
+from models import DarwinSchedule
+
+from conftest import SSD
+
+START = datetime.datetime.combine(SSD, datetime.time(8))
+
+
+@pytest.fixture
+def instrumentation(engine):
+    instrumentation = Instrumentation()
+    instrumentation.attach(engine)
+    yield instrumentation
+    instrumentation.detach()
+
+
+def _board(session, hours):
+    return [a.serialise(True) for a in get_board(session, "RDG", START, START + datetime.timedelta(hours=hours))]
+
+
+def test_board_statements_fixed(populated, instrumentation):
+    # Each window has associated services, so every eager load has something to load
+    counts = []
+    for hours in (1, 2, 4):
+        session = populated()
+        with instrumentation.operation("board") as operation:
+            rows = _board(session, hours)
+        session.close()
+        assert not operation.lazy_loads
+        counts.append((len(rows), operation.statements))
+    assert counts[0][0] < counts[1][0] < counts[2][0]
+    assert len({a[1] for a in counts}) == 1
+    statements = counts[0][1]
+
+    session = populated()
+    with instrumentation.max_queries(statements):
+        _board(session, 4)
+    with pytest.raises(TooManyQueries):
+        with instrumentation.max_queries(statements - 1):
+            _board(session, 4)
+    session.close()
+
+
+@pytest.mark.parametrize("profile,recurse", [("board", False), ("full-service", True)])
+def test_profile_statements_fixed(populated, instrumentation, profile, recurse):
+    counts = []
+    for limit in (2, 20):
+        session = populated()
+        with instrumentation.operation(profile) as operation:
+            schedules = with_profile(session.query(DarwinSchedule), profile).order_by(DarwinSchedule.rid).limit(limit).all()
+            [a.serialise(recurse) for a in schedules]
+        session.close()
+        assert not operation.lazy_loads
+        counts.append(operation.statements)
+    assert counts[0] == counts[1]
+
+
+def test_summary_profile_raises_on_lazy_load(populated):
+    session = populated()
+    schedule = with_profile(session.query(DarwinSchedule), "summary").first()
+    with pytest.raises(Exception):
+        schedule.serialise(False)
+    session.close()
+
+
+def test_relationships_lazy_by_default(populated, instrumentation):
+    # Eager loading is up to the profiles, so a plain query is only the one statement
+    session = populated()
+    with instrumentation.operation("plain") as operation:
+        session.query(DarwinSchedule).all()
+    assert operation.statements == 1
+    with pytest.raises(ValueError):
+        with_profile(session.query(DarwinSchedule), "departures")
+    session.close()
+
+
+def test_nested_operations_roll_up(populated, instrumentation):
+    instrumentation.instrument_serialisers()
+    session = populated()
+    with instrumentation.operation("request") as request:
+        with instrumentation.operation("query") as query:
+            schedules = session.query(DarwinSchedule).order_by(DarwinSchedule.rid).limit(3).all()
+        # Lazy loads as serialise() goes, counted towards the serialise() operation and the request
+        [a.serialise(False) for a in schedules]
+    session.close()
+
+    snapshot = instrumentation.snapshot()
+    serialised = snapshot["DarwinSchedule.serialise"]
+    assert serialised["count"] == 3 and serialised["statements"] > 0
+    assert request.statements == query.statements + serialised["statements"]
+    assert len(request.lazy_loads) == sum(serialised["lazy_loads"].values()) > 0
+
+
+def test_strict_limit_applies_to_enclosing(populated, instrumentation):
+    session = populated()
+    with pytest.raises(TooManyQueries) as raised:
+        with instrumentation.max_queries(1, "request"):
+            with instrumentation.operation("inner"):
+                session.execute(text("SELECT 1"))
+                session.execute(text("SELECT 2"))
+    assert raised.value.operation.name == "request"
+    session.close()
+
+
+def test_failed_statement_leaves_no_start(engine, instrumentation):
+    with engine.connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.execute(text("SELECT * FROM no_such_table"))
+        assert not connection.info.get("swallow_query_start")
+        with instrumentation.operation("after") as operation:
+            connection.execute(text("SELECT 1"))
+        assert operation.statements == 1
+        assert not connection.info["swallow_query_start"]
@@ -0,0 +1,55 @@
+import random
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+import models
+from messages import MessageIndex, get_station_messages, station_filters
+
+CODES = ["PAD", "RDG", "DID", "SWI", "BTH", "BRI"]
+
+
+def _messages(count=60):
+    rng = random.Random(1)
+    return [models.DarwinMessage(message_id=i, category="Train", severity=rng.randrange(4), suppress=rng.random() < 0.2,
+        stations=rng.sample(CODES, rng.randrange(4)), message="Message {}".format(i)) for i in range(count)]
+
+
+def _expected(messages, codes, min_severity=None, max_severity=None, suppressed=False):
+    out = [a for a in messages if set(a.stations) & set(codes) and (min_severity is None or a.severity >= min_severity)
+        and (max_severity is None or a.severity <= max_severity) and (suppressed or not a.suppress)]
+    return [a.message_id for a in sorted(out, key=lambda a: (-a.severity, a.message_id))]
+
+
+@pytest.mark.parametrize("codes,filters", [
+    (["RDG"], {}),
+    (["RDG", "BRI"], {}),
+    (["PAD"], {"min_severity": 2}),
+    (["SWI", "BTH", "DID"], {"max_severity": 1, "suppressed": True}),
+    (["XXX"], {}),
+])
+def test_station_messages(pg_engine, codes, filters):
+    messages = _messages()
+    expected = _expected(messages, codes, **filters)
+    session = sessionmaker(bind=pg_engine)()
+    session.add_all(messages)
+    session.commit()
+
+    crs = codes[0] if len(codes) == 1 else codes
+    assert [a.message_id for a in get_station_messages(session, crs, **filters)] == expected
+    index = MessageIndex()
+    index.load(session)
+    assert [a.message_id for a in get_station_messages(session, crs, index=index, **filters)] == expected
+    assert sorted(index.ids(crs, **filters)) == sorted(expected)
+    session.close()
+
+
+def test_station_filters_use_gin_index(pg_engine):
+    with pg_engine.begin() as connection:
+        connection.execute(text("SET LOCAL enable_seqscan = off"))
+        for codes in (["RDG"], ["RDG", "BRI"]):
+            query = models.DarwinMessage.__table__.select().where(*station_filters(codes))
+            compiled = query.compile(dialect=connection.dialect)
+            plan = "\n".join(a[0] for a in connection.exec_driver_sql("EXPLAIN " + str(compiled), compiled.params))
+            assert "ix_darwin_messages_stations_gin" in plan
@@ -0,0 +1,128 @@
+import datetime
+import random
+from typing import NamedTuple, Optional
+
+import pytest
+
+import models
+import network
+from network import Constraints, NetworkGraph
+
+TIPLOCS = ["T{}".format(a) for a in range(7)]
+CONSTRAINTS = [Constraints(), Constraints(power=frozenset("E")), Constraints(power=frozenset("DE")), Constraints(doo_passenger=True),
+    Constraints(power=frozenset(" D"), doo_passenger=True, doo_non_passenger=True)]
+
+
+class Link(NamedTuple):
+    origin: str
+    destination: str
+    distance: Optional[int]
+    route_allowance: int
+    power: str
+    doo_passenger: bool
+    doo_non_passenger: bool
+    reversible: str
+
+
+def _links(seed: int, count: int=14):
+    rng = random.Random(seed)
+    out = []
+    for _ in range(count):
+        origin, destination = rng.sample(TIPLOCS, 2)
+        out.append(Link(origin, destination, rng.choice([None, 0] + list(range(1, 30))), rng.randrange(0, 10), rng.choice(" DE"),
+            rng.random() < 0.6, rng.random() < 0.6, rng.choice("BRUN")))
+    return out
+
+
+def _usable(link: Link, weight: str, constraints: Constraints) -> bool:
+    return (getattr(link, weight) is not None and getattr(link, weight) >= 0
+        and (constraints.power is None or link.power in constraints.power)
+        and (link.doo_passenger or not constraints.doo_passenger)
+        and (link.doo_non_passenger or not constraints.doo_non_passenger))
+
+
+def _brute_force(links, origin: str, destination: str, weight: str, constraints: Constraints) -> Optional[int]:
+    """Cheapest cost over every simple path"""
+    edges = []
+    for link in links:
+        if _usable(link, weight, constraints):
+            edges.append((link.origin, link.destination, getattr(link, weight)))
+            if link.reversible in network.REVERSIBLE:
+                edges.append((link.destination, link.origin, getattr(link, weight)))
+    best = None
+
+    def walk(node, cost, visited):
+        nonlocal best
+        if node == destination:
+            best = cost if best is None else min(best, cost)
+            return
+        for a, b, c in edges:
+            if a == node and b not in visited:
+                walk(b, cost + c, visited | {b})
+
+    walk(origin, 0, {origin})
+    return best
+
+
+def _cost(links, tiplocs, weight: str, constraints: Constraints) -> Optional[int]:
+    """Of a route by its tiplocs, taking the cheapest usable link for each step"""
+    total = 0
+    for a, b in zip(tiplocs, tiplocs[1:]):
+        costs = [getattr(link, weight) for link in links if _usable(link, weight, constraints)
+            and ((link.origin, link.destination) == (a, b) or (link.reversible in network.REVERSIBLE and (link.destination, link.origin) == (a, b)))]
+        if not costs:
+            return None
+        total += min(costs)
+    return total
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_routes_match_brute_force(seed):
+    links = _links(seed)
+    graph = NetworkGraph(links)
+    for weight in network.WEIGHTS:
+        for constraints in CONSTRAINTS:
+            for origin in TIPLOCS:
+                distances = graph.distances_from(origin, weight, constraints)
+                for destination in TIPLOCS:
+                    expected = _brute_force(links, origin, destination, weight, constraints) if origin in graph.ids else None
+                    route = graph.route(origin, destination, weight, constraints)
+                    assert (route.cost if route else None) == expected
+                    assert distances.get(destination) == expected
+                    if route is not None:
+                        assert route.tiplocs[0] == origin and route.tiplocs[-1] == destination
+                        assert _cost(links, route.tiplocs, weight, constraints) == route.cost
+
+
+def test_service_route_joins_legs():
+    links = _links(3, count=30)
+    graph = NetworkGraph(links)
+    for stops in (["T0", "T3", "T5"], ["T1", "T1", "T4", "T2"], ["T6"]):
+        route = graph.service_route(stops)
+        legs = [graph.route(a, b) for a, b in zip(stops, stops[1:]) if a != b]
+        if any(a is None for a in legs):
+            assert route is None
+            continue
+        assert route.cost == sum(a.cost for a in legs)
+        assert route.tiplocs[0] == stops[0] and route.tiplocs[-1] == stops[-1]
+        assert _cost(links, route.tiplocs, "distance", Constraints()) == route.cost
+
+
+def test_unknown_weight_raises():
+    with pytest.raises(ValueError):
+        NetworkGraph(_links(0)).route("T0", "T1", weight="time")
+
+
+def test_load_takes_links_valid_on_date(Session):
+    session = Session()
+    day = datetime.date(2026, 10, 16)
+    for origin, destination, start, end in (("A", "B", None, None), ("B", "C", day, day), ("C", "D", day + datetime.timedelta(1), None), ("A", "D", None, day - datetime.timedelta(1))):
+        session.add(models.BPlanNetworkLink(origin=origin, destination=destination, running_line_code="", start_date=start, end_date=end,
+            initial_direction="D", final_direction="D", distance=10, doo_passenger=False, doo_non_passenger=False, retb=False, zone="1",
+            reversible="N", power="E", route_allowance=0))
+    session.commit()
+    graph = network.load(session, day)
+    assert graph.route("A", "C").tiplocs == ("A", "B", "C")
+    assert graph.route("A", "D") is None
+    assert network.load(session).route("A", "D").cost == 10
+    session.close()
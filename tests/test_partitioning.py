@@ -0,0 +1,95 @@
+import datetime
+
+import pytest
+from sqlalchemy import UniqueConstraint, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateTable
+
+import models
+import partitioning
+from ingest import BATCH_MODELS
+from conftest import SSD, add_reference_data, postgresql_types, schedule_batch
+
+
+def _ddl(table) -> str:
+    return " ".join(str(CreateTable(table).compile(dialect=postgresql.dialect())).split())
+
+
+def test_partitioned_ddl():
+    with postgresql_types():
+        metadata = models._partitioned_metadata()
+    assert set(metadata.tables) == set(models.Base.metadata.tables)
+    for name in models.PARTITIONED_TABLES:
+        table = metadata.tables[name]
+        ddl = _ddl(table)
+        assert ddl.endswith("PARTITION BY RANGE (ssd)")
+        assert "ssd" in [a.name for a in table.primary_key.columns]
+        assert not table.c.ssd.nullable
+        assert all(a.column.table.name not in models.PARTITIONED_TABLES for a in table.foreign_keys)
+        assert all("ssd" in a.columns for a in table.constraints if isinstance(a, UniqueConstraint))
+    assert "darwin_locations.tiploc" in {a.target_fullname for a in metadata.tables["darwin_schedule_locations"].foreign_keys}
+    assert "PARTITION BY" not in _ddl(metadata.tables["darwin_locations"])
+
+
+def test_partition_names():
+    assert partitioning.partition_name("darwin_schedules", SSD) == "darwin_schedules_20261016"
+    start, end = datetime.datetime.combine(SSD, datetime.time(0, 30)), datetime.datetime.combine(SSD, datetime.time(2))
+    assert partitioning.ssd_window(start, end) == (SSD - datetime.timedelta(days=1), SSD)
+
+
+def _without_ssd(batch):
+    for field in ("locations", "statuses", "associations"):
+        for row in getattr(batch, field):
+            del row["ssd"]
+    return batch
+
+
+def _write_orm(session, batch, fields):
+    for field, model in BATCH_MODELS:
+        if field in fields:
+            for row in getattr(batch, field):
+                session.add(model(**row))
+
+
+def test_orm_writes_fill_ssd(Session):
+    session = Session()
+    add_reference_data(session)
+    batch = _without_ssd(schedule_batch(schedules=4))
+    # In the same flush as their schedules, then with them committed and out of the session
+    _write_orm(session, batch, ("schedules", "locations"))
+    session.commit()
+    session.close()
+
+    session = Session()
+    _write_orm(session, batch, ("statuses", "associations"))
+    session.add(models.DarwinScheduleFormation(rid="202610160000000", fid="202610160000000-001", seq=1, coach_number="A", coach_class="Standard", toilet_type="None"))
+    session.commit()
+    for model, _ in models._SSD_MODELS:
+        assert {a.ssd for a in session.query(model)} == {SSD}
+    session.close()
+
+
+def test_partitioned_orm_writes(pg_partitioned_engine):
+    engine = pg_partitioned_engine
+    with engine.begin() as connection:
+        partitioning.ensure_partition_range(connection, SSD, SSD + datetime.timedelta(days=1))
+        assert partitioning.partition_days(connection) == [SSD, SSD + datetime.timedelta(days=1)]
+        assert partitioning.partition_days(connection, "darwin_associations") == [SSD, SSD + datetime.timedelta(days=1)]
+
+    session = sessionmaker(bind=engine)()
+    add_reference_data(session)
+    batch = _without_ssd(schedule_batch(schedules=4))
+    _write_orm(session, batch, ("schedules", "locations"))
+    session.commit()
+    _write_orm(session, batch, ("statuses", "associations"))
+    session.commit()
+    session.close()
+
+    with engine.begin() as connection:
+        for table in models.PARTITIONED_TABLES[:4]:
+            assert connection.execute(text('SELECT count(*) FROM "{}"'.format(table))).scalar() == \
+                connection.execute(text('SELECT count(*) FROM "{}"'.format(partitioning.partition_name(table, SSD)))).scalar() > 0
+        assert partitioning.drop_before(connection, SSD + datetime.timedelta(days=1)) == [SSD]
+        assert partitioning.partition_days(connection) == [SSD + datetime.timedelta(days=1)]
+        assert connection.execute(select([models.DarwinSchedule.__table__.c.rid])).fetchall() == []
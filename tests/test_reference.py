@@ -0,0 +1,72 @@
+import datetime
+
+import pytest
+
+import models
+from board import get_board
+from reference import ReferenceCache
+
+from conftest import SSD
+
+START = datetime.datetime.combine(SSD, datetime.time(8))
+END = START + datetime.timedelta(hours=3)
+
+
+@pytest.fixture
+def cache():
+    cache = ReferenceCache()
+    yield cache
+    cache.uninstall()
+
+
+def _board(Session):
+    session = Session()
+    try:
+        rows = get_board(session, "RDG", START, END)
+        return rows, [a.serialise(True) for a in rows]
+    finally:
+        session.close()
+
+
+def test_unloaded_cache_falls_back(populated, cache):
+    _, expected = _board(populated)
+    cache.install()
+    rows, out = _board(populated)
+    assert out == expected
+    assert all("location" in a.__dict__ for a in rows)
+
+
+def test_loaded_cache_resolves_locations(populated, cache, counter):
+    counter.reset()
+    _, expected = _board(populated)
+    uncached = len(counter)
+    session = populated()
+    cache.refresh(session)
+    session.close()
+    cache.install()
+
+    counter.reset()
+    rows, out = _board(populated)
+    assert out == expected
+    assert all("location" not in a.__dict__ for a in rows)
+    # Origins, destinations and associated calling points no longer join darwin_locations, but are the same selects
+    assert len(counter) == uncached
+    assert not any("darwin_locations" in a for a in counter.statements[1:])
+
+
+def test_stale_cache_falls_back(populated, cache):
+    session = populated()
+    cache.refresh(session)
+    session.close()
+    cache.install()
+    cache.invalidate()
+    rows, _ = _board(populated)
+    assert all("location" in a.__dict__ for a in rows)
+
+
+def test_cached_location_serialises_as_row(populated, cache):
+    session = populated()
+    cache.refresh(session)
+    for row in session.query(models.DarwinLocation):
+        assert cache.location(row.tiploc).serialise() == row.serialise()
+    session.close()
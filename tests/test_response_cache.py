@@ -0,0 +1,69 @@
+from sqlalchemy import select
+
+import ingest
+import models
+from conftest import schedule_batch
+from response_cache import Invalidator, ResponseCache
+
+
+def test_eviction_prunes_dependents():
+    cache = ResponseCache(max_entries=2)
+    for i in range(100):
+        cache.put(("schedule", "rid{}".format(i), False), {}, embeds=["rid{}".format(i+1000), "rid{}".format(i+2000)])
+    assert len(cache) == 2
+    assert set(cache._dependents) == {"rid1098", "rid2098", "rid1099", "rid2099"}
+    assert set(cache._embeds) == {"rid98", "rid99"}
+
+    cache.invalidate(["rid1099"])
+    assert len(cache) == 1
+    assert set(cache._dependents) == {"rid1098", "rid2098"}
+    assert cache.get(("schedule", "rid98", False)) == {}
+
+
+def _schedules_only(batch):
+    # Resolving status times needs PostgreSQL
+    return ingest.ScheduleBatch(schedules=batch.schedules, associations=batch.associations)
+
+
+def test_writer_invalidates_once_committed(engine):
+    cache = ResponseCache()
+    writer = ingest.BulkWriter(engine, method="upsert")
+    invalidator = Invalidator(cache)
+    invalidator.attach(writer=writer)
+    batch = _schedules_only(schedule_batch(schedules=4))
+    try:
+        for rid in ("202610160000000", "202610160000001", "202610160000004"):
+            cache.put(("schedule", rid, False), {})
+        cache.put(("station", "RDG"), {}, embeds=["202610160000003"])
+
+        # Only once the transaction has committed, not within it or when it's rolled back
+        with engine.connect() as connection:
+            transaction = connection.begin()
+            written = {}
+            assert writer.write_connection(connection, batch, written=written) == 6
+            assert written == {"schedules": {"2026101600{:05d}".format(a) for a in range(4)},
+                "associations": {"2026101600{:05d}".format(a) for a in range(4)}}
+            assert len(cache) == 4
+            transaction.rollback()
+        assert len(cache) == 4
+
+        assert writer.write(ingest.ScheduleBatch(schedules=batch.schedules[:1])) == 1
+        assert cache.get(("schedule", "202610160000000", False)) is None
+        assert len(cache) == 3
+
+        assert writer.write(ingest.ScheduleBatch(associations=batch.associations[1:])) == 1
+        assert cache.get(("station", "RDG")) is None
+        assert cache.get(("schedule", "202610160000001", False)) == {}
+
+        # Rewriting rows updates them
+        batch.schedules[1]["signalling_id"] = "2B00"
+        assert writer.write(batch) == 6
+        assert cache.get(("schedule", "202610160000001", False)) is None
+        assert cache.get(("schedule", "202610160000004", False)) == {}
+        with engine.connect() as connection:
+            schedules = models.DarwinSchedule.__table__
+            assert {a.rid: a.signalling_id for a in connection.execute(select([schedules.c.rid, schedules.c.signalling_id]))} == {a["rid"]: a["signalling_id"] for a in batch.schedules}
+            assert len(connection.execute(models.DarwinAssociation.__table__.select()).fetchall()) == 2
+    finally:
+        invalidator.detach()
+    assert writer.listeners == writer.commit_listeners == []
@@ -0,0 +1,57 @@
+import datetime
+
+import board
+import darwin_time
+import models
+import snapshot
+from conftest import SSD
+
+
+def _board(session, code, start, end) -> list:
+    return [(a.rid, a.index, a.tiploc, a.wta, a.wtd, darwin_time.combine(a.wta, a.status.ta), darwin_time.combine(a.wtd, a.status.td), a.status.plat)
+        for a in board.get_board(session, code, start, end)]
+
+
+def _snapshot_board(snap, code, start, end) -> list:
+    out = []
+    for index in snap.board(code, start, end):
+        location = snap.location(index)
+        out.append((snap.schedule(location.schedule).rid, location.position, location.tiploc, snap.time_at(location.wta), snap.time_at(location.wtd),
+            snap.time_at(location.ta), snap.time_at(location.td), location.plat))
+    return out
+
+
+def _windows():
+    # Short ones whose edges fall at every minute of the ten between services at Reading, and wider ones
+    day = datetime.datetime.combine(SSD, datetime.time(0))
+    for minutes in range(8*60 + 15, 11*60 + 45, 7):
+        yield ("RDG",), day + datetime.timedelta(minutes=minutes), datetime.timedelta(minutes=5)
+    for hours, length in ((0, 24), (8, 1), (9, 2), (11, 1)):
+        yield ("PAD", "RDG", "RDNGSTN", "BRSTLTM", "DID"), day + datetime.timedelta(hours=hours), datetime.timedelta(hours=length)
+
+
+def _compare(session, path):
+    with snapshot.Snapshot(str(path)) as snap:
+        for codes, start, length in _windows():
+            for code in codes:
+                assert _snapshot_board(snap, code, start, start + length) == _board(session, code, start, start + length)
+
+
+def test_board_matches_get_board(populated, engine, tmp_path):
+    session = populated()
+    path = tmp_path / "day.snap"
+    # Dwelling at Reading, so that arrival and departure can fall either side of a window's edge
+    for location in session.query(models.DarwinScheduleLocation).filter(models.DarwinScheduleLocation.tiploc == "RDNGSTN"):
+        location.wtd = location.wta + datetime.timedelta(minutes=4)
+    session.commit()
+    with engine.connect() as connection:
+        snapshot.write(connection, SSD, str(path))
+    _compare(session, path)
+
+    # Rebuilt over the old one after changes, and opened again
+    session.query(models.DarwinScheduleStatus).filter(models.DarwinScheduleStatus.tiploc == "RDNGSTN").update({"plat": "7"})
+    session.commit()
+    with engine.connect() as connection:
+        snapshot.write(connection, SSD, str(path))
+    _compare(session, path)
+    session.close()
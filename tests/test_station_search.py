@@ -0,0 +1,134 @@
+import random
+
+import pytest
+
+import models
+import station_search
+from conftest import add_reference_data
+from reference import CachedLocation, ReferenceCache
+from station_search import StationIndex, StationSearch, normalise, trigrams
+
+
+def _location(tiploc, crs, name, category, **names):
+    fields = dict.fromkeys(CachedLocation._fields)
+    fields.update(tiploc=tiploc, crs_darwin=crs, name_short=name, name_full=name, category=category, **names)
+    return CachedLocation(**fields)
+
+
+LOCATIONS = [
+    _location("RDNGSTN", "RDG", "Reading", "A"),
+    _location("RDNGWST", "RDW", "Reading West", "B"),
+    _location("RDNG4AB", None, "Reading West Junction", None),
+    _location("GORASTR", "GOR", "Goring & Streatley", "B"),
+    _location("GORDONH", "GDH", "Gordon Hill", "A"),
+    _location("BRSTLTM", "BRI", "Bristol Temple Meads", "A", name_corpus="Bristol T.M."),
+    _location("BRSTPWY", "BPW", "Bristol Parkway", "A"),
+    _location("DIDCOTP", "DID", "Didcot Parkway", "A"),
+    _location("PADTON", "PAD", "London Paddington", "A"),
+]
+
+
+def _tiplocs(locations):
+    return [a.tiploc for a in locations]
+
+
+@pytest.mark.parametrize("query,expected", [
+    # An exact CRS first, whatever its category
+    ("gor", ["GORASTR", "GORDONH"]),
+    ("RDG", ["RDNGSTN"]),
+    # Then names starting with the query, by category then name
+    ("read", ["RDNGSTN", "RDNGWST", "RDNG4AB"]),
+    ("reading w", ["RDNGWST", "RDNG4AB"]),
+    ("bristol", ["BRSTPWY", "BRSTLTM"]),
+    ("bristol t m", ["BRSTLTM"]),
+    # Then later words of names
+    ("parkway", ["BRSTPWY", "DIDCOTP"]),
+    ("west", ["RDNGWST", "RDNG4AB"]),
+    ("pad", ["PADTON"]),
+    # Only then similar names
+    ("readng", ["RDNGSTN", "RDNGWST"]),
+    ("  ", []),
+    ("xyzzy", []),
+])
+def test_search_ranking(query, expected):
+    index = StationIndex(LOCATIONS)
+    assert _tiplocs(index.search(query)) == expected
+
+
+def test_search_options():
+    index = StationIndex(LOCATIONS)
+    assert _tiplocs(index.search("read", limit=2)) == ["RDNGSTN", "RDNGWST"]
+    assert index.search("readng", fuzzy=False) == []
+    # Similar names aren't looked for once anything has matched
+    assert _tiplocs(index.search("paddington")) == ["PADTON"]
+
+
+def _brute_force(locations, query):
+    """Tiers of search() without the index, by rank"""
+    query = normalise(query)
+    ranked = sorted(locations, key=station_search._rank)
+    tiers = [[], [], []]
+    for location in ranked:
+        codes = [getattr(location, a).lower() for a in station_search.CRS_FIELDS if getattr(location, a)]
+        names = [normalise(getattr(location, a) or "") for a in station_search.NAME_FIELDS]
+        words = codes + [" ".join(a.split(" ")[n:]) for a in names if a for n in range(1, len(a.split(" ")))]
+        if query in codes:
+            tiers[0].append(location)
+        elif any(a and a.startswith(query) for a in names):
+            tiers[1].append(location)
+        elif any(a.startswith(query) for a in words):
+            tiers[2].append(location)
+    return [a for tier in tiers for a in tier]
+
+
+def test_search_matches_brute_force():
+    rng = random.Random(1)
+    syllables = ["st", "ton", "ford", "bury", "ham", "wick", "mar", "ley", "field", "new", "port", "brid"]
+    locations = list(LOCATIONS)
+    for i in range(600):
+        name = " ".join("".join(rng.choice(syllables) for _ in range(rng.randrange(1, 4))).title() for _ in range(rng.randrange(1, 4)))
+        locations.append(_location("T{:05d}".format(i), "".join(rng.choice("ABCDEFGHJ") for _ in range(3)) if rng.random() < 0.5 else None,
+            name, rng.choice(["A", "B", "C", None])))
+    index = StationIndex(locations)
+    queries = ["st", "s", "sto", "ham", "mar ley", "bury f", "new", "a", "abc", "zz"]
+    queries += [normalise(rng.choice(locations).name_short)[:rng.randrange(1, 8)] for _ in range(50)]
+    for query in queries:
+        assert index.search(query, limit=len(locations), fuzzy=False) == _brute_force(locations, query), query
+
+
+def test_similar_matches_brute_force():
+    index = StationIndex(LOCATIONS)
+    for query in ("readng", "bristle", "goring streatly", "paddingtn", "didcot"):
+        grams = trigrams(normalise(query))
+        best = {}
+        for i, location in enumerate(index.locations):
+            for field in station_search.NAME_FIELDS:
+                name_grams = trigrams(normalise(getattr(location, field) or ""))
+                if name_grams:
+                    similarity = len(grams & name_grams) / len(grams | name_grams)
+                    if similarity >= station_search.SIMILARITY_THRESHOLD:
+                        best[i] = max(best.get(i, 0), similarity)
+        assert index.similar(normalise(query)) == sorted(best, key=lambda a: (-best[a], a))
+
+
+def test_search_before_cache_loaded(Session):
+    session = Session()
+    add_reference_data(session)
+    session.commit()
+    cache = ReferenceCache()
+    search = StationSearch(cache)
+
+    assert search.index is None
+    assert search.search("reading") == []
+    assert _tiplocs(search.search("reading", session=session)) == ["RDNGSTN"]
+
+    cache.refresh(session)
+    index = search.index
+    assert _tiplocs(search.search("rdg")) == ["RDNGSTN"]
+    assert search.index is index
+    session.add(models.DarwinLocation(tiploc="RDNGWST", crs_darwin="RDW", name_short="Reading West", name_full="Reading West", category="B"))
+    session.commit()
+    cache.refresh(session)
+    assert search.index is not index
+    assert _tiplocs(search.search("reading")) == ["RDNGSTN", "RDNGWST"]
+    session.close()
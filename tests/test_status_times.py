@@ -0,0 +1,100 @@
+import datetime
+import random
+
+from sqlalchemy.orm import sessionmaker
+
+import darwin_time
+import ingest
+import models
+import status_times
+from conftest import SSD, STATIONS, add_reference_data, schedule_batch
+
+RID = "202610160000000"
+_HOUR = 3600
+
+
+def _batch(count=300, seed=1):
+    """One schedule with count calling points, whose Darwin times land anywhere from a day before to a day after their
+    working times, many of them on the thresholds"""
+    rng = random.Random(seed)
+    batch = schedule_batch(1)
+    del batch.locations[:], batch.statuses[:], batch.associations[:]
+    midnight = datetime.datetime.combine(SSD, datetime.time(0))
+    edges = [-6*_HOUR - 1, -6*_HOUR, -6*_HOUR + 1, 0, 18*_HOUR - 1, 18*_HOUR, 18*_HOUR + 1]
+    for index in range(count):
+        tiploc = STATIONS[index % len(STATIONS)][0]
+        original_wt = "L{:03d}".format(index)
+        wt = midnight + datetime.timedelta(seconds=rng.randrange(-6*_HOUR, 30*_HOUR))
+        public = wt + datetime.timedelta(minutes=rng.choice([0, 0, 2])) if rng.random() < 0.8 else None
+        kind = rng.choice("apd")
+        location = dict(rid=RID, ssd=SSD, index=index, loc_type="IP", tiploc=tiploc, activity="T", original_wt=original_wt,
+            wta=None, wtp=None, wtd=None, pta=None, ptd=None)
+        status = dict(rid=RID, ssd=SSD, tiploc=tiploc, original_wt=original_wt, ta_delayed=False, tp_delayed=False, td_delayed=False)
+        for letter in "apd":
+            if letter == kind or rng.random() < 0.3:
+                location["wt" + letter] = wt
+                if letter != "p":
+                    location["pt" + letter] = public
+            if rng.random() < 0.8:
+                difference = rng.choice(edges) if rng.random() < 0.3 else rng.randrange(-24*_HOUR, 24*_HOUR)
+                status["t" + letter] = (wt + datetime.timedelta(seconds=difference)).time()
+        batch.locations.append(location)
+        batch.statuses.append(status)
+    return batch
+
+
+def _minutes(later, earlier):
+    return None if later is None or earlier is None else int((later - earlier).total_seconds() // 60)
+
+
+def _expected(location: dict, status: dict) -> tuple:
+    """What status_times resolves, through darwin_time.combine()"""
+    ta, tp, td = [darwin_time.combine(location["wt" + a], status.get("t" + a)) for a in "apd"]
+    # Of the latest time known
+    if status.get("td") is not None:
+        delay = _minutes(td, location["ptd"] or location["wtd"])
+    elif status.get("tp") is not None:
+        delay = _minutes(tp, location["wtp"])
+    elif status.get("ta") is not None:
+        delay = _minutes(ta, location["pta"] or location["wta"])
+    else:
+        delay = None
+    return ta, tp, td, delay
+
+
+def _check(session, batch):
+    locations = {a["original_wt"]: a for a in batch.locations}
+    statuses = session.query(models.DarwinScheduleStatus).filter(models.DarwinScheduleStatus.rid == RID).all()
+    assert len(statuses) == len(batch.statuses)
+    for status in statuses:
+        given = next(a for a in batch.statuses if a["original_wt"] == status.original_wt)
+        assert (status.ta_resolved, status.tp_resolved, status.td_resolved, status.delay_minutes) == _expected(locations[status.original_wt], given)
+
+
+def test_writer_resolves_as_darwin_time(pg_engine):
+    Session = sessionmaker(bind=pg_engine)
+    session = Session()
+    add_reference_data(session)
+    session.commit()
+    batch = _batch()
+    ingest.BulkWriter(pg_engine).write(batch)
+    _check(session, batch)
+    session.close()
+
+
+def test_orm_resolves_as_darwin_time(pg_engine):
+    Session = sessionmaker(bind=pg_engine)
+    status_times.attach(Session)
+    try:
+        session = Session()
+        add_reference_data(session)
+        batch = _batch(seed=2)
+        for field, model in ingest.BATCH_MODELS[:3]:
+            for row in getattr(batch, field):
+                session.add(model(**row))
+            session.flush()
+        session.commit()
+        _check(session, batch)
+        session.close()
+    finally:
+        status_times.detach(Session)
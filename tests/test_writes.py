@@ -0,0 +1,105 @@
+import board_rows
+import models
+import writes
+from board_rows import BoardMaintainer
+from conftest import populate
+from messages import MessageIndex
+from response_cache import Invalidator, ResponseCache
+
+
+def _message(message_id, stations, severity=1):
+    return models.DarwinMessage(message_id=message_id, category="Train", severity=severity, suppress=False, stations=stations, message="")
+
+
+def test_session_writes(Session):
+    flushes, commits = [], []
+    session_writes = writes.session_writes(Session)
+    listener, commit_listener = lambda session, written: flushes.append(written), lambda written, instances: commits.append((written, instances))
+    session_writes.subscribe(listener, commit_listener, instances=("messages",))
+    try:
+        session = Session()
+        populate(session, schedules=2)
+        assert len(commits) == 1
+        written = commits[0][0]
+        assert written["schedules"] == written["locations"] == written["statuses"] == {"202610160000000", "202610160000001"}
+        assert written["associations"] == {"202610160000000", "202610160000001"}
+        assert "messages" not in written
+        assert len(flushes) >= 2
+
+        del commits[:]
+        message = _message(1, ["RDG"])
+        session.add(message)
+        session.flush()
+        session.delete(session.query(models.DarwinScheduleStatus).first())
+        session.rollback()
+        assert commits == []
+
+        session.add(_message(1, ["RDG"]))
+        session.add(_message(2, ["PAD"]))
+        session.commit()
+        session.delete(session.get(models.DarwinMessage, 2))
+        session.commit()
+        assert [a[0] for a in commits] == [{"messages": {1, 2}}, {"messages": {2}}]
+        assert commits[1][1] == {"messages": {(2,): None}}
+        session.close()
+    finally:
+        session_writes.unsubscribe(listener, commit_listener)
+    assert Session not in writes._by_target
+
+
+def test_message_index_follows_commits(Session):
+    index = MessageIndex()
+    session = Session()
+    index.load(session)
+    index.attach(Session)
+    try:
+        session.add(_message(1, ["RDG", "PAD"], severity=2))
+        session.add(_message(2, ["RDG"]))
+        session.commit()
+        assert index.ids("RDG") == [1, 2]
+        assert index.ids("PAD", min_severity=2) == [1]
+
+        session.get(models.DarwinMessage, 1).stations = ["SWI"]
+        session.delete(session.get(models.DarwinMessage, 2))
+        session.flush()
+        assert index.ids("RDG") == [1, 2]
+        session.commit()
+        assert index.ids("RDG") == [] and index.ids("SWI") == [1]
+
+        session.add(_message(3, ["RDG"]))
+        session.flush()
+        session.rollback()
+        assert index.ids("RDG") == []
+    finally:
+        index.detach()
+        session.close()
+
+
+def test_subscribers_share_one_session_writes(Session, engine):
+    board_rows.create(engine)
+    cache = ResponseCache()
+    maintainer, invalidator = BoardMaintainer(), Invalidator(cache)
+    maintainer.attach(sessions=Session)
+    invalidator.attach(sessions=Session)
+    try:
+        assert len(writes._by_target[Session].listeners) == 2
+        session = Session()
+        populate(session, schedules=4)
+        with engine.connect() as connection:
+            assert len(connection.execute(board_rows.board_rows.select()).fetchall()) == 4*4
+
+        schedule = session.get(models.DarwinSchedule, "202610160000002")
+        cache.put(("schedule", schedule.rid, False), schedule.serialise(False))
+        schedule.signalling_id = "2B00"
+        session.flush()
+        assert len(cache) == 1
+        session.commit()
+        assert len(cache) == 0
+        with engine.connect() as connection:
+            assert {a.signalling_id for a in connection.execute(board_rows.board_rows.select().where(board_rows.board_rows.c.rid == schedule.rid))} == {"2B00"}
+        session.close()
+    finally:
+        maintainer.detach()
+        invalidator.detach()
+        board_rows.metadata.drop_all(engine)
+    assert Session not in writes._by_target
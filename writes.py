@@ -0,0 +1,147 @@
+from typing import Dict, Iterable, Optional, Set
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import DarwinSchedule, DarwinScheduleLocation, DarwinScheduleStatus, DarwinAssociation, DarwinScheduleFormation, DarwinMessage
+
+# Writes through ORM sessions, passed on in the shape ingest.BulkWriter passes on its own: the ids written of each model,
+# under the name of its ScheduleBatch field, and message ids under "messages". Whatever is maintained alongside writes
+# subscribes to a SessionWrites, so each flush's new, dirty and deleted objects are gone through once for all of it
+
+FIELDS = (
+    ("schedules", DarwinSchedule),
+    ("locations", DarwinScheduleLocation),
+    ("statuses", DarwinScheduleStatus),
+    ("associations", DarwinAssociation),
+    ("formations", DarwinScheduleFormation),
+    ("messages", DarwinMessage),
+)
+
+
+def _field(obj) -> Optional[str]:
+    for field, model in FIELDS:
+        if isinstance(obj, model):
+            return field
+    return None
+
+
+def _ids(obj) -> tuple:
+    if isinstance(obj, DarwinAssociation):
+        return obj.main_rid, obj.assoc_rid
+    if isinstance(obj, DarwinMessage):
+        return (obj.message_id,)
+    return (obj.rid,)
+
+
+def merge(written: Dict[str, Set], other: Dict[str, Set]):
+    """Add the ids of other to written"""
+    for field, ids in other.items():
+        written.setdefault(field, set()).update(ids)
+
+
+def schedule_rids(written: Dict[str, Set]) -> Set[str]:
+    """Every rid written, of whatever model"""
+    out = set()
+    for field, ids in written.items():
+        if field != "messages":
+            out |= ids
+    return out
+
+
+class SessionWrites:
+    """Writes through the sessions of target, a Session class, sessionmaker or session.
+    Listeners are called as listener(session, written) after each flush, inside its transaction, and commit listeners as
+    listener(written, instances) once the transaction has committed, with everything it wrote. instances maps the fields
+    asked for to the instances written by primary key, None for those deleted. Nothing is called for what's rolled back"""
+    def __init__(self, target):
+        self.target = target
+        self.listeners = []
+        self.commit_listeners = []
+        self.instance_fields = set()  # type: Set[str]
+        self._key = ("swallow_writes", id(self))
+        self._attached = False
+
+    def attach(self):
+        event.listen(self.target, "after_flush", self._after_flush)
+        event.listen(self.target, "after_flush_postexec", self._after_flush_postexec)
+        event.listen(self.target, "after_commit", self._after_commit)
+        event.listen(self.target, "after_soft_rollback", self._after_soft_rollback)
+        self._attached = True
+
+    def detach(self):
+        if not self._attached:
+            return
+        event.remove(self.target, "after_flush", self._after_flush)
+        event.remove(self.target, "after_flush_postexec", self._after_flush_postexec)
+        event.remove(self.target, "after_commit", self._after_commit)
+        event.remove(self.target, "after_soft_rollback", self._after_soft_rollback)
+        self._attached = False
+        if _by_target.get(self.target) is self:
+            del _by_target[self.target]
+
+    def subscribe(self, listener=None, commit_listener=None, instances: Iterable[str]=()):
+        if listener is not None:
+            self.listeners.append(listener)
+        if commit_listener is not None:
+            self.commit_listeners.append(commit_listener)
+        self.instance_fields.update(instances)
+
+    def unsubscribe(self, listener=None, commit_listener=None):
+        """Detaches once nothing is subscribed"""
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+        if commit_listener in self.commit_listeners:
+            self.commit_listeners.remove(commit_listener)
+        if not self.listeners and not self.commit_listeners:
+            self.detach()
+
+    def _after_flush(self, session: Session, flush_context):
+        flushed = {}
+        instances = {}
+        for objects, deleted in ((session.new, False), (session.dirty, False), (session.deleted, True)):
+            for obj in objects:
+                field = _field(obj)
+                if field is None:
+                    continue
+                flushed.setdefault(field, set()).update(_ids(obj))
+                if field in self.instance_fields:
+                    key = tuple(inspect(obj).mapper.primary_key_from_instance(obj))
+                    instances.setdefault(field, {})[key] = None if deleted else obj
+        if flushed:
+            state = session.info.setdefault(self._key, ({}, {}, {}))
+            merge(state[0], flushed)
+            for field, by_key in instances.items():
+                state[2].setdefault(field, {}).update(by_key)
+
+    def _after_flush_postexec(self, session: Session, flush_context):
+        state = session.info.get(self._key)
+        if state is None or not state[0]:
+            return
+        flushed = dict(state[0])
+        state[0].clear()
+        merge(state[1], flushed)
+        for listener in list(self.listeners):
+            listener(session, flushed)
+
+    def _after_commit(self, session: Session):
+        state = session.info.pop(self._key, None)
+        if state is None or not state[1]:
+            return
+        for listener in list(self.commit_listeners):
+            listener(state[1], state[2])
+
+    def _after_soft_rollback(self, session: Session, previous_transaction):
+        session.info.pop(self._key, None)
+
+
+_by_target = {}
+
+
+def session_writes(target=Session) -> SessionWrites:
+    """The SessionWrites of target, attached the first time it's asked for, and shared by everything subscribing to it"""
+    out = _by_target.get(target)
+    if out is None:
+        out = _by_target[target] = SessionWrites(target)
+        out.attach()
+    return out